@@ -4,10 +4,10 @@ import hashlib
 import os
 import secrets
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import requests
 import urllib.parse
 import time
 import socket
+import urllib3
 
 from ..constants import DEPLOYMENT_URL, OAUTH_CLIENT_ID
 from .oauth_pages import SUCCESS_HTML, ERROR_HTML
@@ -41,7 +41,9 @@ class RefreshTokenWorkflow(QThread):
         super().__init__()
         self.refresh_token = refresh_token
     def run(self):
-        api_instance = OAuthApi()
+        # Imported here, core depends on the authorization manager
+        from ..core.streaming_multipart import StreamingApiClient
+        api_instance = OAuthApi(StreamingApiClient())
         body = {
             "grant_type": "refresh_token",
             "refresh_token": self.refresh_token,
@@ -180,8 +182,13 @@ class OAuthCallbackHandler(BaseHTTPRequestHandler):
             "code_verifier": self.server.code_verifier
         }
 
-        response = requests.post(TOKEN_URL, data=data)
-        token_response = response.json()
+        # Imported here, core depends on the authorization manager
+        from ..core.http_transport import post_form
+        try:
+            token_response = post_form(TOKEN_URL, data)
+        except (ValueError, urllib3.exceptions.HTTPError):
+            self.server.error = "Token request failed"
+            return
 
         refresh_token = token_response.get("refresh_token")
         access_token = token_response.get("access_token")
@@ -1,9 +1,15 @@
 from .async_manager import AsyncManager
 from .async_result_thread import AsyncResultThread
+from .async_result_task import AsyncResultTask
 from .cartovista_api import API_CLIENT
 from .cartovista_styles import get_fill_style, get_line_style, get_marker_style
 from .helper_functions import HelperFunctions
 from .layer_upload_helper import LayerUploadHelper
 from .layer_upload_info import LayerUploadInfo, LayerUploadStatus
+from .plugin_settings import PluginSettings
 from .async_manager import ASYNC_MANAGER
-from .cv_theme_set_group_helper import generate_theme_set_group
\ No newline at end of file
+from .cv_theme_set_group_helper import generate_theme_set_group
+from .upload_pipeline import UploadPipeline, STAGE_CHECK, STAGE_EXPORT, STAGE_COMPRESS, STAGE_UPLOAD, STAGE_STYLE, STAGE_ORDER
+from .feature_sync import FeatureSync, FeatureSyncManager
+from .publish_journal import PUBLISH_JOURNAL, PublishJob, JOB_KIND_MAP, JOB_KIND_LAYER, JOB_FAILED
+from .publish_scope import PublishScope, PublishScopeError, PUBLISH_SELECTION
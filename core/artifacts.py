@@ -0,0 +1,174 @@
+"""
+Export artifacts (GeoPackages and zips) stored on disk or in GDAL's in-memory file system
+"""
+
+import io
+import os
+import threading
+import time
+
+from qgis.PyQt.QtCore import QCoreApplication
+
+from .plugin_settings import PluginSettings, MEMORY_EXPORT_CEILING
+
+# In-memory artifacts live under this GDAL /vsimem/ folder
+MEMORY_ROOT = "/vsimem/add_to_cartovista"
+
+
+def is_in_memory(path: str) -> bool:
+    return path is not None and path.startswith("/vsimem/")
+
+
+def memory_path(*parts: str) -> str:
+    return "/".join([MEMORY_ROOT] + list(parts))
+
+
+def artifact_size(path: str) -> int:
+    if is_in_memory(path):
+        from osgeo import gdal
+        stat = gdal.VSIStatL(path)
+        if stat is None:
+            raise FileNotFoundError(path)
+        return stat.size
+    return os.path.getsize(path)
+
+
+def artifact_mtime(path: str) -> float:
+    if is_in_memory(path):
+        return time.time()
+    return os.path.getmtime(path)
+
+
+def artifact_exists(path: str) -> bool:
+    if is_in_memory(path):
+        from osgeo import gdal
+        return gdal.VSIStatL(path) is not None
+    return path is not None and os.path.isfile(path)
+
+
+def open_artifact(path: str, mode: str = 'rb', buffering: int = -1):
+    if is_in_memory(path):
+        return VSIFile(path, mode)
+    return open(path, mode, buffering=buffering)
+
+
+def remove_artifact(path: str):
+    if path is None:
+        return
+    try:
+        if is_in_memory(path):
+            from osgeo import gdal
+            MEMORY_BUDGET.release(path)
+            gdal.Unlink(path)
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_geopackage(path: str):
+    """Removes a GeoPackage artifact with its SQLite journal files"""
+    if path is None:
+        return
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        remove_artifact(path + suffix)
+
+
+class MemoryBudget:
+    """
+    Bytes held by the in-memory artifacts of all the layers being published, kept under
+    MEMORY_EXPORT_CEILING. Exports and zips charge their artifacts as they grow and write
+    to disk instead when the budget can't hold them, removing an artifact frees its bytes.
+    Thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sizes = {}
+
+    def reserve(self, path: str, size: int) -> bool:
+        """Charges size bytes for path, False without charging when the budget can't hold them"""
+        with self._lock:
+            others = sum(self._sizes.values()) - self._sizes.get(path, 0)
+            if others + size > PluginSettings.int_value(MEMORY_EXPORT_CEILING):
+                return False
+            self._sizes[path] = size
+            return True
+
+    def record(self, path: str, size: int):
+        """Charges the final size of a finished artifact, even above the budget"""
+        with self._lock:
+            self._sizes[path] = size
+
+    def release(self, path: str):
+        with self._lock:
+            self._sizes.pop(path, None)
+
+    def used(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+
+class VSIFile(io.RawIOBase):
+    """Binary file object over a GDAL virtual file, usable by zipfile and the multipart body"""
+
+    def __init__(self, path: str, mode: str = 'rb'):
+        super().__init__()
+        from osgeo import gdal
+        self._gdal = gdal
+        self.path = path
+        self.mode = mode
+        self._handle = gdal.VSIFOpenL(path, mode)
+        if self._handle is None:
+            raise IOError(f"Failed to open {path}")
+
+    def readable(self):
+        return 'r' in self.mode
+
+    def writable(self):
+        return 'w' in self.mode or 'a' in self.mode or '+' in self.mode
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            position = self.tell()
+            size = self.seek(0, io.SEEK_END) - position
+            self.seek(position)
+        if size == 0:
+            return b''
+        return self._gdal.VSIFReadL(1, size, self._handle) or b''
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        data = bytes(data)
+        return self._gdal.VSIFWriteL(data, 1, len(data), self._handle)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if self._gdal.VSIFSeekL(self._handle, offset, whence) != 0:
+            raise IOError(f"Failed to seek in {self.path}")
+        return self.tell()
+
+    def tell(self):
+        return self._gdal.VSIFTellL(self._handle)
+
+    def close(self):
+        if self._handle is not None:
+            self._gdal.VSIFCloseL(self._handle)
+            self._handle = None
+        super().close()
+
+
+ # --- Singleton pattern using QCoreApplication ---
+def get_memory_budget():
+    app = QCoreApplication.instance()
+    if not hasattr(app, "_cv_plugin_memory_budget"):
+        app._cv_plugin_memory_budget = MemoryBudget()
+    return app._cv_plugin_memory_budget
+
+MEMORY_BUDGET = get_memory_budget()
@@ -1,27 +1,93 @@
-from .async_result_thread import AsyncResultThread
-from qgis.PyQt.QtCore import QCoreApplication
+import threading
+
+from .async_result_task import AsyncResultTask
+from .plugin_settings import (PluginSettings, MAX_CPU_WORKERS, MAX_NETWORK_WORKERS, API_BULK_CONCURRENCY_MAX,
+                              API_CONTROL_CONCURRENCY_MAX)
+from qgis.PyQt.QtCore import QCoreApplication, QThreadPool, QTimer
 
 class AsyncManager:
+    """
+    Runs plugin work on bounded thread pools: one for CPU and disk bound jobs
+    (geopackage export, zipping), one for network calls to the CartoVista API and one
+    for the uploads of files, so that API calls don't wait for the uploads to finish.
+    Jobs above the pool limits wait in the pool queue instead of starting a new thread.
+    Failed requests waiting to be retried don't hold a thread, they are queued again once
+    their delay is over.
+    """
 
     def __init__(self):
-        self._threads = []
+        self._signals = []
+        self._reserve_lock = threading.Lock()
+        self.cpu_pool = QThreadPool()
+        self.network_pool = QThreadPool()
+        self.bulk_pool = QThreadPool()
+        self.configure_pools()
+
+    def configure_pools(self, max_cpu_workers: int = None, max_network_workers: int = None):
+        if max_cpu_workers is None:
+            max_cpu_workers = PluginSettings.int_value(MAX_CPU_WORKERS)
+        if max_network_workers is None:
+            max_network_workers = PluginSettings.int_value(MAX_NETWORK_WORKERS)
+        self.cpu_pool.setMaxThreadCount(max(1, max_cpu_workers))
+        # Enough threads for the control budget to reach its maximum
+        self.network_pool.setMaxThreadCount(max(1, max_network_workers, PluginSettings.int_value(API_CONTROL_CONCURRENCY_MAX)))
+        # As many threads as the bulk budget can use at most
+        self.bulk_pool.setMaxThreadCount(max(1, PluginSettings.int_value(API_BULK_CONCURRENCY_MAX)))
 
     def setup_thread(self, on_success, on_error, method, *args, **kwargs):
-        thread = AsyncResultThread(method, *args, **kwargs)
+        """Runs method on the network pool"""
+        self._start(self.network_pool, on_success, on_error, method, *args, **kwargs)
+
+    def setup_bulk_thread(self, on_success, on_error, method, *args, **kwargs):
+        """Runs method on the upload pool"""
+        self._start(self.bulk_pool, on_success, on_error, method, *args, **kwargs)
+
+    def setup_cpu_thread(self, on_success, on_error, method, *args, **kwargs):
+        """Runs method on the CPU pool"""
+        self._start(self.cpu_pool, on_success, on_error, method, *args, **kwargs)
+
+    def reserve_cpu_threads(self, wanted: int) -> int:
+        """
+        Reserves up to wanted idle threads of the CPU pool for work that a CPU job spreads
+        over threads of its own, so that the pool starts fewer jobs meanwhile. Returns the
+        number of threads reserved, to pass to release_cpu_threads.
+        """
+        with self._reserve_lock:
+            count = max(0, min(wanted, self.cpu_pool.maxThreadCount() - self.cpu_pool.activeThreadCount()))
+            for _ in range(count):
+                self.cpu_pool.reserveThread()
+        return count
 
-        self._threads.append(thread)
+    def release_cpu_threads(self, count: int):
+        for _ in range(count):
+            self.cpu_pool.releaseThread()
 
-        thread.finished.connect(on_success)
-        thread.error.connect(on_error)
+    def _start(self, pool: QThreadPool, on_success, on_error, method, *args, **kwargs):
+        task = AsyncResultTask(method, *args, **kwargs)
+        signals = task.signals
+
+        # keep the signals object alive until its queued result has been delivered
+        self._signals.append(signals)
+
+        signals.finished.connect(on_success)
+        signals.error.connect(on_error)
 
         def _cleanup():
-            if thread in self._threads:
-                self._threads.remove(thread)
-            thread.deleteLater()
+            if signals in self._signals:
+                self._signals.remove(signals)
+            signals.deleteLater()
+
+        signals.finished.connect(_cleanup)
+        signals.error.connect(_cleanup)
+
+        def _retry(delay: float, attempt: int):
+            retry_task = AsyncResultTask(method, *args, **kwargs)
+            retry_task.signals = signals
+            retry_task.attempt = attempt
+            QTimer.singleShot(int(delay * 1000), lambda: pool.start(retry_task))
 
-        thread.finished.connect(_cleanup)
-        thread.error.connect(_cleanup)
-        thread.start()
+        signals.retry.connect(_retry)
+        pool.start(task)
 
 
  # --- Singleton pattern using QCoreApplication ---
@@ -0,0 +1,37 @@
+from qgis.PyQt.QtCore import QObject, QRunnable, pyqtSignal
+
+from .retry_policy import RetryScheduled, scheduled_attempt
+
+class AsyncResultSignals(QObject):
+    finished = pyqtSignal(object)
+    error = pyqtSignal(Exception)
+    # Delay in seconds and attempt of a request to run again, see RetryScheduled
+    retry = pyqtSignal(float, int)
+
+
+class AsyncResultTask(QRunnable):
+    """
+    QRunnable counterpart of AsyncResultThread, run by one of the AsyncManager pools.
+
+    QRunnable is not a QObject, so the finished/error signals live on a separate
+    AsyncResultSignals object created in the calling thread. A request to retry later is
+    reported by the retry signal, the AsyncManager starts a task for the next attempt.
+    """
+
+    def __init__(self, api_method, *args, **kwargs):
+        super().__init__()
+        self.signals = AsyncResultSignals()
+        self.api_method = api_method
+        self.args = args
+        self.kwargs = kwargs
+        self.attempt = 1
+
+    def run(self):
+        try:
+            with scheduled_attempt(self.attempt):
+                result = self.api_method(*self.args, **self.kwargs)
+            self.signals.finished.emit(result)
+        except RetryScheduled as e:
+            self.signals.retry.emit(e.delay, e.attempt)
+        except Exception as e:
+            self.signals.error.emit(e)
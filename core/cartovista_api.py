@@ -6,6 +6,8 @@ from __future__ import print_function
 from add_to_cartovista import swagger_client
 from ..authorization import AUTHORIZATION_MANAGER
 from .async_manager import ASYNC_MANAGER
+from .request_timeouts import BoundedTimeout, default_timeout
+from .streaming_multipart import StreamingApiClient
 from qgis.PyQt.QtCore import QCoreApplication
 
 class ApiClient():
@@ -23,7 +25,7 @@ class ApiClient():
         # configuration.api_key_prefix['apiKey'] = 'Bearer'
 
         # Create an instance of the API class
-        self.api_client = swagger_client.ApiClient(configuration)
+        self.api_client = StreamingApiClient(configuration)
         self.map_api = swagger_client.MapApi(self.api_client)
         self.layer_api = swagger_client.LayerApi(self.api_client)
         self.layer_settings_api = swagger_client.LayerSettingsApi(self.api_client)
@@ -32,6 +34,8 @@ class ApiClient():
         self.user_api = swagger_client.UserApi(self.api_client)
         self.data_column_api = swagger_client.DataColumnApi(self.api_client)
         self.slide_api = swagger_client.SlideApi(self.api_client)
+        self.feature_api = swagger_client.FeatureApi(self.api_client)
+        self.portal_api = swagger_client.PortalApi(self.api_client)
 
         self.tenant_url_code = None
 
@@ -40,26 +44,84 @@ class ApiClient():
 
     def _unset_internal_tenant_url_code(self):
          self.tenant_url_code = None
-    
-    def get_current_organization(self, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.organization_api.organization_get_organization)
 
-    def get_current_user(self, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.user_api.user_get_current_user, self.tenant_url_code)
+    # deadline is the Deadline of the publish making the call, if any. It is passed as the
+    # request timeout, StreamingRESTClientObject bounds the timeouts and retries with it.
+
+    def get_current_organization(self, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.organization_api.organization_get_organization, _request_timeout=deadline)
+
+    def get_current_user(self, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.user_api.user_get_current_user, self.tenant_url_code, _request_timeout=deadline)
+
+    def upload_layer_api(self, file, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_bulk_thread(on_success, on_error, self.layer_api.layer_create_layer_from_zip, self.tenant_url_code, file=file, _request_timeout=deadline)
+
+    def update_layer_from_zip_api(self, layer_identifier, file, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_bulk_thread(on_success, on_error, self.layer_api.layer_update_from_zip, layer_identifier, self.tenant_url_code, file=file, _request_timeout=deadline)
+
+    def append_to_layer_api(self, layer_identifier, file, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_bulk_thread(on_success, on_error, self.layer_api.layer_append_to_layer, layer_identifier, self.tenant_url_code, file=file, _request_timeout=deadline)
+
+    def create_layer_from_service_api(self, name, service, url, on_success, on_error, deadline=None):
+        body = swagger_client.CreateLayerFromServiceParameter(name=name, url=url, service=service)
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_create_layer_from_service, body, self.tenant_url_code, _request_timeout=deadline)
+
+    def update_layer_service_url_api(self, layer_identifier, url, on_success, on_error, deadline=None):
+        body = swagger_client.UpdateServiceUrl(new_url=url)
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_update_layer_external_service_url, body, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def synchronize_layer_api(self, layer_identifier, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_synchronize_layer, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def upload_part_api(self, file, upload_id, on_success, on_error, deadline=None):
+        kwargs = {'file': file}
+        if upload_id is not None:
+            kwargs['upload_id'] = upload_id
+        ASYNC_MANAGER.setup_bulk_thread(on_success, on_error, self.portal_api.portal_upload, self.tenant_url_code, **kwargs, _request_timeout=deadline)
 
-    def upload_layer_api(self, file, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_create_layer_from_zip, self.tenant_url_code, file=file)
+    def finalize_upload_api(self, upload_id, finalize_parameters, timeout, on_success, on_error, deadline=None):
+        """
+        Turns the upload into a layer, answers once the layer is created. timeout is the read timeout, in seconds.
+        Runs on the upload pool, the network threads stay free for the API calls while the server works.
+        """
+        ASYNC_MANAGER.setup_bulk_thread(on_success, on_error, self.portal_api.portal_finalize_synchronous, finalize_parameters, upload_id, self.tenant_url_code,
+                                   _request_timeout=BoundedTimeout((default_timeout()[0], timeout), deadline))
 
-    def get_data_column(self, layer_identifier, column_identifier, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.data_column_api.data_column_get_layer_data_column, layer_identifier, column_identifier, self.tenant_url_code)
+    def cancel_upload_api(self, upload_id, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.portal_api.portal_cancel_upload, upload_id, self.tenant_url_code, _request_timeout=deadline)
 
-    def get_map_slides(self, map_identifier, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.map_api.map_get_slides, map_identifier, self.tenant_url_code)
+    def update_layer_from_upload_api(self, layer_identifier, update_parameters, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_update_layer_from_file_description, update_parameters, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
 
-    def update_slide_themeset(self, slide_id, theme_set, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.slide_api.slide_update_slide_theme_set, theme_set, slide_id, self.tenant_url_code)
+    def get_layers(self, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_get_layers, self.tenant_url_code, _request_timeout=deadline)
 
-    def create_map_api(self, map_name, map_layer_parameters, on_success, on_error):
+    def get_layer(self, layer_identifier, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_get_layer_by_id, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def set_unique_id_column(self, layer_identifier, column_identifier, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_api.layer_set_data_column_unique_id, layer_identifier, column_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def create_update_features_api(self, layer_identifier, features, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.feature_api.feature_create_update_features_from_geo_json, features, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def update_many_values_api(self, layer_identifier, update_many_parameter, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.feature_api.feature_update_many_values, update_many_parameter, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def delete_features_api(self, layer_identifier, feature_identifiers, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.feature_api.feature_delete_features, feature_identifiers, layer_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def get_data_column(self, layer_identifier, column_identifier, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.data_column_api.data_column_get_layer_data_column, layer_identifier, column_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def get_map_slides(self, map_identifier, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.map_api.map_get_slides, map_identifier, self.tenant_url_code, _request_timeout=deadline)
+
+    def update_slide_themeset(self, slide_id, theme_set, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.slide_api.slide_update_slide_theme_set, theme_set, slide_id, self.tenant_url_code, _request_timeout=deadline)
+
+    def create_map_api(self, map_name, map_layer_parameters, on_success, on_error, deadline=None):
         body = {
             "title": "",
             "description": "",
@@ -82,22 +144,29 @@ class ApiClient():
         body["title"] = map_name
         body["layers"] = map_layer_parameters
 
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.map_api.map_create_map, body, self.tenant_url_code)
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.map_api.map_create_map, body, self.tenant_url_code, _request_timeout=deadline)
+
+    def add_layers_to_map_api(self, map_id, map_layer_parameters, on_success, on_error, deadline=None):
+        body = {"layers": map_layer_parameters}
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.map_api.map_add_layers_to_map, body, map_id, self.tenant_url_code, _request_timeout=deadline)
+
+    def get_map(self, map_id, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.map_api.map_get_map, map_id, self.tenant_url_code, _request_timeout=deadline)
 
-    def get_layer_default_settings(self, layer_id, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_get_default_layer_settings, layer_id, self.tenant_url_code)
+    def get_layer_default_settings(self, layer_id, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_get_default_layer_settings, layer_id, self.tenant_url_code, _request_timeout=deadline)
 
-    def update_point_geometry_style(self, layer_settings_id, geometry_style, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_point_geometry_style, geometry_style, layer_settings_id, self.tenant_url_code)
+    def update_point_geometry_style(self, layer_settings_id, geometry_style, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_point_geometry_style, geometry_style, layer_settings_id, self.tenant_url_code, _request_timeout=deadline)
 
-    def update_polyline_geometry_style(self, layer_settings_id, geometry_style, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_polyline_geometry_style, geometry_style, layer_settings_id, self.tenant_url_code)
+    def update_polyline_geometry_style(self, layer_settings_id, geometry_style, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_polyline_geometry_style, geometry_style, layer_settings_id, self.tenant_url_code, _request_timeout=deadline)
 
-    def update_polygon_geometry_style(self, layer_settings_id, geometry_style, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_polygon_geometry_style, geometry_style, layer_settings_id, self.tenant_url_code)
+    def update_polygon_geometry_style(self, layer_settings_id, geometry_style, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_polygon_geometry_style, geometry_style, layer_settings_id, self.tenant_url_code, _request_timeout=deadline)
 
-    def update_common_layer_settings(self, layer_settings_id, common_settings, on_success, on_error):
-        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_common_settings, common_settings, layer_settings_id, self.tenant_url_code)
+    def update_common_layer_settings(self, layer_settings_id, common_settings, on_success, on_error, deadline=None):
+        ASYNC_MANAGER.setup_thread(on_success, on_error, self.layer_settings_api.layer_settings_update_common_settings, common_settings, layer_settings_id, self.tenant_url_code, _request_timeout=deadline)
 
     def _set_bearer_token(self):
         self.api_client.configuration.api_key['Authorization'] = AUTHORIZATION_MANAGER.access_token
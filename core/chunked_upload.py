@@ -0,0 +1,210 @@
+"""
+Zip uploads split in parts through the CartoVista portal upload flow, for large layers
+on unreliable connections
+"""
+
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from qgis.PyQt.QtCore import QObject, QTimer, pyqtSignal
+from qgis.core import Qgis, QgsMessageLog
+
+from add_to_cartovista.swagger_client.models.finalize_upload_parameters import FinalizeUploadParameters
+from add_to_cartovista.swagger_client.models.layer import Layer
+from add_to_cartovista.swagger_client.models.update_layer_from_file_parameter import UpdateLayerFromFileParameter
+
+from .artifacts import artifact_size
+from .cartovista_api import API_CLIENT
+from .compression_policy import UploadBandwidth
+from .plugin_settings import PluginSettings, UPLOAD_PART_SIZE, UPLOAD_PART_RETRIES, UPLOAD_RETRY_DELAY, FINALIZE_TIMEOUT
+from .request_timeouts import Deadline
+from .retry_policy import UPDATE_REJECTED_STATUSES, never_received
+from .streaming_multipart import MultipartFile
+
+
+class ChunkedUploadError(Exception):
+    pass
+
+
+class ChunkedUpload(QObject):
+    """
+    Sends a zip to the portal upload endpoint one part at a time under a single upload id,
+    then turns the upload into a layer: a new layer is finalized by a request answering once
+    the server created it, then looked up by name among the layers that did not exist before.
+    Uploads creating layers of the same name finalize one after the other, so that each one
+    finds its own layer. An existing layer is updated from the upload.
+
+    A part that the server never received, because it refused it or the connection could not
+    be opened, is sent again after an exponential backoff, longer than the retries of the
+    REST client. Other failures stop the upload: the part may have been stored. A stopped
+    upload keeps its upload id and the index of the next part, so that resume() continues
+    from the last part acknowledged by the server.
+    """
+    part_uploaded = pyqtSignal(int, int)
+    finished = pyqtSignal(Layer)
+    failed = pyqtSignal(Exception)
+
+    # Names of the layers being created, with the uploads waiting to create a layer of the
+    # same name. Main thread only
+    _finalizing: Dict[str, deque] = {}
+
+    def __init__(self, zip_path: str, name: str, cv_id: Optional[str] = None, zip_token: Optional[str] = None,
+                 upload_id: Optional[str] = None, next_part: int = 0, part_size: Optional[int] = None,
+                 deadline: Optional[Deadline] = None):
+        super().__init__()
+        self.zip_path = zip_path
+        # Identifies the zip content, a zip written again at the same path can't be resumed
+        self.zip_token = zip_token
+        self.name = name
+        self.cv_id = cv_id
+        # Deadline of the publish, the cancellation is sent even when it expired
+        self.deadline = deadline
+        self.upload_id = upload_id
+        self.next_part = next_part
+        self.part_size = part_size or PluginSettings.int_value(UPLOAD_PART_SIZE)
+        self.size = artifact_size(zip_path)
+        self.part_count = max(1, math.ceil(self.size / self.part_size))
+        self.max_retries = PluginSettings.int_value(UPLOAD_PART_RETRIES)
+        self.retry_delay = PluginSettings.float_value(UPLOAD_RETRY_DELAY)
+        self._attempt = 0
+        self._part_started = None
+        self._known_layer_ids = set()
+        self._holds_name = False
+        self._cancelled = False
+
+    def state(self) -> dict:
+        """What resuming the upload needs, in a JSON serializable form"""
+        return {
+            "zip_path": self.zip_path,
+            "zip_token": self.zip_token,
+            "upload_id": self.upload_id,
+            "next_part": self.next_part,
+            "part_size": self.part_size,
+        }
+
+    def start(self):
+        self._cancelled = False
+        self._attempt = 0
+        self._send_next_part()
+
+    def resume(self):
+        self.start()
+
+    def cancel(self):
+        self._cancelled = True
+        waiting = ChunkedUpload._finalizing.get(self.name)
+        if waiting is not None and self in waiting:
+            waiting.remove(self)
+        # A finalization in progress keeps the name until it answers, the layer may still be created
+        if self.upload_id is not None:
+            API_CLIENT.cancel_upload_api(self.upload_id, lambda _: None, lambda _: None)
+
+    # --- Parts ---
+
+    def _part(self, index: int) -> MultipartFile:
+        offset = index * self.part_size
+        length = min(self.part_size, self.size - offset)
+        return MultipartFile(self.zip_path, offset=offset, length=length)
+
+    def _send_next_part(self):
+        if self._cancelled:
+            return
+        if self.next_part >= self.part_count:
+            self._finalize()
+            return
+        self._part_started = time.monotonic()
+        API_CLIENT.upload_part_api(self._part(self.next_part), self.upload_id, self._on_part_uploaded, self._on_part_error,
+                                   deadline=self.deadline)
+
+    def _on_part_uploaded(self, upload_id: str):
+        UploadBandwidth.record(self._part(self.next_part).size(), time.monotonic() - self._part_started)
+        if self.upload_id is None:
+            self.upload_id = upload_id
+        self.next_part += 1
+        self._attempt = 0
+        self.part_uploaded.emit(self.next_part, self.part_count)
+        self._send_next_part()
+
+    def _on_part_error(self, e):
+        if self._cancelled or not never_received(getattr(e, 'status', None), e) or self._attempt >= self.max_retries:
+            self._fail(ChunkedUploadError(f"Part {self.next_part + 1}/{self.part_count} of {self.name} failed: {e}"))
+            return
+        delay = self.retry_delay * (2 ** self._attempt)
+        self._attempt += 1
+        QgsMessageLog.logMessage(
+            f"{self.name}: part {self.next_part + 1}/{self.part_count} failed ({e}), retry {self._attempt} in {delay:.0f}s",
+            'CartoVista', Qgis.MessageLevel.Warning)
+        QTimer.singleShot(int(delay * 1000), self._send_next_part)
+
+    # --- Finalization ---
+
+    def _finalize(self):
+        if self.cv_id is not None:
+            parameters = UpdateLayerFromFileParameter(upload_id=self.upload_id, is_append=False)
+            API_CLIENT.update_layer_from_upload_api(self.cv_id, parameters, self._on_finished, self._on_update_error,
+                                                    deadline=self.deadline)
+            return
+        if self._cancelled:
+            self._release_name()
+            return
+        if not self._holds_name:
+            if self.name in ChunkedUpload._finalizing:
+                ChunkedUpload._finalizing[self.name].append(self)
+                return
+            ChunkedUpload._finalizing[self.name] = deque()
+            self._holds_name = True
+        # Remember the existing layers, the new one is the layer with our name that is not among them
+        API_CLIENT.get_layers(self._on_known_layers, self._fail, deadline=self.deadline)
+
+    def _release_name(self):
+        """Lets the next upload waiting for the name finalize"""
+        if not self._holds_name:
+            return
+        self._holds_name = False
+        waiting = ChunkedUpload._finalizing.pop(self.name)
+        if waiting:
+            upload = waiting.popleft()
+            ChunkedUpload._finalizing[self.name] = waiting
+            upload._holds_name = True
+            upload._finalize()
+
+    def _on_update_error(self, e):
+        if getattr(e, 'status', None) not in UPDATE_REJECTED_STATUSES:
+            self._fail(e)
+            return
+        # The layer was deleted on CartoVista or can't take the upload, create a new one from the same upload
+        self.cv_id = None
+        self._finalize()
+
+    def _on_known_layers(self, layers: List[Layer]):
+        if self._cancelled:
+            self._release_name()
+            return
+        self._known_layer_ids = {layer.system_identifier for layer in layers or []}
+        parameters = FinalizeUploadParameters(name=self.name, is_layer=True)
+        API_CLIENT.finalize_upload_api(self.upload_id, parameters, PluginSettings.float_value(FINALIZE_TIMEOUT),
+                                       self._on_finalized, self._fail, deadline=self.deadline)
+
+    def _on_finalized(self, _):
+        if self._cancelled:
+            self._release_name()
+            return
+        API_CLIENT.get_layers(self._on_finalized_layers, self._fail, deadline=self.deadline)
+
+    def _on_finalized_layers(self, layers: List[Layer]):
+        for layer in layers or []:
+            if layer.name == self.name and layer.system_identifier not in self._known_layer_ids:
+                self._on_finished(layer)
+                return
+        self._fail(ChunkedUploadError(f"{self.name} was uploaded but the created layer was not found"))
+
+    def _on_finished(self, layer: Layer):
+        self._release_name()
+        self.finished.emit(layer)
+
+    def _fail(self, e):
+        self._release_name()
+        QgsMessageLog.logMessage(f"{self.name}: chunked upload failed: {e}", 'CartoVista', Qgis.MessageLevel.Warning)
+        self.failed.emit(e if isinstance(e, Exception) else ChunkedUploadError(str(e)))
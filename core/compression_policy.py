@@ -0,0 +1,101 @@
+"""
+Choice of the zip compression of a layer from its compressibility and the upload bandwidth
+"""
+
+import os
+import time
+import zlib
+
+from qgis.core import Qgis, QgsMessageLog
+
+from .artifacts import artifact_size, open_artifact
+from .plugin_settings import (PluginSettings, COMPRESSION_POLICY, ZIP_COMPRESSION_LEVEL, COMPRESSION_FAST_LEVEL,
+                              COMPRESSION_STRONG_LEVEL, UPLOAD_BANDWIDTH, PARALLEL_ZIP_MIN_SIZE, ZIP_WORKERS)
+
+POLICY_AUTO = "auto"
+POLICY_FIXED = "fixed"
+
+# Level 0 means ZIP_STORED
+LEVEL_STORED = 0
+
+SAMPLE_COUNT = 8
+SAMPLE_SIZE = 256 * 1024
+
+# Weight of the latest measure in the bandwidth estimate
+BANDWIDTH_SMOOTHING = 0.3
+
+
+class UploadBandwidth:
+    """Moving average of the measured upload throughput in bytes per second, kept across sessions"""
+
+    @staticmethod
+    def estimate() -> float:
+        return PluginSettings.float_value(UPLOAD_BANDWIDTH)
+
+    @staticmethod
+    def record(size: int, seconds: float):
+        if size <= 0 or seconds <= 0:
+            return
+        measured = size / seconds
+        estimate = UploadBandwidth.estimate()
+        PluginSettings.set_value(UPLOAD_BANDWIDTH, BANDWIDTH_SMOOTHING * measured + (1 - BANDWIDTH_SMOOTHING) * estimate)
+
+
+def sample_file(path: str, size: int):
+    """Evenly spaced blocks of the file, GeoPackage pages vary a lot along the file"""
+    if size <= SAMPLE_COUNT * SAMPLE_SIZE:
+        with open_artifact(path) as f:
+            return [f.read()]
+    step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    samples = []
+    with open_artifact(path) as f:
+        for index in range(SAMPLE_COUNT):
+            f.seek(index * step)
+            samples.append(f.read(SAMPLE_SIZE))
+    return samples
+
+
+def measure_level(samples, level: int):
+    """Compressed size ratio and compression speed in bytes per second of the samples at level"""
+    sample_size = sum(len(sample) for sample in samples)
+    started = time.perf_counter()
+    compressed_size = 0
+    for sample in samples:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed_size += len(compressor.compress(sample)) + len(compressor.flush())
+    seconds = max(time.perf_counter() - started, 1e-6)
+    return compressed_size / max(sample_size, 1), sample_size / seconds
+
+
+def choose_compression_level(path: str, layer_name: str = None, workers: int = None) -> int:
+    """
+    Zip compression level for the file: LEVEL_STORED, the fast or the strong deflate level,
+    whichever minimizes the estimated compression time plus upload time. workers is the number
+    of threads compressing large files, ZIP_WORKERS by default.
+    The decision and its inputs are logged.
+    """
+    if PluginSettings.value(COMPRESSION_POLICY) != POLICY_AUTO:
+        return PluginSettings.int_value(ZIP_COMPRESSION_LEVEL)
+
+    size = artifact_size(path)
+    bandwidth = UploadBandwidth.estimate()
+    samples = sample_file(path, size)
+    if size < PluginSettings.int_value(PARALLEL_ZIP_MIN_SIZE):
+        workers = 1
+    elif workers is None:
+        workers = PluginSettings.int_value(ZIP_WORKERS)
+
+    estimates = {LEVEL_STORED: (1.0, 0.0, size / bandwidth)}
+    for level in {PluginSettings.int_value(COMPRESSION_FAST_LEVEL), PluginSettings.int_value(COMPRESSION_STRONG_LEVEL)}:
+        ratio, speed = measure_level(samples, level)
+        estimates[level] = (ratio, size / (speed * workers), size * ratio / bandwidth)
+
+    level = min(estimates, key=lambda l: estimates[l][1] + estimates[l][2])
+    details = ", ".join(
+        f"level {l}: ratio {ratio:.2f}, compress {compress:.1f}s + upload {upload:.1f}s"
+        for l, (ratio, compress, upload) in sorted(estimates.items()))
+    QgsMessageLog.logMessage(
+        f"{layer_name or os.path.basename(path)}: {size / 1024 / 1024:.1f} MB, bandwidth {bandwidth / 1024 / 1024:.2f} MB/s, "
+        f"{workers} threads, chose level {level} ({details})",
+        'CartoVista', Qgis.MessageLevel.Info)
+    return level
@@ -0,0 +1,115 @@
+"""
+Adaptive limits of the concurrent requests to CartoVista, with separate budgets for the
+bulk uploads and the small control calls so that styling calls never wait for an upload
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+from qgis.PyQt.QtCore import QCoreApplication
+
+from .plugin_settings import (PluginSettings, API_BULK_CONCURRENCY, API_BULK_CONCURRENCY_MAX,
+                              API_CONTROL_CONCURRENCY, API_CONTROL_CONCURRENCY_MAX)
+from .transport_metrics import TRANSPORT_METRICS
+
+# Latency above the baseline times this factor counts as congestion
+LATENCY_TOLERANCE = 2.0
+# Weight of a new sample in the latency average
+LATENCY_SMOOTHING = 0.3
+# Growth of the baseline on each sample, so that it follows a slower server
+BASELINE_DRIFT = 1.01
+# Decreases closer than this are caused by the same congestion
+DECREASE_INTERVAL = 1.0
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit of concurrent requests. Each request finishing while the limit is in use
+    adds 1/limit, that is one request per round of requests, as long as the latency stays
+    close to its baseline. Throttling (429), server errors and rising latency halve it.
+    Latencies are per MB for bulk requests, passed by the caller. Endpoints answer in very
+    different times, each endpoint class has its own latency average and baseline.
+    """
+
+    def __init__(self, name: str, initial: int, maximum: int):
+        self.name = name
+        self.maximum = max(1, maximum)
+        self.limit = float(min(max(1, initial), self.maximum))
+        self.in_flight = 0
+        # By endpoint class
+        self._latencies = {}
+        self._baselines = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Waits for a free slot. Network threads only."""
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                TRANSPORT_METRICS.add(f"{self.name}_waits")
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float = None, congested: bool = False, endpoint: str = None):
+        """
+        Frees the slot. latency is None when the request failed without a response, endpoint
+        is the endpoint_class of the request.
+        """
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if latency is not None and not congested:
+                congested = self._latency_rising(endpoint, latency)
+            if congested:
+                self._decrease()
+            elif latency is not None and saturated and self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _latency_rising(self, endpoint: str, latency: float) -> bool:
+        average = self._latencies.get(endpoint)
+        average = latency if average is None else LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * average
+        baseline = self._baselines.get(endpoint)
+        baseline = average if baseline is None else min(baseline * BASELINE_DRIFT, average)
+        self._latencies[endpoint] = average
+        self._baselines[endpoint] = baseline
+        return average > baseline * LATENCY_TOLERANCE
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(1.0, self.limit / 2)
+        TRANSPORT_METRICS.add(f"{self.name}_limit_decreases")
+
+
+def endpoint_class(method: str, url: str) -> str:
+    """Method and path of the request without the segments holding identifiers, which contain digits"""
+    segments = [segment for segment in urlparse(url).path.split("/") if segment and not any(c.isdigit() for c in segment)]
+    return f"{method.upper()} /{'/'.join(segments)}"
+
+
+class ConcurrencyLimiters:
+    """The bulk and control budgets"""
+
+    def __init__(self):
+        self.bulk = AdaptiveLimiter("bulk", PluginSettings.int_value(API_BULK_CONCURRENCY),
+                                    PluginSettings.int_value(API_BULK_CONCURRENCY_MAX))
+        self.control = AdaptiveLimiter("control", PluginSettings.int_value(API_CONTROL_CONCURRENCY),
+                                       PluginSettings.int_value(API_CONTROL_CONCURRENCY_MAX))
+
+    def limits(self) -> dict:
+        return {"bulk": self.bulk.limit, "control": self.control.limit}
+
+
+ # --- Singleton pattern using QCoreApplication ---
+def get_concurrency_limiters():
+    app = QCoreApplication.instance()
+    if not hasattr(app, "_cv_plugin_concurrency_limiters"):
+        app._cv_plugin_concurrency_limiters = ConcurrencyLimiters()
+    return app._cv_plugin_concurrency_limiters
+
+CONCURRENCY_LIMITERS = get_concurrency_limiters()
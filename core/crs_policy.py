@@ -0,0 +1,83 @@
+"""
+Choice of the CRS a layer is uploaded in: reprojected to EPSG:4326 on the client, or in
+its own CRS for CartoVista to reproject, from the measured cost of the reprojection
+"""
+
+import time
+
+from qgis.core import (Qgis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException,
+                       QgsFeatureRequest, QgsMessageLog, QgsUnitTypes)
+
+from .plugin_settings import PluginSettings, UPLOAD_CRS_MODE, NATIVE_CRS_MIN_SECONDS
+
+CRS_MODE_REPROJECT = "reproject"
+CRS_MODE_NATIVE = "native"
+CRS_MODE_AUTO = "auto"
+
+# Features reprojected to measure the cost per vertex
+BENCHMARK_FEATURES = 500
+
+
+def crs_mode() -> str:
+    mode = PluginSettings.value(UPLOAD_CRS_MODE)
+    return mode if mode in (CRS_MODE_REPROJECT, CRS_MODE_NATIVE, CRS_MODE_AUTO) else CRS_MODE_REPROJECT
+
+
+def can_upload_native(crs: QgsCoordinateReferenceSystem) -> bool:
+    """CartoVista can only reproject from a CRS it can identify"""
+    return crs.isValid() and bool(crs.authid()) and crs.authid().startswith("EPSG:")
+
+
+def reprojection_benchmark(feature_source, transform: QgsCoordinateTransform):
+    """Seconds per vertex to reproject a sample of the features, and their average vertex count"""
+    request = QgsFeatureRequest().setNoAttributes().setLimit(BENCHMARK_FEATURES)
+    vertices = 0
+    features = 0
+    seconds = 0.0
+    for feature in feature_source.getFeatures(request):
+        if not feature.hasGeometry():
+            continue
+        geometry = feature.geometry()
+        started = time.perf_counter()
+        try:
+            geometry.transform(transform)
+        except QgsCsException:
+            pass
+        seconds += time.perf_counter() - started
+        vertices += geometry.constGet().nCoordinates()
+        features += 1
+    if not vertices:
+        return 0.0, 0.0
+    return seconds / vertices, vertices / features
+
+
+def choose_upload_crs(layer_upload_info, upload_crs: QgsCoordinateReferenceSystem) -> QgsCoordinateReferenceSystem:
+    """
+    upload_crs, or the layer CRS when the upload CRS mode is native, or when it is auto and
+    reprojecting the whole layer is estimated to take at least NATIVE_CRS_MIN_SECONDS.
+    The decision and its inputs are logged. Safe to call from a worker thread.
+    """
+    mode = layer_upload_info.export_settings.get("crs_mode", CRS_MODE_REPROJECT)
+    crs = layer_upload_info.crs
+    if mode == CRS_MODE_REPROJECT or crs == upload_crs or not can_upload_native(crs):
+        return upload_crs
+    if mode == CRS_MODE_NATIVE:
+        return crs
+
+    transform = QgsCoordinateTransform(crs, upload_crs, layer_upload_info.transform_context)
+    per_vertex, vertices_per_feature = reprojection_benchmark(layer_upload_info.feature_source, transform)
+    estimate = per_vertex * vertices_per_feature * max(layer_upload_info.feature_count, 0)
+    native = estimate >= PluginSettings.float_value(NATIVE_CRS_MIN_SECONDS)
+    QgsMessageLog.logMessage(
+        f"{layer_upload_info.layer_name}: reprojecting {layer_upload_info.feature_count} features from {crs.authid()} "
+        f"estimated at {estimate:.1f}s ({per_vertex * 1e6:.2f}µs per vertex, {vertices_per_feature:.0f} vertices per feature), "
+        f"uploading in {crs.authid() if native else upload_crs.authid()}",
+        'CartoVista', Qgis.MessageLevel.Info)
+    return crs if native else upload_crs
+
+
+def degrees_to_crs_units(value: float, crs: QgsCoordinateReferenceSystem) -> float:
+    """Approximate length in the CRS units of a length in degrees, for tolerances"""
+    if crs.isGeographic():
+        return value
+    return value * QgsUnitTypes.fromUnitToUnitFactor(Qgis.DistanceUnit.Degrees, crs.mapUnits())
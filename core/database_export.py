@@ -0,0 +1,168 @@
+"""
+Exports of PostGIS and GeoPackage layers by GDAL, with the reprojection, the filters and the
+column selection pushed down to the database instead of reading features through QGIS
+"""
+
+from typing import Optional
+
+from qgis.core import QgsDataSourceUri, QgsFields, QgsProviderRegistry, QgsVectorLayer, QgsWkbTypes
+
+from .artifacts import MEMORY_BUDGET, artifact_exists, artifact_size, is_in_memory, remove_artifact
+from .plugin_settings import PluginSettings, DATABASE_PUSHDOWN
+from .publish_scope import PUBLISH_ALL, PUBLISH_EXTENT
+from .writer_profile import dataset_options, layer_options, upload_profile
+
+UPLOAD_SRID = 4326
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _has_only_provider_fields(layer: QgsVectorLayer) -> bool:
+    fields = layer.fields()
+    return all(fields.fieldOrigin(index) == QgsFields.OriginProvider for index in range(fields.count()))
+
+
+def pushdown_source(layer: QgsVectorLayer, settings: dict) -> Optional[dict]:
+    """
+    What GDAL needs to export the layer straight from its database, or None when the layer
+    is not a PostGIS table or a GeoPackage layer, has joins or expression fields, or is
+    limited to a selection or a QGIS expression, which the database can't evaluate.
+    Main thread only.
+    """
+    if not PluginSettings.bool_value(DATABASE_PUSHDOWN) or layer.isModified() or layer.vectorJoins():
+        return None
+    if not _has_only_provider_fields(layer) or settings.get("scope", PUBLISH_ALL) not in (PUBLISH_ALL, PUBLISH_EXTENT):
+        return None
+    output_type = QgsWkbTypes.displayString(
+        QgsWkbTypes.multiType(QgsWkbTypes.dropM(QgsWkbTypes.dropZ(layer.wkbType())))).upper()
+    source = {
+        "fields": settings.get("fields") if settings.get("fields") is not None else layer.fields().names(),
+        "extent": settings.get("scope_filter") if settings.get("scope") == PUBLISH_EXTENT else None,
+        "geometry_type": output_type,
+    }
+    if layer.providerType() == "postgres":
+        return _postgis_source(layer, settings, source)
+    if layer.providerType() == "ogr" and layer.dataProvider().storageType() == "GPKG":
+        return _geopackage_source(layer, settings, source)
+    return None
+
+
+def _postgis_source(layer: QgsVectorLayer, settings: dict, source: dict) -> Optional[dict]:
+    uri = QgsDataSourceUri(layer.source())
+    srid = layer.crs().postgisSrid()
+    if not uri.table() or not uri.geometryColumn() or not srid:
+        return None
+    geometry = _quote(uri.geometryColumn())
+    # Query layers have a subquery as table
+    table = f"{uri.table()} AS source" if uri.table().startswith("(") else \
+        (f"{_quote(uri.schema())}." if uri.schema() else "") + _quote(uri.table())
+
+    expression = geometry if srid == UPLOAD_SRID else f"ST_Transform({geometry}, {UPLOAD_SRID})"
+    expression = f"ST_Force2D({expression})"
+    if settings.get("simplify_tolerance"):
+        expression = f"ST_SimplifyPreserveTopology({expression}, {settings['simplify_tolerance']!r})"
+    if settings.get("precision"):
+        expression = f"ST_SnapToGrid({expression}, {settings['precision']!r})"
+    expression = f"ST_Multi({expression})"
+
+    conditions = []
+    if uri.sql():
+        conditions.append(f"({uri.sql()})")
+    if source["extent"]:
+        conditions.append(f"{geometry} && ST_MakeEnvelope({', '.join(repr(value) for value in source['extent'])}, {srid})")
+    columns = [_quote(name) for name in source["fields"] if name != uri.geometryColumn()]
+    sql = f"SELECT {', '.join(columns + [f'{expression} AS {geometry}'])} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+
+    source.update({
+        "connection": "PG:" + uri.connectionInfo(True),
+        "sql": sql,
+    })
+    return source
+
+
+def _geopackage_source(layer: QgsVectorLayer, settings: dict, source: dict) -> Optional[dict]:
+    decoded = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source())
+    subset = layer.subsetString()
+    # GDAL reduces geometries in the source CRS, the settings are in degrees
+    if settings.get("precision") or settings.get("simplify_tolerance") or subset.lstrip().upper().startswith("SELECT"):
+        return None
+    if not decoded.get("path"):
+        return None
+    source.update({
+        "connection": decoded["path"],
+        "layer": decoded.get("layerName") or None,
+        "where": subset or None,
+    })
+    return source
+
+
+class DatabaseExporter:
+    """
+    Runs gdal.VectorTranslate from the pushdown_source to a GeoPackage. Same interface as
+    GeopackageExporter.export, so it can replace it in the export stage.
+    """
+
+    def __init__(self, layer_upload_info):
+        self.layer_upload_info = layer_upload_info
+        self.source = layer_upload_info.pushdown_source
+
+    def translate_options(self, callback):
+        from osgeo import gdal
+        source = self.source
+        options = {
+            "format": "GPKG",
+            "layerName": self.layer_upload_info.layer_name,
+            "geometryType": source["geometry_type"],
+            "dim": "XY",
+            "datasetCreationOptions": dataset_options(),
+            "layerCreationOptions": layer_options(),
+            "callback": callback,
+        }
+        if "sql" in source:
+            # The query already returns the upload CRS, only label the output with it
+            options.update(SQLStatement=source["sql"], dstSRS=f"EPSG:{UPLOAD_SRID}", reproject=False)
+        else:
+            options.update(selectFields=source["fields"], where=source["where"], dstSRS=f"EPSG:{UPLOAD_SRID}")
+            if source["layer"]:
+                options["layers"] = [source["layer"]]
+            if source["extent"]:
+                options["spatFilter"] = source["extent"]
+        return gdal.VectorTranslateOptions(**options)
+
+    def export(self, file_path: str):
+        from osgeo import gdal
+        from .geopackage_exporter import ExportSizeExceeded, GeopackageExportError
+
+        exceeded = []
+
+        def callback(_complete, _message, _data):
+            if is_in_memory(file_path):
+                try:
+                    if not MEMORY_BUDGET.reserve(file_path, artifact_size(file_path)):
+                        exceeded.append(True)
+                        return 0
+                except FileNotFoundError:
+                    pass
+            return 1
+
+        name = self.layer_upload_info.layer_name
+        # GDAL would add the layer to a geopackage left by a failed export
+        if artifact_exists(file_path):
+            remove_artifact(file_path)
+        with gdal.ExceptionMgr(useExceptions=True), upload_profile():
+            try:
+                dataset = gdal.VectorTranslate(file_path, self.source["connection"], options=self.translate_options(callback))
+            except RuntimeError as e:
+                if exceeded:
+                    raise ExportSizeExceeded(f"{name} does not fit in the memory left for exports")
+                raise GeopackageExportError(f"Failed to export {name} from its database: {e}")
+        if dataset is None:
+            if exceeded:
+                raise ExportSizeExceeded(f"{name} does not fit in the memory left for exports")
+            raise GeopackageExportError(f"Failed to export {name} from its database: {gdal.GetLastErrorMsg()}")
+        # Closes the dataset, writing the GeoPackage
+        dataset = None
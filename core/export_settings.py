@@ -0,0 +1,21 @@
+"""
+Per-layer settings that change the exported GeoPackage, read on the main thread and
+part of the layer fingerprint so that changing them publishes the layer again
+"""
+
+from typing import Optional
+
+from qgis.core import QgsVectorLayer
+
+from .crs_policy import crs_mode
+from .geometry_reduction import reduction_settings
+from .publish_scope import PublishScope
+from .upload_schema import schema_settings
+
+
+def export_settings(layer: QgsVectorLayer, scope: Optional[PublishScope] = None) -> dict:
+    settings = {"crs_mode": crs_mode()}
+    settings.update((scope or PublishScope()).layer_settings(layer))
+    settings.update(reduction_settings(layer))
+    settings.update(schema_settings(layer))
+    return settings
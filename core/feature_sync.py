@@ -0,0 +1,507 @@
+"""
+Incremental sync of the committed edits of published layers, feature by feature,
+instead of a full re-upload of the layer
+"""
+
+import json
+import time
+from collections import deque
+from functools import partial
+from typing import Dict, List, Optional, Set
+
+from qgis.PyQt.QtCore import QObject, QByteArray, QDate, QDateTime, QTime, QVariant, Qt, pyqtSignal
+from qgis.core import (Qgis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCoordinateTransformContext,
+                       QgsFeatureRequest, QgsMessageLog, QgsProject, QgsVectorLayer, QgsVectorLayerFeatureSource)
+
+from add_to_cartovista.swagger_client.models.data_row_update_many_parameter import DataRowUpdateManyParameter
+from add_to_cartovista.swagger_client.models.feature_geo_json_create_parameter import FeatureGeoJSONCreateParameter
+from add_to_cartovista.swagger_client.models.feature_type import FeatureType
+
+from .async_manager import ASYNC_MANAGER
+from .cartovista_api import API_CLIENT
+from .geopackage_exporter import UPLOAD_CRS, prepare_upload_geometry
+from .layer_fingerprint import PublishRegistry, layer_fingerprint
+from .plugin_settings import (PluginSettings, SYNC_BATCH_BYTES, SYNC_MIN_BATCH_BYTES,
+                              SYNC_MAX_BATCH_BYTES, SYNC_TARGET_SECONDS)
+from .upload_schema import upload_field_names
+
+# Layer custom property holding the edits not sent yet, saved with the project
+PENDING_CHANGES_PROPERTY = "add_to_cartovista/pending_changes"
+
+SYNC_DELETE = "delete"
+SYNC_VALUES = "values"
+SYNC_UPSERT = "upsert"
+
+
+def sync_key_problem(layer: QgsVectorLayer) -> Optional[str]:
+    """Why the layer has no field identifying its features on CartoVista, None when it has one"""
+    primary_keys = layer.primaryKeyAttributes()
+    if len(primary_keys) != 1:
+        return "the layer has no single column primary key"
+    if layer.providerType() == "ogr":
+        # The primary key of a file is its FID (the fid column of a GeoPackage), written as
+        # the FID of the uploaded file and not as a column of the CartoVista layer
+        return f"its primary key {layer.fields().at(primary_keys[0]).name()} is the feature id of the file, which is not uploaded"
+    return None
+
+
+def sync_key_field(layer: QgsVectorLayer) -> Optional[str]:
+    """
+    Name of the field identifying the layer features on CartoVista: the layer's single
+    column primary key, when it is uploaded as a column. Layers without one can't be synced.
+    """
+    if sync_key_problem(layer) is not None:
+        return None
+    return layer.fields().at(layer.primaryKeyAttributes()[0]).name()
+
+
+def json_value(value):
+    if value is None or (isinstance(value, QVariant) and value.isNull()):
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (QDate, QDateTime, QTime)):
+        return value.toString(Qt.DateFormat.ISODate)
+    if isinstance(value, (QByteArray, bytes)):
+        return None
+    return str(value)
+
+
+class FeatureChanges:
+    """
+    Features added, changed and deleted since the layer was last sent to CartoVista.
+    Added and changed features are referred to by QGIS feature id, deleted features by
+    the value of their key field since they can't be read back from the layer.
+    """
+
+    def __init__(self, added=(), geometry_changed=(), attributes_changed=None, deleted=()):
+        self.added: Set[int] = set(added)
+        self.geometry_changed: Set[int] = set(geometry_changed)
+        self.attributes_changed: Dict[int, Set[str]] = {fid: set(names) for fid, names in (attributes_changed or {}).items()}
+        self.deleted: Set[str] = set(deleted)
+
+    def count(self) -> int:
+        return len(self.added | self.geometry_changed | set(self.attributes_changed)) + len(self.deleted)
+
+    def copy(self) -> 'FeatureChanges':
+        return FeatureChanges(self.added, self.geometry_changed, self.attributes_changed, self.deleted)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "added": sorted(self.added),
+            "geometry_changed": sorted(self.geometry_changed),
+            "attributes_changed": {str(fid): sorted(names) for fid, names in self.attributes_changed.items()},
+            "deleted": sorted(self.deleted),
+        })
+
+    @staticmethod
+    def from_json(value: str) -> 'FeatureChanges':
+        try:
+            data = json.loads(value)
+            return FeatureChanges(
+                data.get("added", []),
+                data.get("geometry_changed", []),
+                {int(fid): names for fid, names in data.get("attributes_changed", {}).items()},
+                data.get("deleted", []),
+            )
+        except (TypeError, ValueError, AttributeError):
+            return FeatureChanges()
+
+
+class FeatureChangeTracker(QObject):
+    """
+    Records the edits committed to a published layer from the QgsVectorLayer edit signals.
+    Uncommitted edits are ignored, they may still be rolled back.
+    """
+    changes_changed = pyqtSignal()
+
+    def __init__(self, layer: QgsVectorLayer, key_field: str):
+        super().__init__()
+        self.layer = layer
+        self.key_field = key_field
+        self.changes = FeatureChanges.from_json(layer.customProperty(PENDING_CHANGES_PROPERTY, "{}"))
+        # Key values of the features being deleted or re-keyed by the commit in progress
+        self._committing_keys: Dict[int, str] = {}
+
+        self.layer.beforeCommitChanges.connect(self._on_before_commit)
+        self.layer.committedFeaturesAdded.connect(self._on_features_added)
+        self.layer.committedFeaturesRemoved.connect(self._on_features_removed)
+        self.layer.committedAttributeValuesChanges.connect(self._on_attribute_values_changed)
+        self.layer.committedGeometriesChanges.connect(self._on_geometries_changed)
+
+    def dispose(self):
+        for signal, slot in (
+            (self.layer.beforeCommitChanges, self._on_before_commit),
+            (self.layer.committedFeaturesAdded, self._on_features_added),
+            (self.layer.committedFeaturesRemoved, self._on_features_removed),
+            (self.layer.committedAttributeValuesChanges, self._on_attribute_values_changed),
+            (self.layer.committedGeometriesChanges, self._on_geometries_changed),
+        ):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+
+    def has_changes(self) -> bool:
+        return self.changes.count() > 0
+
+    def snapshot(self) -> FeatureChanges:
+        return self.changes.copy()
+
+    def clear(self):
+        self.changes = FeatureChanges()
+        self._save()
+
+    def mark_synced(self, fids=(), deleted_keys=()):
+        """Forgets changes sent to CartoVista. Edits committed during the sync are kept."""
+        for fid in fids:
+            self.changes.added.discard(fid)
+            self.changes.geometry_changed.discard(fid)
+            self.changes.attributes_changed.pop(fid, None)
+        self.changes.deleted.difference_update(deleted_keys)
+        self._save()
+
+    def _save(self):
+        self.layer.setCustomProperty(PENDING_CHANGES_PROPERTY, self.changes.to_json())
+        self.changes_changed.emit()
+
+    def _on_before_commit(self, *_):
+        self._committing_keys = {}
+        edit_buffer = self.layer.editBuffer()
+        if edit_buffer is None:
+            return
+        key_index = self.layer.fields().lookupField(self.key_field)
+        fids = set(edit_buffer.deletedFeatureIds())
+        fids.update(fid for fid, values in edit_buffer.changedAttributeValues().items() if key_index in values)
+        fids = [fid for fid in fids if fid >= 0]
+        if not fids:
+            return
+        # The provider still has the committed values until the commit is done
+        request = QgsFeatureRequest().setFilterFids(fids).setSubsetOfAttributes([key_index]).setFlags(QgsFeatureRequest.Flag.NoGeometry)
+        for feature in self.layer.dataProvider().getFeatures(request):
+            key = json_value(feature[key_index])
+            if key is not None:
+                self._committing_keys[feature.id()] = str(key)
+
+    def _on_features_added(self, _, features):
+        self.changes.added.update(feature.id() for feature in features)
+        self._save()
+
+    def _on_features_removed(self, _, fids):
+        for fid in fids:
+            key = self._committing_keys.get(fid)
+            if fid in self.changes.added:
+                self.changes.added.discard(fid)
+            elif key is not None:
+                self.changes.deleted.add(key)
+            self.changes.geometry_changed.discard(fid)
+            self.changes.attributes_changed.pop(fid, None)
+        self._save()
+
+    def _on_attribute_values_changed(self, _, changed_attributes):
+        fields = self.layer.fields()
+        for fid, values in changed_attributes.items():
+            names = {fields.at(index).name() for index in values if 0 <= index < fields.count()}
+            if self.key_field in names and fid in self._committing_keys:
+                # The feature is known under another key on CartoVista, replace it
+                self.changes.deleted.add(self._committing_keys[fid])
+                self.changes.added.add(fid)
+            self.changes.attributes_changed.setdefault(fid, set()).update(names)
+        self._save()
+
+    def _on_geometries_changed(self, _, changed_geometries):
+        self.changes.geometry_changed.update(changed_geometries.keys())
+        self._save()
+
+
+class SyncItem:
+    """One feature of a sync request, with its approximate share of the payload in bytes"""
+
+    def __init__(self, size: int, payload, fid: Optional[int] = None, key: Optional[str] = None):
+        self.size = size
+        self.payload = payload
+        self.fid = fid
+        self.key = key
+
+
+class SyncOperation:
+    """Items sent with the same API call, split in batches"""
+
+    def __init__(self, kind: str, items: List[SyncItem], columns=None, values=None):
+        self.kind = kind
+        self.items = deque(items)
+        self.columns = columns
+        self.values = values
+
+
+class AdaptiveBatchSize:
+    """
+    Size in bytes of the next request payload, adjusted from the measured throughput so
+    that each request takes about the target duration, and halved when a request fails.
+    """
+
+    def __init__(self):
+        self.min_bytes = PluginSettings.int_value(SYNC_MIN_BATCH_BYTES)
+        self.max_bytes = max(self.min_bytes, PluginSettings.int_value(SYNC_MAX_BATCH_BYTES))
+        self.target_seconds = PluginSettings.float_value(SYNC_TARGET_SECONDS)
+        self.bytes = self._clamp(PluginSettings.int_value(SYNC_BATCH_BYTES))
+
+    def take(self, items: deque) -> List[SyncItem]:
+        batch = []
+        size = 0
+        while items and (not batch or size + items[0].size <= self.bytes):
+            item = items.popleft()
+            batch.append(item)
+            size += item.size
+        return batch
+
+    def record(self, size: int, seconds: float):
+        if seconds <= 0 or size <= 0:
+            return
+        ideal = size / seconds * self.target_seconds
+        # Grow at most twice per request, the throughput of small requests is mostly latency
+        self.bytes = self._clamp(int(min(ideal, self.bytes * 2)))
+
+    def shrink(self):
+        self.bytes = self._clamp(self.bytes // 2)
+
+    def _clamp(self, value: int) -> int:
+        return max(self.min_bytes, min(self.max_bytes, value))
+
+
+class FeatureSync(QObject):
+    """
+    Sends the pending changes of a tracked layer to its CartoVista layer:
+    deletes with feature_delete_features, attribute values shared by several features with
+    feature_update_many_values and every other added or changed feature with
+    feature_create_update_features_from_geo_json. Requests are sent one at a time.
+    """
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(int)
+    failed = pyqtSignal(Exception)
+
+    def __init__(self, tracker: FeatureChangeTracker, record: dict):
+        super().__init__()
+        self.tracker = tracker
+        self.layer = tracker.layer
+        self.record = record
+        self.cv_id = record["cv_id"]
+        self.batch_size = AdaptiveBatchSize()
+        self.operations = deque()
+        self.total = 0
+        self.done = 0
+
+        # Snapshot used by the payload builder on a worker thread
+        self.changes = tracker.snapshot()
+        self.fields = self.layer.fields()
+        # Only the fields that were uploaded exist on CartoVista. Records of layers published
+        # before the fields were recorded fall back to the fields a publish would upload
+        uploaded = record.get("upload_fields")
+        if uploaded is None:
+            uploaded = upload_field_names(self.layer)
+        self.field_names = [name for name in uploaded if self.fields.lookupField(name) >= 0]
+        self.feature_source = QgsVectorLayerFeatureSource(self.layer)
+        self.transform = QgsCoordinateTransform(
+            self.layer.crs(),
+            QgsCoordinateReferenceSystem(UPLOAD_CRS),
+            QgsCoordinateTransformContext(QgsProject.instance().transformContext()),
+        )
+        self.proj4 = QgsCoordinateReferenceSystem(UPLOAD_CRS).toProj()
+
+    def start(self):
+        self.total = self.changes.count()
+        self.progress.emit(0, self.total)
+        if self.total == 0:
+            self.finished.emit(0)
+            return
+        if self.tracker.key_field not in self.field_names:
+            self._on_error(Exception(f"the key field {self.tracker.key_field} was not uploaded, publish the layer again with it"))
+            return
+        if self.record.get("sync_key") != self.tracker.key_field:
+            API_CLIENT.set_unique_id_column(self.cv_id, self.tracker.key_field, self._on_key_set, self._on_error)
+        else:
+            self._build()
+
+    def _on_key_set(self, _):
+        PublishRegistry.update(self.layer.id(), sync_key=self.tracker.key_field)
+        self._build()
+
+    def _build(self):
+        ASYNC_MANAGER.setup_cpu_thread(self._on_built, self._on_error, self.build_operations)
+
+    def build_operations(self) -> List[SyncOperation]:
+        changes = self.changes
+        key_field = self.tracker.key_field
+        names = self.field_names
+        uploaded = set(names)
+
+        deletes = [SyncItem(len(key) + 4, key, key=key) for key in sorted(changes.deleted)]
+
+        upsert_fids = changes.added | changes.geometry_changed
+        read_fids = upsert_fids | set(changes.attributes_changed)
+        features = {}
+        if read_fids:
+            request = QgsFeatureRequest().setFilterFids(sorted(read_fids))
+            for feature in self.feature_source.getFeatures(request):
+                features[feature.id()] = feature
+
+        # Attribute only changes setting the same values on several features need one request
+        groups = {}
+        for fid, changed_names in changes.attributes_changed.items():
+            if fid in upsert_fids or fid not in features:
+                continue
+            columns = tuple(sorted(changed_names & uploaded))
+            if not columns:
+                continue
+            values = [json_value(features[fid][name]) for name in columns]
+            groups.setdefault((columns, json.dumps(values)), []).append(fid)
+
+        operations = []
+        if deletes:
+            operations.append(SyncOperation(SYNC_DELETE, deletes))
+        for (columns, values), fids in groups.items():
+            if len(fids) < 2:
+                upsert_fids = upsert_fids | set(fids)
+                continue
+            items = []
+            for fid in fids:
+                key = json_value(features[fid][key_field])
+                if key is not None:
+                    items.append(SyncItem(len(str(key)) + 4, str(key), fid=fid))
+            operations.append(SyncOperation(SYNC_VALUES, items, list(columns), json.loads(values)))
+
+        upserts = []
+        for fid in sorted(upsert_fids):
+            feature = features.get(fid)
+            if feature is None:
+                # Deleted since, the delete is sent by the next sync
+                continue
+            values = [json_value(feature[name]) for name in names]
+            geo_json = None
+            if feature.hasGeometry():
+                geo_json = prepare_upload_geometry(feature.geometry(), self.transform).asJson()
+            parameter = FeatureGeoJSONCreateParameter(
+                data_columns_identifiers=names,
+                values=values,
+                feature_type=FeatureType.GEOJSON,
+                proj4=self.proj4,
+                geo_json=geo_json,
+            )
+            size = len(geo_json or "") + len(json.dumps(values, default=str))
+            upserts.append(SyncItem(size, parameter, fid=fid))
+        if upserts:
+            operations.append(SyncOperation(SYNC_UPSERT, upserts))
+        return operations
+
+    def _on_built(self, operations: List[SyncOperation]):
+        self.operations = deque(operation for operation in operations if operation.items)
+        # Changes that could not be read back are counted as done, the tracker keeps them
+        self.total = self.done + sum(len(operation.items) for operation in self.operations)
+        self._send_next()
+
+    def _send_next(self):
+        while self.operations and not self.operations[0].items:
+            self.operations.popleft()
+        if not self.operations:
+            self._on_finished()
+            return
+
+        operation = self.operations[0]
+        batch = self.batch_size.take(operation.items)
+        on_success = partial(self._on_batch_sent, operation, batch, time.monotonic())
+        on_error = partial(self._on_batch_error, operation, batch)
+        payloads = [item.payload for item in batch]
+        if operation.kind == SYNC_DELETE:
+            API_CLIENT.delete_features_api(self.cv_id, payloads, on_success, on_error)
+        elif operation.kind == SYNC_VALUES:
+            parameter = DataRowUpdateManyParameter(
+                data_columns_identifiers=operation.columns,
+                values=operation.values,
+                feature_identifiers=payloads,
+            )
+            API_CLIENT.update_many_values_api(self.cv_id, parameter, on_success, on_error)
+        else:
+            API_CLIENT.create_update_features_api(self.cv_id, payloads, on_success, on_error)
+
+    def _on_batch_sent(self, operation: SyncOperation, batch: List[SyncItem], started: float, report):
+        error_count = getattr(report, "error_count", None) or 0
+        if error_count:
+            self._on_batch_error(operation, batch, Exception(f"{error_count} features rejected: {report.error_details}"))
+            return
+
+        self.batch_size.record(sum(item.size for item in batch), time.monotonic() - started)
+        if operation.kind == SYNC_DELETE:
+            self.tracker.mark_synced(deleted_keys=[item.key for item in batch])
+        else:
+            self.tracker.mark_synced(fids=[item.fid for item in batch])
+        self.done += len(batch)
+        self.progress.emit(self.done, self.total)
+        self._send_next()
+
+    def _on_batch_error(self, operation: SyncOperation, batch: List[SyncItem], e):
+        if len(batch) > 1:
+            # Retry with smaller requests, in case the payload was too large for the server
+            self.batch_size.shrink()
+            operation.items.extendleft(reversed(batch))
+            self._send_next()
+            return
+        self._on_error(e)
+
+    def _on_finished(self):
+        if not self.tracker.has_changes():
+            # The remote layer matches the layer again, a publish does not need to upload it
+            PublishRegistry.update(self.layer.id(), fingerprint=layer_fingerprint(self.layer))
+        QgsMessageLog.logMessage(f"{self.layer.name()}: {self.done} changes sent to CartoVista", 'CartoVista', Qgis.MessageLevel.Info)
+        self.finished.emit(self.done)
+
+    def _on_error(self, e):
+        QgsMessageLog.logMessage(f"{self.layer.name()}: sync failed: {e}", 'CartoVista', Qgis.MessageLevel.Warning)
+        self.failed.emit(e if isinstance(e, Exception) else Exception(str(e)))
+
+
+class FeatureSyncManager(QObject):
+    """
+    Keeps a FeatureChangeTracker on each layer of the project that was published to
+    CartoVista and has a key field.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.trackers: Dict[str, FeatureChangeTracker] = {}
+
+    def tracker(self, layer_id: str) -> Optional[FeatureChangeTracker]:
+        return self.trackers.get(layer_id)
+
+    def track_published_layers(self, *_):
+        self.track_layers(QgsProject.instance().mapLayers().values())
+
+    def track_layers(self, layers):
+        for layer in layers:
+            if isinstance(layer, QgsVectorLayer) and PublishRegistry.find(layer.id()) is not None:
+                self.track(layer)
+
+    def track(self, layer: QgsVectorLayer) -> Optional[FeatureChangeTracker]:
+        tracker = self.trackers.get(layer.id())
+        if tracker is not None:
+            return tracker
+        key_field = sync_key_field(layer)
+        if key_field is None:
+            return None
+        tracker = FeatureChangeTracker(layer, key_field)
+        self.trackers[layer.id()] = tracker
+        return tracker
+
+    def layer_published(self, layer: QgsVectorLayer):
+        """The whole layer was uploaded, there is nothing left to sync"""
+        tracker = self.track(layer)
+        if tracker is not None:
+            tracker.clear()
+
+    def untrack(self, layer_ids):
+        for layer_id in layer_ids:
+            tracker = self.trackers.pop(layer_id, None)
+            if tracker is not None:
+                tracker.dispose()
+
+    def dispose(self):
+        self.untrack(list(self.trackers))
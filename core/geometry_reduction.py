@@ -0,0 +1,100 @@
+"""
+Coordinate precision reduction and simplification of the exported geometries, so that
+layers are not uploaded with more detail than a web map can show
+"""
+
+from typing import Optional
+
+from qgis.core import QgsGeometry, QgsVectorLayer
+
+from .plugin_settings import PluginSettings, COORDINATE_PRECISION, SIMPLIFY_GEOMETRIES, SIMPLIFY_SCALE
+
+# Layer custom properties overriding the plugin settings for one layer
+PRECISION_PROPERTY = "add_to_cartovista/coordinate_precision"
+SIMPLIFY_PROPERTY = "add_to_cartovista/simplify"
+
+# Size of a screen pixel in meters at a given scale, as defined by OGC
+PIXEL_SIZE = 0.00028
+METERS_PER_DEGREE = 111320.0
+
+
+def _float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _bool(value, default: bool) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def simplify_tolerance(layer: QgsVectorLayer) -> float:
+    """
+    Tolerance in degrees that keeps the simplification under half a pixel at the most
+    zoomed in scale the layer is shown at, or at SIMPLIFY_SCALE when it is always shown
+    """
+    scale = layer.maximumScale() if layer.hasScaleBasedVisibility() else 0
+    if not scale:
+        scale = PluginSettings.float_value(SIMPLIFY_SCALE)
+    return scale * PIXEL_SIZE / 2 / METERS_PER_DEGREE
+
+
+def reduction_settings(layer: QgsVectorLayer) -> dict:
+    """Precision and simplification tolerance of the layer in degrees, 0 when disabled. Main thread only."""
+    precision = _float(layer.customProperty(PRECISION_PROPERTY), PluginSettings.float_value(COORDINATE_PRECISION))
+    simplify = _bool(layer.customProperty(SIMPLIFY_PROPERTY), PluginSettings.bool_value(SIMPLIFY_GEOMETRIES))
+    return {
+        "precision": max(precision, 0.0),
+        "simplify_tolerance": simplify_tolerance(layer) if simplify else 0.0,
+    }
+
+
+class GeometryReduction:
+    """
+    Snaps the coordinates to a grid of precision degrees and simplifies the geometries with
+    GEOS topology preserving simplification, which keeps rings valid and holes inside their
+    shell. Counts the vertices and WKB bytes before and after for the export report.
+    """
+
+    def __init__(self, precision: float = 0.0, tolerance: float = 0.0):
+        self.precision = precision
+        self.tolerance = tolerance
+        self.vertices_before = 0
+        self.vertices_after = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.precision > 0 or self.tolerance > 0
+
+    def apply(self, geometry: QgsGeometry) -> QgsGeometry:
+        if not self.enabled or geometry.isNull():
+            return geometry
+        self.vertices_before += geometry.constGet().nCoordinates()
+        self.bytes_before += geometry.wkbSize()
+        reduced = geometry
+        if self.tolerance > 0:
+            simplified = reduced.simplify(self.tolerance)
+            if not simplified.isNull() and not simplified.isEmpty():
+                reduced = simplified
+        if self.precision > 0:
+            snapped = reduced.snappedToGrid(self.precision, self.precision)
+            # Features smaller than the grid would vanish, they keep their coordinates
+            if not snapped.isNull() and not snapped.isEmpty():
+                reduced = snapped
+        self.vertices_after += reduced.constGet().nCoordinates()
+        self.bytes_after += reduced.wkbSize()
+        return reduced
+
+    def summary(self) -> Optional[str]:
+        if not self.enabled or not self.vertices_before:
+            return None
+        return (f"{self.vertices_before} -> {self.vertices_after} vertices, "
+                f"{self.bytes_before / 1024:.0f} -> {self.bytes_after / 1024:.0f} KB of geometry "
+                f"(precision {self.precision:g}, simplification tolerance {self.tolerance:g})")
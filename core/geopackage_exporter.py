@@ -0,0 +1,156 @@
+"""
+Writes a layer snapshot to a GeoPackage ready for upload to CartoVista
+"""
+
+import copy
+
+from qgis.core import (Qgis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException,
+                       QgsFeature, QgsFeatureRequest, QgsMessageLog, QgsVectorFileWriter, QgsWkbTypes)
+
+from .artifacts import MEMORY_BUDGET, artifact_size, is_in_memory
+from .crs_policy import choose_upload_crs, degrees_to_crs_units
+from .geometry_reduction import GeometryReduction
+from .layer_upload_info import LayerUploadInfo
+from .upload_schema import field_indexes, upload_fields
+from .writer_profile import dataset_options, layer_options, upload_profile
+
+UPLOAD_CRS = 'EPSG:4326'
+
+# Features written between two checks of the output size
+SIZE_CHECK_INTERVAL = 10000
+
+
+class GeopackageExportError(Exception):
+    pass
+
+
+class ExportSizeExceeded(GeopackageExportError):
+    pass
+
+
+def prepare_upload_geometry(geometry, transform: QgsCoordinateTransform):
+    """Reprojects the geometry to the upload CRS as a multi geometry without Z/M"""
+    geometry.transform(transform)
+    abstract_geometry = geometry.get()
+    abstract_geometry.dropZValue()
+    abstract_geometry.dropMValue()
+    geometry.convertToMultiType()
+    return geometry
+
+
+class GeopackageExporter:
+    """
+    Exports a LayerUploadInfo's feature source to a GeoPackage.
+
+    Only the feature source, fields and transform context copied into the
+    LayerUploadInfo on the main thread are used, so several exporters can run
+    on worker threads at the same time without touching the QgsVectorLayer.
+    """
+
+    def __init__(self, layer_upload_info: LayerUploadInfo):
+        self.layer_upload_info = layer_upload_info
+        self.destination_crs = choose_upload_crs(layer_upload_info, QgsCoordinateReferenceSystem(UPLOAD_CRS))
+        self.transform = QgsCoordinateTransform(
+            layer_upload_info.crs,
+            self.destination_crs,
+            layer_upload_info.transform_context,
+        )
+        # Multi geometries without Z/M, as expected by CartoVista
+        self.wkb_type = QgsWkbTypes.multiType(
+            QgsWkbTypes.dropM(QgsWkbTypes.dropZ(layer_upload_info.wkb_type))
+        )
+        # Reduction settings are in degrees
+        self.reduction = GeometryReduction(
+            degrees_to_crs_units(layer_upload_info.export_settings.get("precision", 0.0), self.destination_crs),
+            degrees_to_crs_units(layer_upload_info.export_settings.get("simplify_tolerance", 0.0), self.destination_crs),
+        )
+        # Source attribute indexes of the uploaded fields
+        self.field_indexes = field_indexes(layer_upload_info.fields, layer_upload_info.export_settings.get("fields"))
+        self.feature_source = layer_upload_info.feature_source
+        self.filter_expression = None
+        self._output_fields = None
+
+    def output_fields(self):
+        """Fields of the GeoPackage, computed once so that all partitions share the same schema"""
+        if self._output_fields is None:
+            info = self.layer_upload_info
+            self._output_fields = upload_fields(info.fields, self.field_indexes, info.feature_source,
+                                                info.export_settings.get("narrow_types", False))
+        return self._output_fields
+
+    def for_partition(self, feature_source, filter_expression: str) -> 'GeopackageExporter':
+        """Exporter of the features of filter_expression only, read from their own feature source"""
+        self.output_fields()
+        partition = copy.copy(self)
+        partition.feature_source = feature_source
+        partition.filter_expression = filter_expression
+        partition.transform = QgsCoordinateTransform(self.transform)
+        partition.reduction = GeometryReduction(self.reduction.precision, self.reduction.tolerance)
+        return partition
+
+    def writer_options(self) -> QgsVectorFileWriter.SaveVectorOptions:
+        writer_options = QgsVectorFileWriter.SaveVectorOptions()
+        writer_options.driverName = 'GPKG'
+        writer_options.fileEncoding = 'UTF-8'
+        writer_options.datasourceOptions = dataset_options()
+        writer_options.layerOptions = layer_options()
+        writer_options.saveMetadata = False
+        writer_options.symbologyExport = Qgis.FeatureSymbologyExport.NoSymbology
+        return writer_options
+
+    def feature_request(self) -> QgsFeatureRequest:
+        scope_request = self.layer_upload_info.scope_request
+        request = QgsFeatureRequest(scope_request) if scope_request is not None else QgsFeatureRequest()
+        request.setSubsetOfAttributes(self.field_indexes)
+        if self.filter_expression:
+            request.setFilterExpression(self.filter_expression)
+        return request
+
+    def export(self, file_path: str):
+        """
+        Writes the GeoPackage. In memory, raises ExportSizeExceeded as soon as it grows above
+        what the MEMORY_BUDGET has left.
+        """
+        info = self.layer_upload_info
+        fields = self.output_fields()
+        all_fields = fields.count() == info.fields.count()
+        in_memory = is_in_memory(file_path)
+        with upload_profile():
+            writer = QgsVectorFileWriter.create(
+                file_path,
+                fields,
+                self.wkb_type,
+                self.destination_crs,
+                info.transform_context,
+                self.writer_options(),
+            )
+        if writer.hasError() != QgsVectorFileWriter.WriterError.NoError:
+            raise GeopackageExportError(f"Failed to create {file_path}: {writer.errorMessage()}")
+
+        try:
+            for count, source_feature in enumerate(self.feature_source.getFeatures(self.feature_request()), 1):
+                if in_memory and count % SIZE_CHECK_INTERVAL == 0:
+                    writer.flushBuffer()
+                    if not MEMORY_BUDGET.reserve(file_path, artifact_size(file_path)):
+                        raise ExportSizeExceeded(f"{info.layer_name} does not fit in the memory left for exports")
+                if all_fields:
+                    feature = source_feature
+                else:
+                    feature = QgsFeature(fields, source_feature.id())
+                    attributes = source_feature.attributes()
+                    feature.setAttributes([attributes[index] for index in self.field_indexes])
+                if source_feature.hasGeometry():
+                    feature.setGeometry(self.prepare_geometry(source_feature.geometry()))
+                if not writer.addFeature(feature):
+                    raise GeopackageExportError(f"Failed to write feature {feature.id()} of {info.layer_name}: {writer.errorMessage()}")
+            writer.flushBuffer()
+            info.export_report = self.reduction.summary()
+            if info.export_report:
+                QgsMessageLog.logMessage(f"{info.layer_name}: {info.export_report}", 'CartoVista', Qgis.MessageLevel.Info)
+        except QgsCsException as e:
+            raise GeopackageExportError(f"Failed to reproject {info.layer_name}: {e}")
+        finally:
+            del writer
+
+    def prepare_geometry(self, geometry):
+        return self.reduction.apply(prepare_upload_geometry(geometry, self.transform))
@@ -0,0 +1,59 @@
+"""
+HTTP connections shared by the API client, the OAuth token request and the token refresh,
+so that they all reuse the same kept alive TLS connections to CartoVista
+"""
+
+import json
+import ssl
+import threading
+
+import certifi
+import urllib3
+from qgis.PyQt.QtCore import QCoreApplication
+
+from add_to_cartovista.swagger_client.configuration import Configuration
+
+from .plugin_settings import PluginSettings, HTTP_POOL_MAXSIZE
+from .request_timeouts import default_timeout
+
+# Hosts whose connections are kept at the same time
+POOL_HOSTS = 4
+
+_lock = threading.Lock()
+
+
+def create_pool_manager(configuration: Configuration) -> urllib3.PoolManager:
+    """Pool manager with the SSL and proxy options of rest.RESTClientObject and HTTP_POOL_MAXSIZE connections per host"""
+    pool_args = {
+        "num_pools": POOL_HOSTS,
+        "maxsize": PluginSettings.int_value(HTTP_POOL_MAXSIZE),
+        "cert_reqs": ssl.CERT_REQUIRED if configuration.verify_ssl else ssl.CERT_NONE,
+        "ca_certs": configuration.ssl_ca_cert or certifi.where(),
+        "cert_file": configuration.cert_file,
+        "key_file": configuration.key_file,
+        # Failed requests are retried by the REST client, see RetryPolicy
+        "retries": urllib3.Retry(total=None, connect=0, read=0, status=0, redirect=5),
+    }
+    if configuration.assert_hostname is not None:
+        pool_args["assert_hostname"] = configuration.assert_hostname
+    if configuration.proxy:
+        return urllib3.ProxyManager(proxy_url=configuration.proxy, **pool_args)
+    return urllib3.PoolManager(**pool_args)
+
+
+def shared_pool_manager(configuration: Configuration = None) -> urllib3.PoolManager:
+    """The pool manager of the plugin, created from the first configuration. Thread safe."""
+    app = QCoreApplication.instance()
+    with _lock:
+        if not hasattr(app, "_cv_plugin_pool_manager"):
+            app._cv_plugin_pool_manager = create_pool_manager(configuration or Configuration())
+        return app._cv_plugin_pool_manager
+
+
+def post_form(url: str, data: dict, timeout=None) -> dict:
+    """Posts an urlencoded form through the shared connections, returns the JSON response"""
+    if timeout is None:
+        connect, read = default_timeout()
+        timeout = urllib3.Timeout(connect=connect, read=read)
+    response = shared_pool_manager().request("POST", url, fields=data, encode_multipart=False, timeout=timeout)
+    return json.loads(response.data.decode("utf-8") or "{}")
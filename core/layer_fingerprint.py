@@ -0,0 +1,159 @@
+"""
+Layer fingerprints and the record of layers already published from the project,
+used to avoid re-uploading layers that did not change since the last publish
+"""
+
+import hashlib
+import json
+import os.path
+from datetime import datetime, timezone
+from typing import Optional
+
+from qgis.core import QgsProject, QgsProviderRegistry, QgsVectorLayer
+
+from .export_settings import export_settings
+
+PROJECT_SCOPE = "add_to_cartovista"
+PUBLISHED_LAYERS_KEY = "published_layers"
+
+# Files next to the main source file that hold part of the layer's data
+SIDECAR_SUFFIXES = ("-wal", ".dbf", ".shx")
+
+
+def layer_source_path(layer: QgsVectorLayer) -> Optional[str]:
+    """Path of the file backing the layer, or None if the layer is not file based"""
+    decoded = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source())
+    path = decoded.get("path")
+    if path and os.path.isfile(path):
+        return path
+    return None
+
+
+def schema_hash(layer: QgsVectorLayer) -> str:
+    schema = {
+        "fields": [[field.name(), field.typeName(), field.length(), field.precision()] for field in layer.fields()],
+        "wkb_type": int(layer.wkbType()),
+        "crs": layer.crs().authid() or layer.crs().toWkt(),
+    }
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def upload_signature(path: str) -> Optional[dict]:
+    """
+    Format, schema hash and field names of the file uploaded for a layer, or None when GDAL
+    can't read it. CartoVista can't update a layer from a file of another format or schema.
+    The fields are the columns of the CartoVista layer, the FID column of the file is not
+    one of them. Safe to call from a worker thread.
+    """
+    from osgeo import gdal
+    dataset = gdal.OpenEx(path, gdal.OF_VECTOR | gdal.OF_READONLY)
+    if dataset is None or dataset.GetLayerCount() == 0:
+        return None
+    try:
+        layer = dataset.GetLayer(0)
+        definition = layer.GetLayerDefn()
+        fields = [definition.GetFieldDefn(index) for index in range(definition.GetFieldCount())]
+        srs = layer.GetSpatialRef()
+        schema = {
+            "fields": [[field.GetName(), field.GetTypeName(), field.GetWidth(), field.GetPrecision()] for field in fields],
+            "geometry_type": definition.GetGeomType(),
+            "crs": srs.ExportToWkt() if srs is not None else None,
+        }
+        return {
+            "upload_format": dataset.GetDriver().ShortName,
+            "upload_schema": hashlib.sha1(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest(),
+            "upload_fields": [field.GetName() for field in fields],
+        }
+    finally:
+        dataset = None
+
+
+def layer_fingerprint(layer: QgsVectorLayer, settings: Optional[dict] = None) -> Optional[str]:
+    """
+    Fingerprint of the layer content and export settings, or None when changes can't be detected
+    reliably: layers that are not file based (databases, services) and layers with unsaved edits.
+    """
+    if layer.isModified():
+        return None
+    path = layer_source_path(layer)
+    if path is None:
+        return None
+
+    files = []
+    for file_path in [path] + [os.path.splitext(path)[0] + s if s.startswith(".") else path + s for s in SIDECAR_SUFFIXES]:
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            files.append([os.path.basename(file_path), stat.st_mtime_ns, stat.st_size])
+
+    fingerprint = {
+        "provider": layer.providerType(),
+        "uri": layer.source(),
+        "subset": layer.subsetString(),
+        "feature_count": layer.featureCount(),
+        "files": files,
+        "schema": schema_hash(layer),
+        "export": settings if settings is not None else export_settings(layer),
+    }
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PublishRegistry:
+    """
+    Remote CartoVista layers published from the current project, stored in the project
+    custom properties as a JSON object keyed by QGIS layer id. The record is only
+    persisted when the project is saved.
+    """
+
+    @staticmethod
+    def _read() -> dict:
+        value, ok = QgsProject.instance().readEntry(PROJECT_SCOPE, PUBLISHED_LAYERS_KEY, "{}")
+        if not ok:
+            return {}
+        try:
+            return json.loads(value)
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _write(published_layers: dict):
+        QgsProject.instance().writeEntry(PROJECT_SCOPE, PUBLISHED_LAYERS_KEY, json.dumps(published_layers))
+
+    @staticmethod
+    def get(qgis_id: str, tenant_url_code: str) -> Optional[dict]:
+        record = PublishRegistry._read().get(qgis_id)
+        if record is None or record.get("tenant") != tenant_url_code:
+            return None
+        return record
+
+    @staticmethod
+    def find(qgis_id: str) -> Optional[dict]:
+        """Record of the layer whatever the organization it was published to"""
+        return PublishRegistry._read().get(qgis_id)
+
+    @staticmethod
+    def update(qgis_id: str, **values):
+        published_layers = PublishRegistry._read()
+        if qgis_id in published_layers:
+            published_layers[qgis_id].update(values)
+            PublishRegistry._write(published_layers)
+
+    @staticmethod
+    def record(qgis_id: str, tenant_url_code: str, cv_id: str, cv_identifier: str, fingerprint: Optional[str],
+               signature: Optional[dict] = None):
+        """signature is the upload_signature of the uploaded file, if known"""
+        published_layers = PublishRegistry._read()
+        published_layers[qgis_id] = {
+            "tenant": tenant_url_code,
+            "cv_id": cv_id,
+            "cv_identifier": cv_identifier,
+            "fingerprint": fingerprint,
+            "published_at": datetime.now(timezone.utc).isoformat(),
+            **(signature or {}),
+        }
+        PublishRegistry._write(published_layers)
+
+    @staticmethod
+    def forget(qgis_id: str):
+        published_layers = PublishRegistry._read()
+        if published_layers.pop(qgis_id, None) is not None:
+            PublishRegistry._write(published_layers)
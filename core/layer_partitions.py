@@ -0,0 +1,38 @@
+"""
+Split of very large layers in feature id ranges, exported in parallel and uploaded as one
+CartoVista layer created from the first partition and appended with the others
+"""
+
+from typing import List, Optional, Tuple
+
+from qgis.core import QgsFeatureRequest
+
+from .plugin_settings import PluginSettings, PARTITION_MIN_FEATURES, PARTITION_COUNT
+
+
+def partition_count(feature_count: int) -> int:
+    """Number of partitions of a layer of feature_count features, 1 when it is not split"""
+    if feature_count < PluginSettings.int_value(PARTITION_MIN_FEATURES):
+        return 1
+    return max(1, PluginSettings.int_value(PARTITION_COUNT))
+
+
+def fid_ranges(feature_source, count: int) -> List[Tuple[int, Optional[int]]]:
+    """
+    [first, next first) feature id ranges holding about the same number of features each,
+    the last range is open ended. Reads the feature ids of feature_source once.
+    """
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.Flag.NoGeometry).setNoAttributes()
+    fids = sorted(feature.id() for feature in feature_source.getFeatures(request))
+    if not fids:
+        return [(0, None)]
+    count = max(1, min(count, len(fids)))
+    starts = sorted({fids[len(fids) * index // count] for index in range(count)})
+    return [(start, starts[index + 1] if index + 1 < len(starts) else None) for index, start in enumerate(starts)]
+
+
+def range_expression(first: int, end: Optional[int]) -> str:
+    # $id filters are compiled to SQL by the OGR and database providers
+    if end is None:
+        return f"$id >= {first}"
+    return f"$id >= {first} AND $id < {end}"
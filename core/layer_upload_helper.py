@@ -4,14 +4,34 @@ from .cartovista_styles import get_fill_style, get_label_settings, get_line_styl
 from .helper_functions import HelperFunctions
 from .layer_upload_info import LayerUploadInfo, LayerUploadStatus
 from qgis.PyQt.QtCore import pyqtSignal, QObject
-from qgis.core import (Qgis, QgsFeatureRenderer, QgsWkbTypes, QgsSymbol,
-                       QgsVectorFileWriter, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCoordinateTransformContext,
+from qgis.core import (QgsSymbol,
                        QgsSimpleMarkerSymbolLayer, QgsSvgMarkerSymbolLayer, QgsSimpleLineSymbolLayer, QgsSimpleFillSymbolLayer, 
-                       QgsGradientFillSymbolLayer, QgsMapLayer)
+                       QgsGradientFillSymbolLayer, QgsMapLayer, Qgis, QgsMessageLog)
+import re
+import shutil
+import time
+import uuid
 import zipfile
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from .async_manager import ASYNC_MANAGER
+from .artifacts import (MEMORY_BUDGET, artifact_mtime, artifact_size, is_in_memory, memory_path, open_artifact, remove_artifact,
+                        remove_geopackage)
 from .cartovista_api import API_CLIENT
+from .chunked_upload import ChunkedUpload
+from .database_export import DatabaseExporter
+from .geopackage_exporter import ExportSizeExceeded, GeopackageExportError, GeopackageExporter
+from .layer_fingerprint import PublishRegistry, upload_signature
+from .layer_partitions import fid_ranges, range_expression
+from .publish_scope import PublishScope, PublishScopeError
+from .retry_policy import UPDATE_REJECTED_STATUSES
+from .service_layers import wfs_count_default
+from .parallel_zip import write_parallel_deflate_zip
+from .compression_policy import LEVEL_STORED, UploadBandwidth, choose_compression_level
+from .plugin_settings import (PluginSettings, CHUNKED_UPLOAD_THRESHOLD, PARALLEL_ZIP_MIN_SIZE, ZIP_WORKERS,
+                              EXPORT_TO_MEMORY)
+from .streaming_multipart import CHUNK_SIZE
 from add_to_cartovista.swagger_client.models.data_column import DataColumn
 from add_to_cartovista.swagger_client.models.layer import Layer
 
@@ -22,70 +42,463 @@ class LayerUploadHelper(QObject):
         super().__init__()
         self.layers_upload_info: List[LayerUploadInfo] = []
         self.invalid_layer_names: List[str] = []
-        # Context object to store info about coordinate operations
-        self.transform_context = QgsCoordinateTransformContext()
+        # Chunked uploads that failed, kept to resume them on the next attempt
+        self.chunked_uploads = {}
 
-    def create_layers_info_for_map_upload(self, layers: List[QgsMapLayer]):
+    def create_layers_info_for_map_upload(self, layers: List[QgsMapLayer], scope: PublishScope = None) -> List[str]:
+        """
+        Upload info of the supported layers. Layers the scope can't be applied to are left
+        out with the unsupported ones, the returned messages tell why.
+        """
         self.layers_upload_info = []
         self.invalid_layer_names = []
+        scope_errors = []
         for layer in layers:
-            if HelperFunctions.is_supported_layer(layer):
-                self.layers_upload_info.append(LayerUploadInfo(layer))
-            else:
+            if not HelperFunctions.is_supported_layer(layer):
+                self.invalid_layer_names.append(layer.name())
+                continue
+            try:
+                self.layers_upload_info.append(LayerUploadInfo(layer, scope))
+            except PublishScopeError as e:
                 self.invalid_layer_names.append(layer.name())
+                scope_errors.append(f"{layer.name()}: {e}")
+        return scope_errors
 
     def create_geopackage(self, layer_upload_info: LayerUploadInfo, temp_dir: str):
-        layer_path_no_extension = os.path.join(temp_dir, layer_upload_info.layer_name)
-
-        writer_options = QgsVectorFileWriter.SaveVectorOptions()
-        writer_options.driverName = 'GPKG'
-        writer_options.ct = QgsCoordinateTransform(
-            layer_upload_info.layer.crs(),
-            QgsCoordinateReferenceSystem('EPSG:4326'),
-            self.transform_context,
-        )
-        writer_options.forceMulti = True
-        writer_options.overrideGeometryType = QgsWkbTypes.dropM(
-            QgsWkbTypes.dropZ(layer_upload_info.layer.wkbType())
-        )
-        writer_options.includeZ = False
-        
-        output = QgsVectorFileWriter.writeAsVectorFormatV3(layer_upload_info.layer, layer_path_no_extension, self.transform_context, writer_options)
-        if output[0]:
+        """
+        Exports the layer to a geopackage in memory (/vsimem/), or in its own folder of temp_dir
+        when in-memory export is disabled or the geopackage outgrows what the MEMORY_BUDGET has left.
+        Layers whose source file can be uploaded as is are not exported, database layers are
+        exported by GDAL when possible, very large layers are exported in partitions in
+        parallel unless they update a published layer. Safe to call from a worker thread.
+        """
+        if layer_upload_info.source_files:
+            layer_upload_info.file_path = layer_upload_info.source_files[0]
+            layer_upload_info.size = math.floor(sum(os.path.getsize(path) for path in layer_upload_info.source_files) / 1024)
+            layer_upload_info.upload_signature = upload_signature(layer_upload_info.file_path)
+            QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: uploading the source file as is", 'CartoVista', Qgis.MessageLevel.Info)
+            return layer_upload_info
+        try:
+            if layer_upload_info.pushdown_source:
+                paths = self._export_from_database(layer_upload_info, temp_dir)
+            elif layer_upload_info.partition_count > 1 and layer_upload_info.cv_id is None:
+                # An update replaces the layer with the first partition, a failed append would
+                # leave it half replaced. Updates, including the retry of a partially created
+                # layer, upload the whole layer at once instead.
+                exporter = GeopackageExporter(layer_upload_info)
+                paths = self._export_partitions(exporter, layer_upload_info, temp_dir)
+            else:
+                paths = [self._export(GeopackageExporter(layer_upload_info), layer_upload_info, temp_dir,
+                                      (self.layer_folder_name(layer_upload_info),))]
+        except:
             layer_upload_info.status = LayerUploadStatus.FAILED
-            self.iface.messageBar().pushMessage("Error writing Layer contents", "Failed to write: " + layer_upload_info.layer_name + " Status: " + str(output), level=Qgis.MessageLevel.Critical)
-            raise Exception("Writing layer to geopackage failed")
-        true_file_path = output[2]
-        layer_upload_info.file_path = true_file_path
-        layer_upload_info.size = math.floor(os.path.getsize(true_file_path) / 1024)
-        
+            raise
+        layer_upload_info.file_path = paths[0]
+        layer_upload_info.partition_paths = paths[1:]
+        layer_upload_info.size = math.floor(sum(artifact_size(path) for path in paths) / 1024)
+        layer_upload_info.upload_signature = upload_signature(paths[0])
+        return layer_upload_info
+
+    def _export_from_database(self, layer_upload_info: LayerUploadInfo, temp_dir: str) -> List[str]:
+        """
+        Exports with the pushdown to the database, or feature by feature when GDAL fails, for
+        instance when it can't connect with the credentials of the QGIS connection
+        """
+        folder = (self.layer_folder_name(layer_upload_info),)
+        try:
+            path = self._export(DatabaseExporter(layer_upload_info), layer_upload_info, temp_dir, folder)
+        except GeopackageExportError as e:
+            QgsMessageLog.logMessage(f"{e}, exporting feature by feature instead", 'CartoVista', Qgis.MessageLevel.Warning)
+            layer_upload_info.pushdown_source = None
+            path = self._export(GeopackageExporter(layer_upload_info), layer_upload_info, temp_dir, folder)
+        else:
+            QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: exported by the database", 'CartoVista', Qgis.MessageLevel.Info)
+        return [path]
+
+    def _export(self, exporter: GeopackageExporter, layer_upload_info: LayerUploadInfo, temp_dir: str, folder: tuple) -> str:
+        file_name = f"{layer_upload_info.layer_name}.gpkg"
+        layer_path = None
+        try:
+            if PluginSettings.bool_value(EXPORT_TO_MEMORY):
+                layer_path = memory_path(*folder, file_name)
+                try:
+                    exporter.export(layer_path)
+                    MEMORY_BUDGET.record(layer_path, artifact_size(layer_path))
+                except ExportSizeExceeded as e:
+                    QgsMessageLog.logMessage(f"{e}, exporting to disk instead", 'CartoVista', Qgis.MessageLevel.Info)
+                    remove_geopackage(layer_path)
+                    layer_path = None
+            if layer_path is None:
+                layer_dir = os.path.join(temp_dir, *folder)
+                os.makedirs(layer_dir, exist_ok=True)
+                layer_path = os.path.join(layer_dir, file_name)
+                exporter.export(layer_path)
+        except:
+            if is_in_memory(layer_path):
+                remove_geopackage(layer_path)
+            raise
+        return layer_path
+
+    def _export_partitions(self, exporter: GeopackageExporter, layer_upload_info: LayerUploadInfo, temp_dir: str) -> List[str]:
+        """
+        Exports feature id ranges of the layer to one geopackage each, in parallel on the
+        thread of the export and on the idle threads of the CPU pool, reserved meanwhile
+        """
+        ranges = fid_ranges(layer_upload_info.feature_source, layer_upload_info.partition_count)
+        sources = [layer_upload_info.feature_source] + layer_upload_info.partition_sources
+        folder = self.layer_folder_name(layer_upload_info)
+        reserved = ASYNC_MANAGER.reserve_cpu_threads(len(ranges) - 1)
+        try:
+            with ThreadPoolExecutor(max_workers=reserved + 1) as executor:
+                futures = [
+                    executor.submit(self._export, exporter.for_partition(sources[index], range_expression(*fid_range)),
+                                    layer_upload_info, temp_dir, (folder, f"part{index + 1}"))
+                    for index, fid_range in enumerate(ranges)
+                ]
+        finally:
+            ASYNC_MANAGER.release_cpu_threads(reserved)
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            for future in futures:
+                if future.exception() is None and is_in_memory(future.result()):
+                    remove_geopackage(future.result())
+            raise errors[0]
+        QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: exported in {len(ranges)} partitions", 'CartoVista', Qgis.MessageLevel.Info)
+        return [future.result() for future in futures]
+
+    def release_artifacts(self, layer_upload_info: LayerUploadInfo):
+        """Frees the memory held by the in-memory artifacts of the layer"""
+        for path in [layer_upload_info.file_path] + layer_upload_info.partition_paths:
+            if is_in_memory(path):
+                remove_geopackage(path)
+        for path in [layer_upload_info.zip_path] + layer_upload_info.partition_zip_paths:
+            if is_in_memory(path):
+                remove_artifact(path)
+        if is_in_memory(layer_upload_info.file_path):
+            layer_upload_info.file_path = None
+        if is_in_memory(layer_upload_info.zip_path):
+            layer_upload_info.zip_path = None
+        layer_upload_info.partition_paths = []
+        layer_upload_info.partition_zip_paths = []
+
     def zip_geopackage(self, temp_dir: str, layer_upload_info: LayerUploadInfo):
         # Zip the layer
+        zip_paths = []
         try:
-            zipped_layer = str(os.path.join(temp_dir, layer_upload_info.layer_name)) +'.zip'
-            with zipfile.ZipFile(zipped_layer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(layer_upload_info.file_path, f"{layer_upload_info.layer_name}.gpkg")
-                layer_upload_info.zip_path = zipf.filename
+            zip_name = f"{layer_upload_info.layer_name}.zip"
+            folder = self.layer_folder_name(layer_upload_info)
+            zipped_layer = self._zip_path(layer_upload_info.file_path, memory_path(folder, zip_name),
+                                          os.path.join(temp_dir, folder, zip_name))
+            zip_paths.append(zipped_layer)
+            # Large files are compressed by threads of the CPU pool, reserved so that the pool
+            # starts fewer jobs meanwhile. This job's thread is one of the compressing threads
+            sources = layer_upload_info.source_files or [layer_upload_info.file_path]
+            parallel = any(len(files) == 1 and artifact_size(files[0]) >= PluginSettings.int_value(PARALLEL_ZIP_MIN_SIZE)
+                           for files in [sources] + [[path] for path in layer_upload_info.partition_paths])
+            reserved = ASYNC_MANAGER.reserve_cpu_threads(PluginSettings.int_value(ZIP_WORKERS) - 1) if parallel else 0
+            try:
+                level = choose_compression_level(layer_upload_info.file_path, layer_upload_info.layer_name, reserved + 1)
+                self._zip(zipped_layer, sources, layer_upload_info.layer_name, level, reserved + 1)
+                # Partitions are zipped next to their geopackage, with the same compression
+                partition_zip_paths = []
+                for index, path in enumerate(layer_upload_info.partition_paths, 2):
+                    partition_zip_paths.append(self._zip_path(path, os.path.splitext(path)[0] + ".zip",
+                                                              os.path.join(temp_dir, folder, f"part{index}", zip_name)))
+                    zip_paths.append(partition_zip_paths[-1])
+                    self._zip(partition_zip_paths[-1], [path], layer_upload_info.layer_name, level, reserved + 1)
+            finally:
+                ASYNC_MANAGER.release_cpu_threads(reserved)
+            for path in zip_paths:
+                if is_in_memory(path):
+                    MEMORY_BUDGET.record(path, artifact_size(path))
+            layer_upload_info.zip_path = zipped_layer
+            layer_upload_info.partition_zip_paths = partition_zip_paths
+            layer_upload_info.zip_token = uuid.uuid4().hex
+            for path in [layer_upload_info.file_path] + layer_upload_info.partition_paths:
+                if is_in_memory(path):
+                    # Only the zip is uploaded, don't hold the layer twice in memory
+                    remove_geopackage(path)
         except:
+            for path in zip_paths:
+                if is_in_memory(path):
+                    remove_artifact(path)
             layer_upload_info.status = LayerUploadStatus.FAILED
             raise
         return layer_upload_info
 
+    @staticmethod
+    def _zip_path(source_path: str, memory_zip_path: str, disk_zip_path: str) -> str:
+        """
+        Path of the zip of an artifact: in memory next to an in-memory artifact when the MEMORY_BUDGET
+        can hold a zip as large as it, on disk otherwise
+        """
+        if is_in_memory(source_path) and MEMORY_BUDGET.reserve(memory_zip_path, artifact_size(source_path)):
+            return memory_zip_path
+        os.makedirs(os.path.dirname(disk_zip_path), exist_ok=True)
+        return disk_zip_path
+
+    def _zip(self, zip_path: str, sources: List[str], name: str, level: int, workers: int):
+        # Source files keep their extension, all named after the layer
+        entries = [(path, name + os.path.splitext(path)[1].lower()) for path in sources]
+        if level != LEVEL_STORED and len(entries) == 1 and \
+                artifact_size(sources[0]) >= PluginSettings.int_value(PARALLEL_ZIP_MIN_SIZE):
+            write_parallel_deflate_zip(zip_path, sources[0], entries[0][1], level, workers)
+        else:
+            self._write_zip(zip_path, entries, level)
+
+    @staticmethod
+    def _write_zip(zip_path: str, entries, level: int):
+        """Zips the (source path, arcname) entries, streaming them so that in-memory artifacts work"""
+        compression = zipfile.ZIP_STORED if level == LEVEL_STORED else zipfile.ZIP_DEFLATED
+        with open_artifact(zip_path, 'wb') as output, \
+                zipfile.ZipFile(output, 'w', compression, compresslevel=level or None) as zipf:
+            for source_path, arcname in entries:
+                zip_info = zipfile.ZipInfo(arcname, time.localtime(artifact_mtime(source_path))[:6])
+                zip_info.compress_type = compression
+                zip_info.file_size = artifact_size(source_path)
+                with open_artifact(source_path) as source, zipf.open(zip_info, 'w') as entry:
+                    shutil.copyfileobj(source, entry, CHUNK_SIZE)
+
+    def layer_folder_name(self, layer_upload_info: LayerUploadInfo) -> str:
+        # One folder per layer, so that layers with the same name can be exported in parallel
+        return re.sub(r'[^\w\-]', '_', layer_upload_info.qgis_id)
+
+    def check_published_layer(self, layer_upload_info: LayerUploadInfo, on_done, on_error):
+        """
+        Looks up the CartoVista layer published from this QGIS layer, if any. Unchanged
+        layers are marked to reuse it, changed ones will update it instead of creating a new layer.
+        """
+        record = PublishRegistry.get(layer_upload_info.qgis_id, API_CLIENT.tenant_url_code)
+        if record is None or not layer_upload_info.scope.is_all:
+            on_done()
+            return
+        on_found = partial(self._on_published_layer_found, layer_upload_info, record, on_done)
+        on_not_found = partial(self._on_published_layer_not_found, layer_upload_info, record, on_done)
+        API_CLIENT.get_layer(record["cv_id"], on_found, on_not_found, deadline=layer_upload_info.deadline)
+
+    def _on_published_layer_found(self, layer_upload_info: LayerUploadInfo, record: dict, on_done, _):
+        layer_upload_info.cv_id = record["cv_id"]
+        layer_upload_info.cv_identifier = record["cv_identifier"]
+        layer_upload_info.reuse_remote_layer = layer_upload_info.fingerprint is not None and layer_upload_info.fingerprint == record["fingerprint"]
+        on_done()
+
+    def _on_published_layer_not_found(self, layer_upload_info: LayerUploadInfo, record: dict, on_done, e):
+        if getattr(e, 'status', None) == 404:
+            # Deleted in CartoVista since the last publish
+            PublishRegistry.forget(layer_upload_info.qgis_id)
+        else:
+            # Could not check, update the layer and fall back to creating it if it is gone
+            layer_upload_info.cv_id = record["cv_id"]
+        on_done()
+
+    def record_published_layer(self, layer_upload_info: LayerUploadInfo):
+        if not layer_upload_info.scope.is_all:
+            # A part of the layer is a new CartoVista layer, the record keeps the whole layer
+            return
+        PublishRegistry.record(layer_upload_info.qgis_id, API_CLIENT.tenant_url_code, layer_upload_info.cv_id, layer_upload_info.cv_identifier, layer_upload_info.fingerprint,
+                               layer_upload_info.upload_signature)
+
+    def publish_by_reference(self, layer_upload_info: LayerUploadInfo, on_done):
+        """
+        Creates the CartoVista layer from the service of the layer, or points the previously
+        published layer to it and synchronizes it. When CartoVista can't read the service, or
+        a WFS can't return all the features of the layer at once, the layer is uploaded as a
+        copy by the next stages.
+        """
+        reference = layer_upload_info.service_reference
+        if reference is None or layer_upload_info.reuse_remote_layer:
+            on_done()
+            return
+        if "capabilities_url" in reference and "count_default" not in reference:
+            ASYNC_MANAGER.setup_thread(partial(self._on_service_limit, layer_upload_info, on_done),
+                                       partial(self._on_service_limit_error, layer_upload_info, on_done),
+                                       wfs_count_default, reference["capabilities_url"])
+            return
+        on_published = partial(self._on_published_by_reference, layer_upload_info, on_done)
+        on_error = partial(self._on_publish_by_reference_error, layer_upload_info, on_done)
+        if layer_upload_info.cv_id is not None:
+            on_updated = partial(self._synchronize_service_layer, layer_upload_info, on_published, on_error)
+            API_CLIENT.update_layer_service_url_api(layer_upload_info.cv_id, reference["url"], on_updated, on_error,
+                                                    deadline=layer_upload_info.deadline)
+        else:
+            API_CLIENT.create_layer_from_service_api(layer_upload_info.layer_name, reference["service"], reference["url"],
+                                                     on_published, on_error, deadline=layer_upload_info.deadline)
+
+    def _on_service_limit(self, layer_upload_info: LayerUploadInfo, on_done, count_default):
+        if count_default is not None and layer_upload_info.feature_count > count_default:
+            QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: the service returns at most {count_default} of its "
+                                     f"{layer_upload_info.feature_count} features at once, uploading a copy instead",
+                                     'CartoVista', Qgis.MessageLevel.Info)
+            layer_upload_info.service_reference = None
+            on_done()
+            return
+        layer_upload_info.service_reference["count_default"] = count_default
+        self.publish_by_reference(layer_upload_info, on_done)
+
+    @staticmethod
+    def _on_service_limit_error(layer_upload_info: LayerUploadInfo, on_done, e):
+        QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: could not read the capabilities of the service ({e}), "
+                                 "uploading a copy instead", 'CartoVista', Qgis.MessageLevel.Info)
+        layer_upload_info.service_reference = None
+        on_done()
+
+    @staticmethod
+    def _synchronize_service_layer(layer_upload_info: LayerUploadInfo, on_success, on_error, _):
+        API_CLIENT.synchronize_layer_api(layer_upload_info.cv_id, on_success, on_error, deadline=layer_upload_info.deadline)
+
+    def _on_published_by_reference(self, layer_upload_info: LayerUploadInfo, on_done, upload_response: Layer):
+        self.set_uploaded_layer(layer_upload_info, upload_response)
+        layer_upload_info.published_by_reference = True
+        QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: published from {layer_upload_info.service_reference['url']}",
+                                 'CartoVista', Qgis.MessageLevel.Info)
+        on_done()
+
+    @staticmethod
+    def _on_publish_by_reference_error(layer_upload_info: LayerUploadInfo, on_done, e):
+        QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: CartoVista could not publish the layer from its service "
+                                 f"({getattr(e, 'status', None) or e}), uploading a copy instead", 'CartoVista', Qgis.MessageLevel.Info)
+        layer_upload_info.service_reference = None
+        on_done()
+
     def upload_layer(self, layer_upload_info: LayerUploadInfo):
-        API_CLIENT.upload_layer_api(layer_upload_info.zip_path, partial(self._upload_layer_2, layer_upload_info), partial(self._on_upload_layer_error, layer_upload_info))
+        self.upload_layer_data(layer_upload_info, partial(self._upload_layer_2, layer_upload_info), partial(self._on_upload_layer_error, layer_upload_info))
+
+    def upload_layer_data(self, layer_upload_info: LayerUploadInfo, on_success, on_error):
+        """
+        Uploads the zipped layer without styling it, updating the previously published
+        CartoVista layer if there is one. on_success receives the CartoVista Layer.
+        """
+        if layer_upload_info.partition_zip_paths:
+            on_success = partial(self._append_partitions, layer_upload_info, on_success, on_error)
+        if layer_upload_info.cv_id is not None and self._upload_signature_changed(layer_upload_info):
+            QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: the format or fields changed since the last publish, "
+                                     "publishing a new layer", 'CartoVista', Qgis.MessageLevel.Info)
+            layer_upload_info.cv_id = None
+            layer_upload_info.cv_identifier = None
+        size = artifact_size(layer_upload_info.zip_path)
+        if size >= PluginSettings.int_value(CHUNKED_UPLOAD_THRESHOLD):
+            self.upload_layer_data_chunked(layer_upload_info, on_success, on_error)
+            return
+        on_success = partial(self._on_layer_data_uploaded, size, time.monotonic(), on_success)
+        if layer_upload_info.cv_id is not None:
+            on_update_error = partial(self._on_update_layer_data_error, layer_upload_info, on_success, on_error)
+            API_CLIENT.update_layer_from_zip_api(layer_upload_info.cv_id, layer_upload_info.zip_path, on_success, on_update_error,
+                                                 deadline=layer_upload_info.deadline)
+        else:
+            API_CLIENT.upload_layer_api(layer_upload_info.zip_path, on_success, on_error, deadline=layer_upload_info.deadline)
+
+    @staticmethod
+    def _upload_signature_changed(layer_upload_info: LayerUploadInfo) -> bool:
+        """Whether the published layer was uploaded from a file of another format or schema, when both are known"""
+        record = PublishRegistry.get(layer_upload_info.qgis_id, API_CLIENT.tenant_url_code)
+        signature = layer_upload_info.upload_signature
+        if record is None or record["cv_id"] != layer_upload_info.cv_id or signature is None or "upload_format" not in record:
+            return False
+        return any(record.get(key) != value for key, value in signature.items())
+
+    def _append_partitions(self, layer_upload_info: LayerUploadInfo, on_success, on_error, upload_response: Layer):
+        """Appends the other partitions to the layer created from the first one, in any order"""
+        pending = {"count": len(layer_upload_info.partition_zip_paths), "failed": False}
+        on_appended = partial(self._on_partition_appended, pending, on_success, upload_response)
+        on_append_error = partial(self._on_partition_append_error, layer_upload_info, pending, on_error, upload_response)
+        for path in layer_upload_info.partition_zip_paths:
+            API_CLIENT.append_to_layer_api(upload_response.system_identifier, path, on_appended, on_append_error,
+                                           deadline=layer_upload_info.deadline)
+
+    @staticmethod
+    def _on_partition_appended(pending: dict, on_success, upload_response: Layer, _):
+        pending["count"] -= 1
+        if pending["count"] == 0 and not pending["failed"]:
+            on_success(upload_response)
+
+    def _on_partition_append_error(self, layer_upload_info: LayerUploadInfo, pending: dict, on_error, upload_response: Layer, e):
+        if not pending["failed"]:
+            pending["failed"] = True
+            # The layer exists with part of the features, the retry replaces it as a whole
+            self.set_uploaded_layer(layer_upload_info, upload_response)
+            QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: appending a partition failed, the layer was "
+                                     "published partially", 'CartoVista', Qgis.MessageLevel.Warning)
+            on_error(e)
+
+    @staticmethod
+    def _on_layer_data_uploaded(size: int, started: float, on_success, upload_response: Layer):
+        # Feeds the compression policy of the next layers. Includes the server processing
+        # of the zip, which makes the estimate err on the side of compressing more
+        UploadBandwidth.record(size, time.monotonic() - started)
+        on_success(upload_response)
+
+    def upload_layer_data_chunked(self, layer_upload_info: LayerUploadInfo, on_success, on_error):
+        """
+        Sends the zip in parts through the portal upload. A failed upload of the same zip
+        is resumed from its last acknowledged part instead of starting over.
+        """
+        chunked_upload = self.chunked_uploads.get(layer_upload_info.qgis_id)
+        upload_state = layer_upload_info.upload_state
+        if chunked_upload is None and upload_state and upload_state.get("zip_token") == layer_upload_info.zip_token:
+            # Interrupted in a previous session
+            chunked_upload = ChunkedUpload(layer_upload_info.zip_path, layer_upload_info.layer_name, layer_upload_info.cv_id,
+                                           layer_upload_info.zip_token, upload_state["upload_id"], upload_state["next_part"],
+                                           upload_state["part_size"], layer_upload_info.deadline)
+            self.chunked_uploads[layer_upload_info.qgis_id] = chunked_upload
+        if chunked_upload is None or chunked_upload.zip_token != layer_upload_info.zip_token:
+            chunked_upload = ChunkedUpload(layer_upload_info.zip_path, layer_upload_info.layer_name, layer_upload_info.cv_id,
+                                           layer_upload_info.zip_token, deadline=layer_upload_info.deadline)
+            self.chunked_uploads[layer_upload_info.qgis_id] = chunked_upload
+        else:
+            self._disconnect_chunked_upload(chunked_upload)
+            # Resumed by a new publish
+            chunked_upload.deadline = layer_upload_info.deadline
+        chunked_upload.finished.connect(partial(self._on_chunked_upload_finished, layer_upload_info, on_success))
+        chunked_upload.failed.connect(on_error)
+        chunked_upload.start()
+
+    def _on_chunked_upload_finished(self, layer_upload_info: LayerUploadInfo, on_success, layer: Layer):
+        chunked_upload = self.chunked_uploads.pop(layer_upload_info.qgis_id, None)
+        if chunked_upload is not None:
+            self._disconnect_chunked_upload(chunked_upload)
+            chunked_upload.deleteLater()
+        on_success(layer)
+
+    def chunked_upload_state(self, layer_upload_info: LayerUploadInfo):
+        """State of the unfinished chunked upload of the layer, if any"""
+        chunked_upload = self.chunked_uploads.get(layer_upload_info.qgis_id)
+        return chunked_upload.state() if chunked_upload is not None else None
+
+    @staticmethod
+    def _disconnect_chunked_upload(chunked_upload: ChunkedUpload):
+        for signal in (chunked_upload.finished, chunked_upload.failed):
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass
+
+    def _on_update_layer_data_error(self, layer_upload_info: LayerUploadInfo, on_success, on_error, e):
+        if getattr(e, 'status', None) not in UPDATE_REJECTED_STATUSES:
+            on_error(e)
+            return
+        QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: CartoVista could not update the layer ({e.status}), "
+                                 "publishing a new layer", 'CartoVista', Qgis.MessageLevel.Info)
+        layer_upload_info.cv_id = None
+        layer_upload_info.cv_identifier = None
+        API_CLIENT.upload_layer_api(layer_upload_info.zip_path, on_success, on_error, deadline=layer_upload_info.deadline)
+
+    def set_uploaded_layer(self, layer_upload_info: LayerUploadInfo, upload_response: Layer):
+        layer_upload_info.cv_id = upload_response.system_identifier
+        layer_upload_info.cv_identifier = upload_response.unique_identifier
             
     def _upload_layer_2(self, layer_upload_info: LayerUploadInfo, upload_response: Layer):
-        # Get layer styles
-        cv_layer_id = upload_response.system_identifier
-        layer_upload_info.cv_id = cv_layer_id
-        layer_upload_info.cv_identifier = upload_response.unique_identifier
+        self.set_uploaded_layer(layer_upload_info, upload_response)
+        self.style_layer(layer_upload_info)
 
-        if layer_upload_info.done_with_geometry_style and layer_upload_info.common_settings_non_default():
+    def style_layer(self, layer_upload_info: LayerUploadInfo):
+        """Applies the QGIS styles to the uploaded layer, then emits layer_uploaded."""
+        if layer_upload_info.done_with_geometry_style and layer_upload_info.done_with_other_layer_settings:
             layer_upload_info.status = LayerUploadStatus.COMPLETE
             self.layer_uploaded.emit(layer_upload_info)
             return
         
-        API_CLIENT.get_layer_default_settings(cv_layer_id, partial(self._upload_layer_3, layer_upload_info), partial(self._on_get_layer_default_settings_failed, layer_upload_info))
+        API_CLIENT.get_layer_default_settings(layer_upload_info.cv_id, partial(self._upload_layer_3, layer_upload_info), partial(self._on_get_layer_default_settings_failed, layer_upload_info),
+                                              deadline=layer_upload_info.deadline)
     
     def _upload_layer_3(self, layer_upload_info: LayerUploadInfo, upload_layer_default_settings):
         layer_upload_info.cv_default_layer_settings_id = upload_layer_default_settings.id
@@ -100,7 +513,7 @@ class LayerUploadHelper(QObject):
         label_settings = layer_upload_info.layer.labeling().settings()
         on_success = partial(self._get_column_id_for_labeling_success, layer_upload_info)
         on_failure = partial(self._get_column_id_for_labeling_style_failure, layer_upload_info)
-        API_CLIENT.get_data_column(layer_upload_info.cv_id, label_settings.fieldName, on_success, on_failure)
+        API_CLIENT.get_data_column(layer_upload_info.cv_id, label_settings.fieldName, on_success, on_failure, deadline=layer_upload_info.deadline)
 
     def _get_column_id_for_labeling_style_failure(self, layer_upload_info: LayerUploadInfo, _):
         layer_upload_info.add_cv_labels = False
@@ -124,7 +537,8 @@ class LayerUploadHelper(QObject):
             'effects': None
         }
         on_complete = partial(self._on_upload_layer_style_success_or_error, False, layer_upload_info)
-        API_CLIENT.update_common_layer_settings(layer_upload_info.cv_default_layer_settings_id, common_layer_settings_update_param, on_complete, on_complete)
+        API_CLIENT.update_common_layer_settings(layer_upload_info.cv_default_layer_settings_id, common_layer_settings_update_param, on_complete, on_complete,
+                                                deadline=layer_upload_info.deadline)
 
     def _upload_layer_set_symbology(self, layer_upload_info: LayerUploadInfo):
         symbol: QgsSymbol = layer_upload_info.layer.renderer().symbol()
@@ -133,13 +547,13 @@ class LayerUploadHelper(QObject):
         on_complete = partial(self._on_upload_layer_style_success_or_error, True, layer_upload_info)
         if isinstance(symbol_layer, (QgsSimpleMarkerSymbolLayer, QgsSvgMarkerSymbolLayer)):
             style = get_marker_style(properties)
-            API_CLIENT.update_point_geometry_style(layer_upload_info.cv_default_layer_settings_id, style, on_complete, on_complete)
+            API_CLIENT.update_point_geometry_style(layer_upload_info.cv_default_layer_settings_id, style, on_complete, on_complete, deadline=layer_upload_info.deadline)
         elif isinstance(symbol_layer, QgsSimpleLineSymbolLayer):
             style = get_line_style(properties)
-            API_CLIENT.update_polyline_geometry_style(layer_upload_info.cv_default_layer_settings_id, style, on_complete, on_complete)
+            API_CLIENT.update_polyline_geometry_style(layer_upload_info.cv_default_layer_settings_id, style, on_complete, on_complete, deadline=layer_upload_info.deadline)
         elif isinstance(symbol_layer, (QgsSimpleFillSymbolLayer, QgsGradientFillSymbolLayer)):
             style = get_fill_style(properties)
-            API_CLIENT.update_polygon_geometry_style(layer_upload_info.cv_default_layer_settings_id, style, on_complete, on_complete)
+            API_CLIENT.update_polygon_geometry_style(layer_upload_info.cv_default_layer_settings_id, style, on_complete, on_complete, deadline=layer_upload_info.deadline)
         else:
             self._on_upload_layer_style_success_or_error(True, layer_upload_info, None)
 
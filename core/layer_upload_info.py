@@ -1,19 +1,73 @@
 from enum import Enum
 from .cartovista_styles import get_rendering_settings, get_visibility_ranges_settings
-from qgis.core import QgsVectorLayer, QgsFeatureRenderer
+from .database_export import pushdown_source
+from .export_settings import export_settings
+from .layer_fingerprint import layer_fingerprint
+from .layer_partitions import partition_count
+from .publish_scope import PublishScope
+from .service_layers import service_reference
+from .source_passthrough import passthrough_files
+from qgis.core import QgsVectorLayer, QgsFeatureRenderer, QgsVectorLayerFeatureSource, QgsCoordinateTransformContext, QgsProject
 
 class LayerUploadInfo:
-  def __init__(self, layer: QgsVectorLayer):
+  def __init__(self, layer: QgsVectorLayer, scope: PublishScope = None):
     self.qgis_id = layer.id()
     self.layer = layer
     self.layer_name = layer.name()
     self.size = None
     self.file_path = None
     self.zip_path = None
+    # Set each time the zip is written, tells a partial upload of a previous zip apart
+    self.zip_token = None
     self.cv_id = None
     self.cv_identifier = None
     self.cv_default_layer_settings_id = None
     self.status = LayerUploadStatus.PROGRESS
+
+    # Snapshot of the layer used by the export, so that it can run on a worker thread
+    self.crs = layer.crs()
+    self.fields = layer.fields()
+    self.wkb_type = layer.wkbType()
+    # Features to publish, None for all of them
+    self.scope = scope or PublishScope()
+    self.scope_request = self.scope.layer_request(layer)
+    self.feature_count = self.scope.feature_count(layer)
+    self.transform_context = QgsCoordinateTransformContext(QgsProject.instance().transformContext())
+    self.feature_source = QgsVectorLayerFeatureSource(layer)
+
+    # Options of the export, see export_settings
+    self.export_settings = export_settings(layer, self.scope)
+    # Vertex and size reduction of the export, for the log
+    self.export_report = None
+    # Service CartoVista publishes the layer from instead of a copy, see service_reference.
+    # Cleared when CartoVista can't read the service
+    self.service_reference = service_reference(layer, self.export_settings)
+    self.published_by_reference = False
+    # Source files zipped as is instead of exporting the layer, see passthrough_files
+    self.source_files = passthrough_files(layer, self.export_settings)
+    # Database export done by GDAL instead of reading the features, see pushdown_source
+    self.pushdown_source = None if self.source_files else pushdown_source(layer, self.export_settings)
+
+    # Very large layers are exported in partitions, each read from its own feature source.
+    # The first partition uses file_path and zip_path, the others are appended to the layer
+    self.partition_count = 1 if self.source_files or self.pushdown_source or self.service_reference or not self.scope.is_all \
+      else partition_count(self.feature_count)
+    self.partition_sources = [QgsVectorLayerFeatureSource(layer) for _ in range(self.partition_count - 1)]
+    self.partition_paths = []
+    self.partition_zip_paths = []
+
+    # Set when the layer was already published and did not change since
+    self.fingerprint = layer_fingerprint(layer, self.export_settings)
+    self.reuse_remote_layer = False
+    # Format and schema of the uploaded file, see upload_signature. Set by the export
+    self.upload_signature = None
+
+    # Restored from the publish journal when a publish is resumed
+    self.done_stages = set()
+    self.upload_state = None
+    self.error = None
+    # Deadline of the publish, bounds the requests made for the layer. Set by the UploadPipeline
+    self.deadline = None
     
     renderer: QgsFeatureRenderer = layer.renderer()
     style_type = renderer.type()
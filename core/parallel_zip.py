@@ -0,0 +1,147 @@
+"""
+Single entry zip archives deflated on several threads, pigz style
+"""
+
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .artifacts import artifact_mtime, artifact_size, open_artifact
+
+# Size of the blocks compressed independently
+BLOCK_SIZE = 1024 * 1024
+# Deflate window, each block is primed with this much of the data before it
+WINDOW_SIZE = 32 * 1024
+
+ZIP64_LIMIT = 0xFFFFFFFF
+DEFLATED = 8
+VERSION_DEFLATE = 20
+VERSION_ZIP64 = 45
+UTF8_FLAG = 0x800
+
+
+def compress_block(data: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    """
+    Raw deflate of one block. Blocks end on a sync flush, which aligns them on a byte
+    boundary without closing the stream, so the compressed blocks concatenate into a
+    single valid deflate stream. zlib releases the GIL while compressing.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary) if dictionary \
+        else zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def dos_date_time(timestamp: float):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return date, dos_time
+
+
+def write_parallel_deflate_zip(zip_path: str, source_path: str, arcname: str, level: int = 6,
+                               workers: int = None, block_size: int = BLOCK_SIZE, force_zip64: bool = False):
+    """
+    Writes source_path as the single deflated entry arcname of a new zip archive.
+    Both paths can be on disk or in memory (/vsimem/).
+
+    The output is a standard zip (ZIP64 when the entry needs it) that any unzip tool reads
+    the same as one written by zipfile with ZIP_DEFLATED, but the blocks are compressed in
+    parallel. Each block uses the last 32 KB of the previous block as preset dictionary so
+    the compression ratio stays close to a single stream.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    size = artifact_size(source_path)
+    date, dos_time = dos_date_time(artifact_mtime(source_path))
+    name = arcname.encode('utf-8')
+    flags = UTF8_FLAG if not arcname.isascii() else 0
+    # Deflated data can be slightly larger than its input
+    zip64 = force_zip64 or size + size // 1000 + 1024 >= ZIP64_LIMIT
+
+    with open_artifact(source_path) as source, open_artifact(zip_path, 'wb') as output, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        local_header_offset = output.tell()
+        output.write(_local_header(name, flags, date, dos_time, 0, 0, size, zip64))
+
+        crc = 0
+        compressed_size = 0
+        pending = deque()
+        dictionary = b''
+        position = 0
+        while True:
+            # Enough blocks in flight to keep the workers busy, without reading the whole file
+            while position < size and len(pending) < workers * 2:
+                block = source.read(block_size)
+                if not block:
+                    break
+                position += len(block)
+                crc = zlib.crc32(block, crc)
+                pending.append(executor.submit(compress_block, block, dictionary, level, position >= size))
+                dictionary = (dictionary + block)[-WINDOW_SIZE:]
+            if not pending:
+                break
+            data = pending.popleft().result()
+            output.write(data)
+            compressed_size += len(data)
+
+        if size == 0:
+            data = compress_block(b'', b'', level, True)
+            output.write(data)
+            compressed_size += len(data)
+        if position != size:
+            raise IOError(f"{source_path} changed size while it was being compressed")
+
+        central_directory_offset = output.tell()
+        output.seek(local_header_offset)
+        output.write(_local_header(name, flags, date, dos_time, crc, compressed_size, size, zip64))
+        output.seek(central_directory_offset)
+
+        central_directory = _central_directory_header(name, flags, date, dos_time, crc, compressed_size, size,
+                                                      local_header_offset, zip64)
+        output.write(central_directory)
+        central_directory_end = output.tell()
+        if zip64 or central_directory_offset >= ZIP64_LIMIT:
+            output.write(_zip64_end_records(len(central_directory), central_directory_offset, central_directory_end))
+        output.write(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, 1, 1, len(central_directory),
+            min(central_directory_offset, ZIP64_LIMIT), 0))
+
+
+def _local_header(name: bytes, flags: int, date: int, dos_time: int, crc: int, compressed_size: int, size: int, zip64: bool) -> bytes:
+    extra = b''
+    if zip64:
+        # Sizes go in the ZIP64 extra field, the header keeps the same length once patched
+        extra = struct.pack('<HHQQ', 0x0001, 16, size, compressed_size)
+        size = compressed_size = ZIP64_LIMIT
+    return struct.pack(
+        '<IHHHHHIIIHH', 0x04034b50, VERSION_ZIP64 if zip64 else VERSION_DEFLATE, flags, DEFLATED,
+        dos_time, date, crc, compressed_size, size, len(name), len(extra)) + name + extra
+
+
+def _central_directory_header(name: bytes, flags: int, date: int, dos_time: int, crc: int, compressed_size: int, size: int,
+                              offset: int, zip64: bool) -> bytes:
+    extra_values = []
+    if zip64:
+        extra_values += [size, compressed_size]
+        size = compressed_size = ZIP64_LIMIT
+    if offset >= ZIP64_LIMIT:
+        extra_values.append(offset)
+        offset = ZIP64_LIMIT
+    extra = b''
+    if extra_values:
+        extra = struct.pack(f'<HH{len(extra_values)}Q', 0x0001, 8 * len(extra_values), *extra_values)
+    version = VERSION_ZIP64 if extra else VERSION_DEFLATE
+    return struct.pack(
+        '<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, flags, DEFLATED, dos_time, date,
+        crc, compressed_size, size, len(name), len(extra), 0, 0, 0, 0, offset) + name + extra
+
+
+def _zip64_end_records(central_directory_size: int, central_directory_offset: int, zip64_end_offset: int) -> bytes:
+    end_record = struct.pack(
+        '<IQHHIIQQQQ', 0x06064b50, 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0, 1, 1,
+        central_directory_size, central_directory_offset)
+    locator = struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+    return end_record + locator
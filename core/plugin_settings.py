@@ -0,0 +1,212 @@
+"""
+User configurable plugin settings, stored in the QGIS settings under add_to_cartovista/
+"""
+
+import os
+from qgis.PyQt.QtCore import QSettings
+
+SETTINGS_GROUP = "add_to_cartovista"
+
+# Worker pools
+MAX_CPU_WORKERS = "max_cpu_workers"
+MAX_NETWORK_WORKERS = "max_network_workers"
+
+# Connections kept alive to CartoVista, shared by every API call
+HTTP_POOL_MAXSIZE = "http_pool_maxsize"
+
+# Timeouts of the API requests in seconds. Uploads wait HTTP_READ_TIMEOUT_PER_MB more per
+# MB for the answer. PUBLISH_DEADLINE bounds the requests and retries of a publish, 0 for none
+HTTP_CONNECT_TIMEOUT = "http_connect_timeout"
+HTTP_READ_TIMEOUT = "http_read_timeout"
+HTTP_READ_TIMEOUT_PER_MB = "http_read_timeout_per_mb"
+PUBLISH_DEADLINE = "publish_deadline"
+
+# JSON and XML request bodies of at least GZIP_MIN_BYTES bytes are sent compressed with gzip
+GZIP_REQUESTS = "gzip_requests"
+GZIP_MIN_BYTES = "gzip_min_bytes"
+
+# Retries of failed API requests: HTTP_RETRY_ATTEMPTS attempts in total, waiting a random
+# time up to HTTP_RETRY_BASE_DELAY * 2^n seconds, or Retry-After, at most HTTP_RETRY_MAX_DELAY
+HTTP_RETRY_ATTEMPTS = "http_retry_attempts"
+HTTP_RETRY_BASE_DELAY = "http_retry_base_delay"
+HTTP_RETRY_MAX_DELAY = "http_retry_max_delay"
+
+# Concurrent API requests, adapted between 1 and the maximum from the latency and the
+# throttling of the server. Uploads use the bulk budget and threads, other calls the
+# control budget, so that small calls never wait for an upload
+API_BULK_CONCURRENCY = "api_bulk_concurrency"
+API_BULK_CONCURRENCY_MAX = "api_bulk_concurrency_max"
+API_CONTROL_CONCURRENCY = "api_control_concurrency"
+API_CONTROL_CONCURRENCY_MAX = "api_control_concurrency_max"
+
+# Upload pipeline
+PIPELINE_QUEUE_SIZE = "pipeline_queue_size"
+
+# Feature sync: request payload size is adapted between the min and max so that
+# each request takes about SYNC_TARGET_SECONDS
+SYNC_BATCH_BYTES = "sync_batch_bytes"
+SYNC_MIN_BATCH_BYTES = "sync_min_batch_bytes"
+SYNC_MAX_BATCH_BYTES = "sync_max_batch_bytes"
+SYNC_TARGET_SECONDS = "sync_target_seconds"
+
+# Chunked uploads: zips of at least CHUNKED_UPLOAD_THRESHOLD bytes are sent in parts.
+# FINALIZE_TIMEOUT is how long the server may take to create the layer from the parts
+CHUNKED_UPLOAD_THRESHOLD = "chunked_upload_threshold"
+UPLOAD_PART_SIZE = "upload_part_size"
+UPLOAD_PART_RETRIES = "upload_part_retries"
+UPLOAD_RETRY_DELAY = "upload_retry_delay"
+FINALIZE_TIMEOUT = "finalize_timeout"
+
+# Zip compression: GeoPackages of at least PARALLEL_ZIP_MIN_SIZE bytes are deflated on ZIP_WORKERS threads
+ZIP_COMPRESSION_LEVEL = "zip_compression_level"
+PARALLEL_ZIP_MIN_SIZE = "parallel_zip_min_size"
+ZIP_WORKERS = "zip_workers"
+
+# Compression policy: "auto" picks stored, the fast or the strong level per layer from
+# a compressibility sample and UPLOAD_BANDWIDTH, "fixed" always uses ZIP_COMPRESSION_LEVEL
+COMPRESSION_POLICY = "compression_policy"
+COMPRESSION_FAST_LEVEL = "compression_fast_level"
+COMPRESSION_STRONG_LEVEL = "compression_strong_level"
+# Measured upload bandwidth in bytes per second, updated after each upload
+UPLOAD_BANDWIDTH = "upload_bandwidth"
+
+# Export: layers are written to GDAL's in-memory file system (/vsimem/) as long as the
+# in-memory GeoPackages and zips of all layers hold at most MEMORY_EXPORT_CEILING bytes,
+# the artifacts that don't fit are written to disk
+EXPORT_TO_MEMORY = "export_to_memory"
+MEMORY_EXPORT_CEILING = "memory_export_ceiling"
+
+# Geometry reduction: coordinates are snapped to COORDINATE_PRECISION degrees (0 disables it)
+# and simplified below half a pixel at the layer's most zoomed in visible scale, or at
+# SIMPLIFY_SCALE. Layers can override both with custom properties, see geometry_reduction
+COORDINATE_PRECISION = "coordinate_precision"
+SIMPLIFY_GEOMETRIES = "simplify_geometries"
+SIMPLIFY_SCALE = "simplify_scale"
+
+# Uploaded attributes: binary fields and fields with a hidden widget are not uploaded.
+# PRUNE_ATTRIBUTES keeps only the fields used by labels, map tips and styles plus the
+# comma separated KEEP_FIELDS. NARROW_FIELD_TYPES makes 64 bit integer fields 32 bit when
+# all their values fit
+PRUNE_ATTRIBUTES = "prune_attributes"
+KEEP_FIELDS = "keep_fields"
+NARROW_FIELD_TYPES = "narrow_field_types"
+
+# Source passthrough: layers that are a whole file of one of the comma separated
+# PASSTHROUGH_FORMATS (OGR driver names) with multi geometries, in EPSG:4326 or in their
+# own CRS with the native UPLOAD_CRS_MODE, are zipped without being exported
+SOURCE_PASSTHROUGH = "source_passthrough"
+PASSTHROUGH_FORMATS = "passthrough_formats"
+
+# Upload CRS: "reproject" to EPSG:4326 on the client (default), "native" to upload in the
+# layer CRS and let CartoVista reproject, "auto" to upload in the layer CRS when reprojecting
+# it is estimated to take at least NATIVE_CRS_MIN_SECONDS
+UPLOAD_CRS_MODE = "upload_crs_mode"
+NATIVE_CRS_MIN_SECONDS = "native_crs_min_seconds"
+
+# Partitioned export: layers of at least PARTITION_MIN_FEATURES features are exported in
+# PARTITION_COUNT feature id ranges in parallel, and uploaded as one layer plus appends
+PARTITION_MIN_FEATURES = "partition_min_features"
+PARTITION_COUNT = "partition_count"
+
+# PostGIS and GeoPackage layers are exported by GDAL, with the reprojection, the filters
+# and the column selection done by the database
+DATABASE_PUSHDOWN = "database_pushdown"
+
+# ArcGIS feature service, WFS and OGC API Features layers are published by reference to
+# their service, and uploaded as a copy only when CartoVista can't read the service
+SERVICE_REFERENCE = "service_reference"
+
+# GeoPackages are written without spatial index, journal, fsync and metadata tables, with
+# pages of GPKG_PAGE_SIZE bytes (0 for the SQLite default)
+UPLOAD_WRITER_PROFILE = "upload_writer_profile"
+GPKG_PAGE_SIZE = "gpkg_page_size"
+
+# Publish journal
+JOB_RETENTION_DAYS = "job_retention_days"
+
+DEFAULTS = {
+    MAX_CPU_WORKERS: max(1, (os.cpu_count() or 2) - 1),
+    MAX_NETWORK_WORKERS: 4,
+    HTTP_POOL_MAXSIZE: 10,
+    HTTP_CONNECT_TIMEOUT: 15.0,
+    HTTP_READ_TIMEOUT: 120.0,
+    HTTP_READ_TIMEOUT_PER_MB: 2.0,
+    PUBLISH_DEADLINE: 4 * 3600,
+    GZIP_REQUESTS: True,
+    GZIP_MIN_BYTES: 16 * 1024,
+    HTTP_RETRY_ATTEMPTS: 5,
+    HTTP_RETRY_BASE_DELAY: 1.0,
+    HTTP_RETRY_MAX_DELAY: 60.0,
+    API_BULK_CONCURRENCY: 2,
+    API_BULK_CONCURRENCY_MAX: 4,
+    API_CONTROL_CONCURRENCY: 4,
+    API_CONTROL_CONCURRENCY_MAX: 6,
+    PIPELINE_QUEUE_SIZE: 2,
+    SYNC_BATCH_BYTES: 256 * 1024,
+    SYNC_MIN_BATCH_BYTES: 16 * 1024,
+    SYNC_MAX_BATCH_BYTES: 8 * 1024 * 1024,
+    SYNC_TARGET_SECONDS: 2.0,
+    CHUNKED_UPLOAD_THRESHOLD: 32 * 1024 * 1024,
+    UPLOAD_PART_SIZE: 8 * 1024 * 1024,
+    UPLOAD_PART_RETRIES: 5,
+    UPLOAD_RETRY_DELAY: 2.0,
+    FINALIZE_TIMEOUT: 1800.0,
+    JOB_RETENTION_DAYS: 7.0,
+    ZIP_COMPRESSION_LEVEL: 6,
+    PARALLEL_ZIP_MIN_SIZE: 8 * 1024 * 1024,
+    ZIP_WORKERS: max(1, os.cpu_count() or 1),
+    COMPRESSION_POLICY: "auto",
+    COMPRESSION_FAST_LEVEL: 1,
+    COMPRESSION_STRONG_LEVEL: 9,
+    UPLOAD_BANDWIDTH: 2 * 1024 * 1024,
+    EXPORT_TO_MEMORY: True,
+    MEMORY_EXPORT_CEILING: 256 * 1024 * 1024,
+    COORDINATE_PRECISION: 0.0,
+    SIMPLIFY_GEOMETRIES: False,
+    SIMPLIFY_SCALE: 1000.0,
+    PRUNE_ATTRIBUTES: False,
+    KEEP_FIELDS: "",
+    NARROW_FIELD_TYPES: True,
+    SOURCE_PASSTHROUGH: True,
+    PASSTHROUGH_FORMATS: "GPKG",
+    UPLOAD_CRS_MODE: "reproject",
+    NATIVE_CRS_MIN_SECONDS: 5.0,
+    PARTITION_MIN_FEATURES: 1000000,
+    PARTITION_COUNT: 4,
+    DATABASE_PUSHDOWN: True,
+    SERVICE_REFERENCE: True,
+    UPLOAD_WRITER_PROFILE: True,
+    GPKG_PAGE_SIZE: 0,
+}
+
+
+class PluginSettings:
+
+    @staticmethod
+    def value(key: str):
+        return QSettings().value(f"{SETTINGS_GROUP}/{key}", DEFAULTS.get(key))
+
+    @staticmethod
+    def int_value(key: str) -> int:
+        try:
+            return int(PluginSettings.value(key))
+        except (TypeError, ValueError):
+            return DEFAULTS[key]
+
+    @staticmethod
+    def float_value(key: str) -> float:
+        try:
+            return float(PluginSettings.value(key))
+        except (TypeError, ValueError):
+            return DEFAULTS[key]
+
+    @staticmethod
+    def bool_value(key: str) -> bool:
+        value = PluginSettings.value(key)
+        if isinstance(value, str):
+            return value.lower() in ("1", "true", "yes", "on")
+        return bool(value)
+
+    @staticmethod
+    def set_value(key: str, value):
+        QSettings().setValue(f"{SETTINGS_GROUP}/{key}", value)
@@ -0,0 +1,302 @@
+"""
+On-disk journal of publish jobs, so that a publish interrupted by a crash or by failed
+layers can be resumed without exporting and uploading the completed layers again
+"""
+
+import json
+import os.path
+import shutil
+import sqlite3
+import time
+from typing import List, Optional
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import Qgis, QgsApplication, QgsMessageLog, QgsProject
+
+from .artifacts import artifact_exists, artifact_size, is_in_memory, remove_artifact, remove_geopackage
+from .layer_upload_info import LayerUploadInfo, LayerUploadStatus
+from .plugin_settings import PluginSettings, JOB_RETENTION_DAYS
+from .publish_scope import PublishScope, PublishScopeError
+from .upload_pipeline import STAGE_CHECK, STAGE_EXPORT, STAGE_COMPRESS, STAGE_UPLOAD, STAGE_ORDER
+
+JOB_KIND_MAP = "map"
+JOB_KIND_LAYER = "layer"
+
+JOB_RUNNING = "running"
+JOB_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT,
+    tenant TEXT,
+    project_path TEXT,
+    artifact_dir TEXT,
+    status TEXT NOT NULL,
+    map_identifier TEXT,
+    scope TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_layers (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    qgis_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    layer_name TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    fingerprint TEXT,
+    cv_id TEXT,
+    cv_identifier TEXT,
+    file_path TEXT,
+    zip_path TEXT,
+    upload_state TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, qgis_id)
+);
+"""
+
+STATUS_NAMES = {
+    LayerUploadStatus.PROGRESS: "progress",
+    LayerUploadStatus.FAILED: "failed",
+    LayerUploadStatus.COMPLETE: "complete",
+}
+
+
+def journal_dir() -> str:
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "add_to_cartovista")
+
+
+def reusable_artifact(path: Optional[str]) -> bool:
+    """
+    Only artifacts on disk are reused by a resumed job. In-memory ones are released when
+    their layer finishes and don't survive QGIS, the layer is exported again instead.
+    """
+    return path is not None and not is_in_memory(path) and artifact_exists(path)
+
+
+class PublishJob:
+    """A publish journaled in the PublishJournal, with the folder holding its export artifacts"""
+
+    def __init__(self, journal: 'PublishJournal', row: sqlite3.Row):
+        self.journal = journal
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.name = row["name"]
+        self.tenant = row["tenant"]
+        self.project_path = row["project_path"]
+        self.artifact_dir = row["artifact_dir"]
+        self.status = row["status"]
+        self.map_identifier = row["map_identifier"]
+        self.scope = PublishScope.from_json(row["scope"])
+        self.created_at = row["created_at"]
+
+    def add_layers(self, layers_upload_info: List[LayerUploadInfo]):
+        for position, layer_upload_info in enumerate(layers_upload_info):
+            self.record_layer(layer_upload_info, position=position)
+
+    def record_layer(self, layer_upload_info: LayerUploadInfo, stage: Optional[str] = None,
+                     upload_state: Optional[dict] = None, error=None, position: Optional[int] = None):
+        self.journal.record_layer(self.id, layer_upload_info, stage, upload_state, error, position)
+
+    def on_stage_finished(self, stage: str, layer_upload_info: LayerUploadInfo):
+        self.record_layer(layer_upload_info, stage)
+
+    def set_map_identifier(self, map_identifier: str):
+        self.map_identifier = map_identifier
+        self.journal.update_job(self.id, map_identifier=map_identifier)
+
+    def set_status(self, status: str):
+        self.status = status
+        self.journal.update_job(self.id, status=status)
+
+    def layer_rows(self) -> List[sqlite3.Row]:
+        return self.journal.layer_rows(self.id)
+
+    def failed_layer_names(self) -> List[str]:
+        return [row["layer_name"] for row in self.layer_rows() if row["status"] != STATUS_NAMES[LayerUploadStatus.COMPLETE]]
+
+    def restore_layers(self) -> List[LayerUploadInfo]:
+        """
+        LayerUploadInfo of the job layers still in the project. Completed layers are marked
+        COMPLETE, the others skip the stages whose artifacts are still valid.
+        """
+        layers_upload_info = []
+        project = QgsProject.instance()
+        for row in self.layer_rows():
+            layer = project.mapLayer(row["qgis_id"])
+            if layer is None:
+                continue
+            try:
+                layer_upload_info = LayerUploadInfo(layer, self.scope)
+            except PublishScopeError as e:
+                # The layer changed since, for instance its CRS
+                QgsMessageLog.logMessage(f"{layer.name()} is not resumed: {e}", 'CartoVista', Qgis.MessageLevel.Warning)
+                continue
+            layer_upload_info.cv_id = row["cv_id"]
+            layer_upload_info.cv_identifier = row["cv_identifier"]
+            if row["status"] == STATUS_NAMES[LayerUploadStatus.COMPLETE]:
+                layer_upload_info.status = LayerUploadStatus.COMPLETE
+                layer_upload_info.done_stages = set(STAGE_ORDER)
+            else:
+                layer_upload_info.done_stages = self._reusable_stages(row, layer_upload_info)
+                if row["upload_state"] and STAGE_COMPRESS in layer_upload_info.done_stages:
+                    # A partial upload only continues with the zip it was started from
+                    layer_upload_info.upload_state = json.loads(row["upload_state"])
+                    layer_upload_info.zip_token = layer_upload_info.upload_state.get("zip_token")
+            layers_upload_info.append(layer_upload_info)
+        return layers_upload_info
+
+    @staticmethod
+    def _reusable_stages(row: sqlite3.Row, layer_upload_info: LayerUploadInfo) -> set:
+        if row["stage"] not in STAGE_ORDER:
+            return set()
+        done = set(STAGE_ORDER[:STAGE_ORDER.index(row["stage"]) + 1])
+        if STAGE_UPLOAD in done:
+            # Uploaded, only the styling is left
+            return done
+        done.discard(STAGE_CHECK)
+        if layer_upload_info.partition_count > 1:
+            # The partitions are not journaled, they are exported again
+            return set()
+        # Artifacts are only reused when the layer provably did not change since
+        unchanged = layer_upload_info.fingerprint is not None and layer_upload_info.fingerprint == row["fingerprint"]
+        if not unchanged:
+            return set()
+        # The zip alone is enough to upload
+        if STAGE_COMPRESS in done and reusable_artifact(row["zip_path"]):
+            layer_upload_info.zip_path = row["zip_path"]
+            if reusable_artifact(row["file_path"]):
+                layer_upload_info.file_path = row["file_path"]
+                layer_upload_info.size = artifact_size(row["file_path"]) / 1024
+            return done
+        done.discard(STAGE_COMPRESS)
+        if STAGE_EXPORT in done and reusable_artifact(row["file_path"]):
+            layer_upload_info.file_path = row["file_path"]
+            layer_upload_info.size = artifact_size(row["file_path"]) / 1024
+            return done
+        return set()
+
+    def discard(self):
+        self.journal.delete_job(self.id)
+
+
+class PublishJournal:
+    """
+    SQLite store of the publish jobs in the QGIS profile folder. Every job gets a folder
+    next to the database for its exported GeoPackages and zips, deleted with the job.
+    Only used from the main thread.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or journal_dir()
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.directory, "publish_jobs.sqlite"))
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA foreign_keys = ON")
+            self._connection.executescript(SCHEMA)
+            columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+            if "scope" not in columns:
+                # Journals created before publish scopes existed
+                self._connection.execute("ALTER TABLE jobs ADD COLUMN scope TEXT")
+            self._connection.commit()
+        return self._connection
+
+    def create_job(self, kind: str, name: str, tenant: str, scope: Optional[PublishScope] = None) -> PublishJob:
+        now = time.time()
+        scope = scope.to_json() if scope is not None else None
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (kind, name, tenant, project_path, status, scope, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, name, tenant, QgsProject.instance().fileName(), JOB_RUNNING, scope, now, now))
+            job_id = cursor.lastrowid
+            artifact_dir = os.path.join(self.directory, "jobs", str(job_id))
+            self.connection.execute("UPDATE jobs SET artifact_dir = ? WHERE id = ?", (artifact_dir, job_id))
+        os.makedirs(artifact_dir, exist_ok=True)
+        return self.job(job_id)
+
+    def job(self, job_id: int) -> Optional[PublishJob]:
+        row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return PublishJob(self, row) if row is not None else None
+
+    def unfinished_job(self, kind: str, tenant: str) -> Optional[PublishJob]:
+        """Most recent job of the current project that did not complete"""
+        row = self.connection.execute(
+            "SELECT * FROM jobs WHERE kind = ? AND tenant = ? AND project_path = ? ORDER BY created_at DESC LIMIT 1",
+            (kind, tenant, QgsProject.instance().fileName())).fetchone()
+        return PublishJob(self, row) if row is not None else None
+
+    def update_job(self, job_id: int, **values):
+        values["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self.connection:
+            self.connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*values.values(), job_id))
+
+    def record_layer(self, job_id: int, layer_upload_info: LayerUploadInfo, stage: Optional[str] = None,
+                     upload_state: Optional[dict] = None, error=None, position: Optional[int] = None):
+        values = {
+            "layer_name": layer_upload_info.layer_name,
+            "status": STATUS_NAMES[layer_upload_info.status],
+            "fingerprint": layer_upload_info.fingerprint,
+            "cv_id": layer_upload_info.cv_id,
+            "cv_identifier": layer_upload_info.cv_identifier,
+            "file_path": layer_upload_info.file_path,
+            "zip_path": layer_upload_info.zip_path,
+        }
+        if stage is not None:
+            values["stage"] = stage
+        if upload_state is not None:
+            values["upload_state"] = json.dumps(upload_state)
+        if error is not None:
+            values["error"] = str(error)
+        with self.connection:
+            if position is not None:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO job_layers (job_id, qgis_id, position, status) VALUES (?, ?, ?, ?)",
+                    (job_id, layer_upload_info.qgis_id, position, values["status"]))
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            self.connection.execute(
+                f"UPDATE job_layers SET {assignments} WHERE job_id = ? AND qgis_id = ?",
+                (*values.values(), job_id, layer_upload_info.qgis_id))
+            self.connection.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def layer_rows(self, job_id: int) -> List[sqlite3.Row]:
+        return self.connection.execute("SELECT * FROM job_layers WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+
+    def delete_job(self, job_id: int):
+        job = self.job(job_id)
+        if job is None:
+            return
+        rows = self.layer_rows(job_id)
+        with self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if job.artifact_dir:
+            shutil.rmtree(job.artifact_dir, ignore_errors=True)
+        # In-memory artifacts are outside the job folder
+        for row in rows:
+            if is_in_memory(row["file_path"]):
+                remove_geopackage(row["file_path"])
+            if is_in_memory(row["zip_path"]):
+                remove_artifact(row["zip_path"])
+
+    def purge(self):
+        """Deletes the jobs not touched for longer than the retention period"""
+        cutoff = time.time() - PluginSettings.float_value(JOB_RETENTION_DAYS) * 24 * 3600
+        for row in self.connection.execute("SELECT id FROM jobs WHERE updated_at < ?", (cutoff,)).fetchall():
+            self.delete_job(row["id"])
+
+
+ # --- Singleton pattern using QCoreApplication ---
+def get_publish_journal():
+    app = QCoreApplication.instance()
+    if not hasattr(app, "_cv_plugin_publish_journal"):
+        app._cv_plugin_publish_journal = PublishJournal()
+    return app._cv_plugin_publish_journal
+
+PUBLISH_JOURNAL = get_publish_journal()
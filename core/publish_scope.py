@@ -0,0 +1,115 @@
+"""
+Publish modes limiting the published features of each layer to the map canvas extent,
+the selected features or a filter expression
+"""
+
+import hashlib
+import json
+from typing import Optional
+
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException, QgsExpression,
+                       QgsFeatureRequest, QgsProject, QgsRectangle, QgsVectorLayer)
+
+PUBLISH_ALL = "all"
+PUBLISH_EXTENT = "extent"
+PUBLISH_SELECTION = "selection"
+PUBLISH_EXPRESSION = "expression"
+
+
+class PublishScopeError(Exception):
+    pass
+
+
+class PublishScope:
+    """
+    Features of each layer to publish. The extent is in extent_crs, the expression is
+    evaluated on every layer of the publish.
+    """
+
+    def __init__(self, mode: str = PUBLISH_ALL, extent: Optional[QgsRectangle] = None,
+                 extent_crs: Optional[QgsCoordinateReferenceSystem] = None, expression: Optional[str] = None):
+        self.mode = mode
+        self.extent = extent
+        self.extent_crs = extent_crs
+        self.expression = expression
+
+    @property
+    def is_all(self) -> bool:
+        return self.mode == PUBLISH_ALL
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "mode": self.mode,
+            "extent": [self.extent.xMinimum(), self.extent.yMinimum(), self.extent.xMaximum(), self.extent.yMaximum()]
+            if self.extent is not None else None,
+            "extent_crs": self.extent_crs.toWkt() if self.extent_crs is not None else None,
+            "expression": self.expression,
+        })
+
+    @staticmethod
+    def from_json(value: Optional[str]) -> 'PublishScope':
+        """The scope saved by to_json, the selection is the current one"""
+        if not value:
+            return PublishScope()
+        data = json.loads(value)
+        extent = QgsRectangle(*data["extent"]) if data.get("extent") else None
+        extent_crs = QgsCoordinateReferenceSystem.fromWkt(data["extent_crs"]) if data.get("extent_crs") else None
+        return PublishScope(data.get("mode", PUBLISH_ALL), extent, extent_crs, data.get("expression"))
+
+    def validate(self):
+        if self.mode == PUBLISH_EXTENT and (self.extent is None or self.extent.isEmpty()):
+            raise PublishScopeError("The map extent is empty")
+        if self.mode == PUBLISH_EXPRESSION:
+            expression = QgsExpression(self.expression or "")
+            if not self.expression or expression.hasParserError():
+                raise PublishScopeError(f"Invalid filter expression: {expression.parserErrorString() or 'empty expression'}")
+
+    def layer_extent(self, layer: QgsVectorLayer) -> QgsRectangle:
+        """The extent in the layer CRS"""
+        if self.extent_crs is None or self.extent_crs == layer.crs():
+            return QgsRectangle(self.extent)
+        transform = QgsCoordinateTransform(self.extent_crs, layer.crs(), QgsProject.instance().transformContext())
+        try:
+            return transform.transformBoundingBox(self.extent)
+        except QgsCsException:
+            raise PublishScopeError(f"The map extent can't be expressed in the CRS of {layer.name()}")
+
+    def layer_expression(self, layer: QgsVectorLayer) -> str:
+        """The expression, when the layer has all the fields it refers to"""
+        missing = sorted(name for name in QgsExpression(self.expression).referencedColumns()
+                         if name != QgsFeatureRequest.ALL_ATTRIBUTES and layer.fields().lookupField(name) < 0)
+        if missing:
+            raise PublishScopeError(f"The filter expression refers to fields {layer.name()} does not have: {', '.join(missing)}")
+        return self.expression
+
+    def layer_request(self, layer: QgsVectorLayer) -> Optional[QgsFeatureRequest]:
+        """
+        Request reading the scoped features of the layer, None to read all of them. The
+        selection is copied, so the request can be used on a worker thread. Main thread only.
+        """
+        if self.mode == PUBLISH_EXTENT:
+            return QgsFeatureRequest().setFilterRect(self.layer_extent(layer))
+        if self.mode == PUBLISH_SELECTION:
+            return QgsFeatureRequest().setFilterFids(sorted(layer.selectedFeatureIds()))
+        if self.mode == PUBLISH_EXPRESSION:
+            return QgsFeatureRequest().setFilterExpression(self.layer_expression(layer))
+        return None
+
+    def layer_settings(self, layer: QgsVectorLayer) -> dict:
+        """What the scope selects in the layer, for the export settings"""
+        if self.mode == PUBLISH_EXTENT:
+            rectangle = self.layer_extent(layer)
+            return {"scope": self.mode, "scope_filter": [rectangle.xMinimum(), rectangle.yMinimum(),
+                                                          rectangle.xMaximum(), rectangle.yMaximum()]}
+        if self.mode == PUBLISH_SELECTION:
+            fids = ",".join(str(fid) for fid in sorted(layer.selectedFeatureIds()))
+            return {"scope": self.mode, "scope_filter": hashlib.sha1(fids.encode("utf-8")).hexdigest()}
+        if self.mode == PUBLISH_EXPRESSION:
+            return {"scope": self.mode, "scope_filter": self.layer_expression(layer)}
+        return {"scope": PUBLISH_ALL}
+
+    def feature_count(self, layer: QgsVectorLayer) -> int:
+        """Number of features to publish, an upper bound for the extent and the expression"""
+        if self.mode == PUBLISH_SELECTION:
+            return layer.selectedFeatureCount()
+        return layer.featureCount()
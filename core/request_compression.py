@@ -0,0 +1,59 @@
+"""
+gzip compression of the large JSON and XML request bodies sent to CartoVista
+"""
+
+import gzip
+import json
+import re
+from typing import Optional
+
+from add_to_cartovista.swagger_client import rest
+
+from .plugin_settings import PluginSettings, GZIP_REQUESTS, GZIP_MIN_BYTES
+from .transport_metrics import TRANSPORT_METRICS
+
+GZIP_LEVEL = 6
+# Content types sent as serialized strings by rest.RESTClientObject that are worth compressing
+TEXT_CONTENT_TYPE = re.compile(r'xml|^text/', re.IGNORECASE)
+# A 400 only rejects the compression when the server says that it could not decode the body
+DECODING_FAILURE = re.compile(r'gzip|content.?encoding|decompress|decod', re.IGNORECASE)
+
+
+def _encode_body(headers: dict, body) -> Optional[bytes]:
+    """The body as rest.RESTClientObject sends it, None when it isn't JSON or a text string"""
+    content_type = headers.get('Content-Type', 'application/json')
+    if re.search('json', content_type, re.IGNORECASE):
+        return json.dumps(body).encode('utf-8')
+    if isinstance(body, str) and TEXT_CONTENT_TYPE.search(content_type):
+        return body.encode('utf-8')
+    return None
+
+
+def gzip_request_body(method: str, headers: dict, body) -> Optional[bytes]:
+    """
+    The JSON or XML body encoded like rest.RESTClientObject does and compressed, or None
+    when the request has no such body, the body is under GZIP_MIN_BYTES or compression is
+    disabled
+    """
+    if body is None or method.upper() not in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        return None
+    if not PluginSettings.bool_value(GZIP_REQUESTS):
+        return None
+    data = _encode_body(headers, body)
+    if data is None or len(data) < PluginSettings.int_value(GZIP_MIN_BYTES):
+        return None
+    compressed = gzip.compress(data, GZIP_LEVEL)
+    TRANSPORT_METRICS.add("gzip_requests")
+    TRANSPORT_METRICS.add("gzip_bytes_in", len(data))
+    TRANSPORT_METRICS.add("gzip_bytes_out", len(compressed))
+    return compressed
+
+
+def compression_rejected(error: rest.ApiException) -> bool:
+    """The server can't read compressed bodies: 415, or a 400 about decoding the body"""
+    if error.status == 415:
+        return True
+    if error.status != 400 or not error.body:
+        return False
+    body = error.body.decode('utf-8', 'replace') if isinstance(error.body, bytes) else str(error.body)
+    return DECODING_FAILURE.search(body) is not None
@@ -0,0 +1,79 @@
+"""
+Connect and read timeouts of the API requests, and the deadline of a publish that bounds
+the timeouts and retries of every request it makes
+"""
+
+import time
+from typing import Optional, Tuple
+
+from add_to_cartovista.swagger_client import rest
+
+from .plugin_settings import (PluginSettings, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_READ_TIMEOUT_PER_MB,
+                              PUBLISH_DEADLINE)
+
+
+class DeadlineExceeded(rest.ApiException):
+    """The publish ran out of time, status 0 like the other transport failures"""
+
+    def __init__(self, reason: str = "Publish deadline exceeded"):
+        super().__init__(status=0, reason=reason)
+
+
+class Deadline:
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class BoundedTimeout:
+    """Timeout of a request that takes longer than the default ones, bounded by the deadline if any"""
+
+    def __init__(self, timeout, deadline: Optional[Deadline] = None):
+        self.timeout = timeout
+        self.deadline = deadline
+
+
+def publish_deadline() -> Optional[Deadline]:
+    """Deadline of a publish starting now, None when the PUBLISH_DEADLINE setting is 0"""
+    seconds = PluginSettings.float_value(PUBLISH_DEADLINE)
+    return Deadline(seconds) if seconds else None
+
+def default_timeout(upload_size: int = 0) -> Tuple[float, float]:
+    """
+    (connect, read) timeouts in seconds. The read timeout of uploads grows with their size,
+    for the time the server takes to process the file before it answers.
+    """
+    read = PluginSettings.float_value(HTTP_READ_TIMEOUT) + \
+        PluginSettings.float_value(HTTP_READ_TIMEOUT_PER_MB) * upload_size / 1024 / 1024
+    return PluginSettings.float_value(HTTP_CONNECT_TIMEOUT), read
+
+
+def timeout_and_deadline(_request_timeout, upload_size: int = 0) -> Tuple[object, Optional[Deadline]]:
+    """
+    The timeout and the deadline of a request from its _request_timeout: a timeout, a Deadline
+    bounding the default timeout, a BoundedTimeout or None for the default timeout
+    """
+    if isinstance(_request_timeout, BoundedTimeout):
+        return _request_timeout.timeout, _request_timeout.deadline
+    if isinstance(_request_timeout, Deadline):
+        return default_timeout(upload_size), _request_timeout
+    return _request_timeout or default_timeout(upload_size), None
+
+
+def request_timeout(timeout, deadline: Optional[Deadline]):
+    """timeout in seconds or as a (connect, read) tuple, as a tuple bounded by the deadline"""
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    if deadline is None:
+        return timeout
+    if deadline.expired:
+        raise DeadlineExceeded()
+    remaining = deadline.remaining()
+    return tuple(min(value, remaining) for value in timeout)
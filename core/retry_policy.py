@@ -0,0 +1,146 @@
+"""
+Retries of failed API requests with exponential backoff and full jitter, honouring
+Retry-After, limited to the requests that can be repeated without side effects
+"""
+
+import contextlib
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+import urllib3
+
+from .plugin_settings import PluginSettings, HTTP_RETRY_ATTEMPTS, HTTP_RETRY_BASE_DELAY, HTTP_RETRY_MAX_DELAY
+
+# Statuses of transient failures of the server or its load balancer
+RETRY_STATUSES = (429, 502, 503, 504)
+# Statuses telling that the request was refused before being processed
+REFUSED_STATUSES = (429, 503)
+# Statuses of an update of a layer that is gone or can't take the uploaded file, the
+# layer is created again instead
+UPDATE_REJECTED_STATUSES = (400, 404, 409, 422)
+
+# Methods of this API that read, or set values to what the request holds
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE")
+# POST endpoints giving the same result when repeated. Creates, appends, upload parts,
+# map layer additions and token requests are not in the list: they are only retried
+# when the server refused them or the connection could not be opened
+IDEMPOTENT_POSTS = [re.compile(pattern) for pattern in (
+    r"/Features/createUpdateFromGeoJSON$",
+    r"/updateFromZip$",
+    r"/updateFromFileDescription$",
+    r"/setDataColumnUniqueId$",
+    r"/synchronize$",
+    r"/update-layer-external-service-url$",
+    r"/Portal/upload/[^/]+/cancel$",
+)]
+
+
+# Attempt of the request made by the AsyncManager task running on the thread
+_scheduled = threading.local()
+
+
+class RetryScheduled(Exception):
+    """
+    Raised by a failed request to be retried after delay seconds. The AsyncManager runs the
+    call again as attempt once the delay is over, instead of sleeping on the pool thread.
+    """
+
+    def __init__(self, delay: float, attempt: int):
+        super().__init__(f"Retry {attempt} in {delay:.1f}s")
+        self.delay = delay
+        self.attempt = attempt
+
+
+@contextlib.contextmanager
+def scheduled_attempt(attempt: int):
+    """Runs the requests of the block as attempt, retried by raising RetryScheduled"""
+    _scheduled.attempt = attempt
+    try:
+        yield
+    finally:
+        del _scheduled.attempt
+
+
+def current_scheduled_attempt() -> Optional[int]:
+    """Attempt of the requests made on this thread, None when their retries can't be scheduled"""
+    return getattr(_scheduled, "attempt", None)
+
+
+def is_idempotent(method: str, url: str) -> bool:
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    path = urlparse(url).path
+    return any(pattern.search(path) for pattern in IDEMPOTENT_POSTS)
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def error_reason(error: Exception) -> Exception:
+    """The error behind the urllib3 MaxRetryError wrapping it, if any"""
+    return getattr(error, "reason", None) if isinstance(error, urllib3.exceptions.MaxRetryError) else error
+
+
+def never_received(status: Optional[int], error: Exception) -> bool:
+    """The request was refused before being processed, or its connection could not be opened"""
+    if status in REFUSED_STATUSES:
+        return True
+    # Transport failures reach the callers as ApiException(status=0) raised from the urllib3 error
+    return isinstance(error_reason(getattr(error, "__cause__", None) or error), urllib3.exceptions.ConnectTimeoutError)
+
+
+class RetryPolicy:
+    """
+    Which failures of a request are retried and how long to wait before each attempt.
+    Requests refused with 429/503 or whose connection could not be opened were not
+    processed and are always retried, other transient failures only for idempotent requests.
+    """
+
+    def __init__(self, attempts: int, base_delay: float, max_delay: float):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def from_settings() -> 'RetryPolicy':
+        return RetryPolicy(PluginSettings.int_value(HTTP_RETRY_ATTEMPTS), PluginSettings.float_value(HTTP_RETRY_BASE_DELAY),
+                           PluginSettings.float_value(HTTP_RETRY_MAX_DELAY))
+
+    def retry_reason(self, method: str, url: str, attempt: int, status: int = None, error: Exception = None) -> Optional[str]:
+        """Name of the retried failure, None when the attempt must not be retried. attempt starts at 1."""
+        if attempt >= self.attempts:
+            return None
+        if status in REFUSED_STATUSES:
+            return f"http_{status}"
+        reason = error_reason(error) if error is not None else None
+        if isinstance(reason, urllib3.exceptions.ConnectTimeoutError):
+            return "connect_error"
+        if not is_idempotent(method, url):
+            return None
+        if status in RETRY_STATUSES:
+            return f"http_{status}"
+        if isinstance(reason, (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ProtocolError)):
+            return "read_error"
+        return None
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before the attempt after attempt, Retry-After when the server sent one"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
@@ -0,0 +1,116 @@
+"""
+Layers backed by a web service that CartoVista can read itself, published by reference
+to the service instead of uploading a copy of their features
+"""
+
+import xml.etree.ElementTree as ElementTree
+from typing import Optional
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+from qgis.PyQt.QtCore import QUrl
+from qgis.PyQt.QtNetwork import QNetworkRequest
+from qgis.core import QgsBlockingNetworkRequest, QgsDataSourceUri, QgsFields, QgsProviderRegistry, QgsVectorLayer
+
+from .plugin_settings import PluginSettings, SERVICE_REFERENCE
+from .publish_scope import PUBLISH_ALL
+from add_to_cartovista.swagger_client.models.layer_external_service import LayerExternalService
+
+# Features per page of the OGC API Features items, CartoVista follows the next links
+OAPIF_PAGE_SIZE = 10000
+
+
+class WfsCapabilitiesError(Exception):
+    pass
+
+
+def _with_params(url: str, params: dict, removed=()) -> str:
+    """url with params, replacing the parameters of the same name and the removed ones whatever their case"""
+    parts = urlsplit(url)
+    names = {name.upper() for name in list(params) + list(removed)}
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if name.upper() not in names]
+    return urlunsplit(parts._replace(query=urlencode(query + list(params.items()))))
+
+
+def _wfs_url(uri: QgsDataSourceUri) -> Optional[str]:
+    url = uri.param("url")
+    if not url or not uri.param("typename"):
+        return None
+    # CartoVista reads GeoJSON, servers without a JSON output format make the reference fail
+    return _with_params(url, {
+        "SERVICE": "WFS",
+        "REQUEST": "GetFeature",
+        "VERSION": "2.0.0",
+        "TYPENAMES": uri.param("typename"),
+        "OUTPUTFORMAT": "application/json",
+        "SRSNAME": "EPSG:4326",
+    }, removed=("TYPENAME", "COUNT", "MAXFEATURES", "STARTINDEX"))
+
+
+def _wfs_capabilities_url(uri: QgsDataSourceUri) -> str:
+    return _with_params(uri.param("url"), {"SERVICE": "WFS", "REQUEST": "GetCapabilities", "VERSION": "2.0.0"})
+
+
+def wfs_count_default(capabilities_url: str) -> Optional[int]:
+    """
+    Most features the WFS returns for one GetFeature, its CountDefault constraint, or None
+    when it advertises no limit. Raises WfsCapabilitiesError when the capabilities can't be
+    read. Safe to call from a worker thread.
+    """
+    request = QgsBlockingNetworkRequest()
+    if request.get(QNetworkRequest(QUrl(capabilities_url))) != QgsBlockingNetworkRequest.ErrorCode.NoError:
+        raise WfsCapabilitiesError(request.errorMessage())
+    try:
+        capabilities = ElementTree.fromstring(bytes(request.reply().content()))
+    except ElementTree.ParseError as e:
+        raise WfsCapabilitiesError(f"Invalid capabilities: {e}")
+    value = capabilities.find(".//{*}Constraint[@name='CountDefault']/{*}DefaultValue")
+    if value is None or not (value.text or "").strip().isdigit():
+        return None
+    return int(value.text.strip())
+
+
+def _oapif_url(uri: QgsDataSourceUri) -> Optional[str]:
+    url = uri.param("url")
+    if not url or not uri.param("typename"):
+        return None
+    return f"{url.rstrip('/')}/collections/{quote(uri.param('typename'), safe='')}/items?" + \
+        urlencode({"f": "json", "limit": OAPIF_PAGE_SIZE})
+
+
+def service_reference(layer: QgsVectorLayer, settings: dict) -> Optional[dict]:
+    """
+    Service type and URL CartoVista can publish the layer from, or None when the layer is
+    not an ArcGIS feature service, WFS or OGC API Features layer, needs QGIS credentials,
+    or is filtered, joined or limited by the publish scope, which the reference would
+    ignore. WFS references also hold the URL of the service capabilities: CartoVista reads
+    a single GetFeature response, the layer must fit in the server limit, see
+    wfs_count_default. Main thread only.
+    """
+    if not PluginSettings.bool_value(SERVICE_REFERENCE) or settings.get("scope", PUBLISH_ALL) != PUBLISH_ALL:
+        return None
+    if layer.isModified() or layer.subsetString() or layer.vectorJoins():
+        return None
+    fields = layer.fields()
+    if any(fields.fieldOrigin(index) != QgsFields.OriginProvider for index in range(fields.count())):
+        return None
+
+    provider = layer.providerType()
+    uri = QgsDataSourceUri(layer.source())
+    if uri.authConfigId() or uri.username() or uri.hasParam("authcfg"):
+        return None
+    if provider == "arcgisfeatureserver":
+        url = QgsProviderRegistry.instance().decodeUri(provider, layer.source()).get("url")
+        service = LayerExternalService.ARCGIS
+    elif provider == "WFS":
+        url = _wfs_url(uri)
+        service = LayerExternalService.GEOJSON
+    elif provider == "OAPIF":
+        url = _oapif_url(uri)
+        service = LayerExternalService.GEOJSON
+    else:
+        return None
+    if not url:
+        return None
+    if provider == "WFS":
+        return {"service": service, "url": url, "capabilities_url": _wfs_capabilities_url(uri)}
+    return {"service": service, "url": url}
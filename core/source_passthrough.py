@@ -0,0 +1,96 @@
+"""
+Layers whose source file can be uploaded as is, without exporting them feature by feature
+"""
+
+import os.path
+from typing import List, Optional
+
+from qgis.core import QgsFields, QgsProviderRegistry, QgsVectorLayer, QgsWkbTypes
+
+from .crs_policy import CRS_MODE_NATIVE, CRS_MODE_REPROJECT, can_upload_native
+from .plugin_settings import PluginSettings, SOURCE_PASSTHROUGH, PASSTHROUGH_FORMATS
+from .publish_scope import PUBLISH_ALL
+
+# Files making up a layer of each format, the first one is the main file
+FORMAT_FILES = {
+    "GPKG": [".gpkg"],
+    "ESRI Shapefile": [".shp", ".shx", ".dbf", ".prj", ".cpg"],
+    "FlatGeobuf": [".fgb"],
+}
+# Files that must be present for the upload to hold the whole layer
+REQUIRED_FILES = {
+    "ESRI Shapefile": [".shp", ".shx", ".dbf", ".prj"],
+}
+
+
+def passthrough_formats() -> List[str]:
+    return [name.strip() for name in str(PluginSettings.value(PASSTHROUGH_FORMATS) or "").split(",") if name.strip()]
+
+
+def _single_table_geopackage(path: str) -> bool:
+    from osgeo import gdal
+    # Edits still in the write-ahead log are not in the main file
+    wal_path = path + "-wal"
+    if os.path.isfile(wal_path) and os.path.getsize(wal_path) > 0:
+        return False
+    dataset = gdal.OpenEx(path, gdal.OF_VECTOR | gdal.OF_READONLY)
+    if dataset is None:
+        return False
+    try:
+        return dataset.GetLayerCount() == 1
+    finally:
+        dataset = None
+
+
+def passthrough_files(layer: QgsVectorLayer, settings: dict) -> Optional[List[str]]:
+    """
+    Files to zip instead of exporting the layer, or None when the export would change the
+    data: the layer is not the whole of a file in an accepted format in a CRS it can be uploaded in,
+    has unsaved edits, a filter, expression fields or joins, single geometries or Z/M values,
+    or the export settings reduce its geometries, fields or features. Main thread only.
+    """
+    # Imported here, the exporter depends on LayerUploadInfo which depends on this module
+    from .geopackage_exporter import UPLOAD_CRS
+
+    if not PluginSettings.bool_value(SOURCE_PASSTHROUGH) or layer.providerType() != "ogr":
+        return None
+    driver = layer.dataProvider().storageType()
+    if driver not in FORMAT_FILES or driver not in passthrough_formats():
+        return None
+    if layer.isModified() or layer.subsetString() or layer.vectorJoins():
+        return None
+    # Other CRS are reprojected by CartoVista when the layer is always uploaded in its own CRS.
+    # In auto mode the export may reproject it, the upload would depend on the file format
+    if layer.crs().authid() != UPLOAD_CRS and (settings.get("crs_mode", CRS_MODE_REPROJECT) != CRS_MODE_NATIVE
+                                               or not can_upload_native(layer.crs())):
+        return None
+    # The export writes multi geometries without Z/M
+    wkb_type = layer.wkbType()
+    if not QgsWkbTypes.isMultiType(wkb_type) or QgsWkbTypes.hasZ(wkb_type) or QgsWkbTypes.hasM(wkb_type):
+        return None
+    fields = layer.fields()
+    if any(fields.fieldOrigin(index) != QgsFields.OriginProvider for index in range(fields.count())):
+        return None
+    if settings.get("precision") or settings.get("simplify_tolerance"):
+        return None
+    if settings.get("scope", PUBLISH_ALL) != PUBLISH_ALL:
+        return None
+    if settings.get("fields") is not None and settings["fields"] != fields.names():
+        return None
+
+    path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get("path")
+    if not path or os.path.splitext(path)[1].lower() != FORMAT_FILES[driver][0] or not os.path.isfile(path):
+        return None
+    if driver == "GPKG" and not _single_table_geopackage(path):
+        return None
+
+    base = os.path.splitext(path)[0]
+    files = [path]
+    for extension in FORMAT_FILES[driver][1:]:
+        candidates = [base + extension, base + extension.upper()]
+        existing = next((candidate for candidate in candidates if os.path.isfile(candidate)), None)
+        if existing is not None:
+            files.append(existing)
+        elif extension in REQUIRED_FILES.get(driver, []):
+            return None
+    return files
@@ -0,0 +1,411 @@
+"""
+Streaming multipart/form-data uploads for the generated swagger client
+"""
+
+import io
+import mimetypes
+import os
+import time
+import uuid
+from typing import Optional
+
+import six
+import urllib3
+from qgis.core import Qgis, QgsMessageLog
+from six.moves.urllib.parse import urlencode
+
+from add_to_cartovista.swagger_client.api_client import ApiClient as SwaggerApiClient
+from add_to_cartovista.swagger_client import rest
+
+from .artifacts import artifact_size, open_artifact
+from .http_transport import shared_pool_manager
+from .concurrency_limiter import CONCURRENCY_LIMITERS, AdaptiveLimiter, endpoint_class
+from .request_compression import compression_rejected, gzip_request_body
+from .request_timeouts import BoundedTimeout, Deadline, DeadlineExceeded, request_timeout, timeout_and_deadline
+from .retry_policy import (RETRY_STATUSES, RetryPolicy, RetryScheduled, current_scheduled_attempt, error_reason,
+                           retry_after_seconds)
+from .transport_metrics import TRANSPORT_METRICS
+
+# Largest block handed to the connection on each read of the request body
+CHUNK_SIZE = 1024 * 1024
+
+
+class MultipartFile:
+    """
+    File form field whose content stays on disk, or in /vsimem/, until the request body is sent.
+    ``offset`` and ``length`` restrict the field to a part of the file.
+    """
+    def __init__(self, path: str, filename: str = None, mimetype: str = None, offset: int = 0, length: int = None):
+        self.path = path
+        self.filename = filename or os.path.basename(path)
+        self.mimetype = mimetype or mimetypes.guess_type(self.filename)[0] or 'application/octet-stream'
+        self.offset = offset
+        self.length = length
+
+    def size(self) -> int:
+        if self.length is not None:
+            return self.length
+        return artifact_size(self.path) - self.offset
+
+    def open(self):
+        return open_artifact(self.path, 'rb', buffering=CHUNK_SIZE)
+
+
+class StreamingMultipartBody(io.RawIOBase):
+    """
+    Read-only, seekable multipart/form-data body.
+
+    Form fields are encoded up front, file fields are read from disk in blocks of
+    at most ``chunk_size`` bytes while the connection consumes the body, so memory
+    use does not depend on the size of the uploaded files.
+    """
+    def __init__(self, fields, boundary: str = None, chunk_size: int = CHUNK_SIZE):
+        super().__init__()
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self._segments = []
+        for name, value in fields:
+            if isinstance(value, tuple):
+                filename, data, mimetype = value
+                headers = (
+                    f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                    f'Content-Type: {mimetype}\r\n\r\n'
+                )
+            else:
+                data = value
+                headers = f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            self._segments.append(f'--{self.boundary}\r\n{headers}'.encode('utf-8'))
+            if isinstance(data, MultipartFile):
+                self._segments.append(data)
+            elif isinstance(data, bytes):
+                self._segments.append(data)
+            else:
+                self._segments.append(str(data).encode('utf-8'))
+            self._segments.append(b'\r\n')
+        self._segments.append(f'--{self.boundary}--\r\n'.encode('utf-8'))
+
+        self._sizes = [s.size() if isinstance(s, MultipartFile) else len(s) for s in self._segments]
+        self._length = sum(self._sizes)
+        self._position = 0
+        self._segment_index = 0
+        self._segment_offset = 0
+        self._file = None
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        offset = max(0, min(offset, self._length))
+        self._close_file()
+        self._position = offset
+        self._segment_index = 0
+        while self._segment_index < len(self._segments) and offset >= self._sizes[self._segment_index]:
+            offset -= self._sizes[self._segment_index]
+            self._segment_index += 1
+        self._segment_offset = offset
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        if size == 0:
+            return b''
+        size = min(size, self.chunk_size)
+        while self._segment_index < len(self._segments):
+            segment = self._segments[self._segment_index]
+            remaining = self._sizes[self._segment_index] - self._segment_offset
+            if remaining <= 0:
+                self._next_segment()
+                continue
+            count = min(size, remaining)
+            if isinstance(segment, MultipartFile):
+                if self._file is None:
+                    self._file = segment.open()
+                    self._file.seek(segment.offset + self._segment_offset)
+                data = self._file.read(count)
+                if not data:
+                    raise IOError(f"{segment.path} changed size while it was being uploaded")
+            else:
+                data = segment[self._segment_offset:self._segment_offset + count]
+            self._segment_offset += len(data)
+            self._position += len(data)
+            return data
+        return b''
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._close_file()
+        super().close()
+
+    def _next_segment(self):
+        self._close_file()
+        self._segment_index += 1
+        self._segment_offset = 0
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def has_streamed_files(post_params) -> bool:
+    for _, value in post_params or []:
+        if isinstance(value, tuple) and isinstance(value[1], MultipartFile):
+            return True
+    return False
+
+
+def streamed_size(post_params) -> int:
+    return sum(value[1].size() for _, value in post_params or []
+               if isinstance(value, tuple) and isinstance(value[1], MultipartFile))
+
+
+def response_status(error) -> Optional[int]:
+    """HTTP status of a failed request, None when it failed without a response"""
+    return getattr(error, 'status', None) if isinstance(error, rest.ApiException) else None
+
+
+def is_congestion(status, error) -> bool:
+    """Failures telling that the server or the network is overloaded"""
+    return status in RETRY_STATUSES or isinstance(
+        error_reason(error), (urllib3.exceptions.ConnectTimeoutError, urllib3.exceptions.ReadTimeoutError))
+
+
+def transport_error(error: urllib3.exceptions.HTTPError) -> rest.ApiException:
+    """Timeouts and connection failures fail the call like the other transport errors, with status 0"""
+    reason = error_reason(error)
+    if isinstance(reason, urllib3.exceptions.TimeoutError):
+        TRANSPORT_METRICS.add("timeouts")
+    return rest.ApiException(status=0, reason=f"{type(reason).__name__}: {reason}")
+
+
+class StreamingRESTClientObject(rest.RESTClientObject):
+    """
+    RESTClientObject that sends multipart requests containing files as a
+    StreamingMultipartBody instead of letting urllib3 encode them in memory.
+    Its connections are the shared ones of http_transport, failed requests are
+    retried according to the RetryPolicy. Requests wait for a slot of the bulk budget
+    when they upload files, of the control budget otherwise, see ConcurrencyLimiters.
+    Requests with a BoundedTimeout wait on the server processing rather than on the
+    network, they take no slot and their latency is not reported to a budget.
+    Requests without a timeout get the default one. A Deadline, or a BoundedTimeout,
+    passed as the timeout bounds the request and its retries by the deadline of the
+    publish making it. Large JSON and XML bodies are sent compressed with gzip until the
+    server rejects one, responses are accepted compressed.
+    """
+    def __init__(self, configuration):
+        self.pool_manager = shared_pool_manager(configuration)
+        self.gzip_rejected = False
+
+    def request(self, method, url, query_params=None, headers=None,
+                body=None, post_params=None, _preload_content=True,
+                _request_timeout=None):
+        headers = self._request_headers(headers)
+        bulk = has_streamed_files(post_params)
+        upload_size = streamed_size(post_params) if bulk else 0
+        limiter = None if isinstance(_request_timeout, BoundedTimeout) else \
+            CONCURRENCY_LIMITERS.bulk if bulk else CONCURRENCY_LIMITERS.control
+        endpoint = endpoint_class(method, url)
+        timeout, deadline = timeout_and_deadline(_request_timeout, upload_size)
+        policy = RetryPolicy.from_settings()
+        scheduled = current_scheduled_attempt()
+        attempt = scheduled or 1
+        while True:
+            try:
+                # The headers are changed by the multipart encoding
+                return self._limited(limiter, endpoint, bulk, upload_size, self._send, method, url, query_params=query_params,
+                                     headers=dict(headers), body=body, post_params=post_params,
+                                     _preload_content=_preload_content,
+                                     _request_timeout=request_timeout(timeout, deadline))
+            except (rest.ApiException, urllib3.exceptions.HTTPError) as e:
+                delay = self._retry_delay(policy, method, url, attempt, e, deadline)
+                if delay is None:
+                    if isinstance(e, urllib3.exceptions.HTTPError):
+                        raise transport_error(e) from e
+                    raise
+                if scheduled is not None:
+                    # Run again by the AsyncManager after the delay, the thread serves other calls meanwhile
+                    raise RetryScheduled(delay, attempt + 1) from e
+            # Calls made outside the AsyncManager wait for their retry
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _request_headers(headers) -> dict:
+        """Headers shared by the attempts of a request"""
+        headers = headers or {}
+        # Decoded by urllib3
+        headers.setdefault('Accept-Encoding', 'gzip')
+        return headers
+
+    @staticmethod
+    def _limited(limiter: Optional[AdaptiveLimiter], endpoint: str, bulk: bool, upload_size: int, send, *args, **kwargs):
+        """Calls send in a slot of limiter, and reports its latency to the limiter. Without limiter, just calls send."""
+        TRANSPORT_METRICS.add("requests")
+        if limiter is None:
+            return send(*args, **kwargs)
+        # Upload latencies are compared per MB
+        megabytes = max(1.0, upload_size / 1024 / 1024) if bulk else 1.0
+        limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = send(*args, **kwargs)
+        except (rest.ApiException, urllib3.exceptions.HTTPError) as e:
+            status = response_status(e)
+            limiter.release((time.monotonic() - started) / megabytes if status else None, is_congestion(status, e), endpoint)
+            raise
+        except BaseException:
+            limiter.release()
+            raise
+        limiter.release((time.monotonic() - started) / megabytes, endpoint=endpoint)
+        return response
+
+    @staticmethod
+    def _retry_delay(policy: RetryPolicy, method, url, attempt: int, error, deadline: Optional[Deadline]) -> Optional[float]:
+        """Seconds to wait before retrying the failed attempt, None when it is not retried"""
+        reason = policy.retry_reason(method, url, attempt, response_status(error), error)
+        response_headers = getattr(error, 'headers', None) or {}
+        delay = policy.delay(attempt, retry_after_seconds(response_headers.get('Retry-After')))
+        if isinstance(error, DeadlineExceeded) or (reason is not None and deadline is not None and delay >= deadline.remaining()):
+            TRANSPORT_METRICS.add("deadline_exceeded")
+            reason = None
+        if reason is None:
+            if attempt > 1:
+                TRANSPORT_METRICS.add("retries_exhausted" if attempt >= policy.attempts else "retries_abandoned")
+            return None
+        TRANSPORT_METRICS.add("retries")
+        TRANSPORT_METRICS.add(f"retries_{reason}")
+        TRANSPORT_METRICS.add("retry_wait_seconds", delay)
+        return delay
+
+    def _send(self, method, url, query_params=None, headers=None,
+              body=None, post_params=None, _preload_content=True,
+              _request_timeout=None):
+        if headers.get('Content-Type') == 'multipart/form-data' and has_streamed_files(post_params):
+            return self._send_multipart(method, self._full_url(url, query_params), headers, post_params,
+                                        _preload_content, _request_timeout)
+
+        compressed = None if self.gzip_rejected else gzip_request_body(method, headers, body)
+        if compressed is not None:
+            response = self._send_compressed(method, self._full_url(url, query_params), headers, compressed,
+                                             _preload_content, _request_timeout)
+            if response is not None:
+                return response
+        response = super().request(method, url, query_params=query_params, headers=headers,
+                                   body=body, post_params=post_params, _preload_content=_preload_content,
+                                   _request_timeout=_request_timeout)
+        if compressed is not None:
+            # Accepted uncompressed, the server can't read gzip bodies
+            self.gzip_rejected = True
+            TRANSPORT_METRICS.add("gzip_rejected")
+            QgsMessageLog.logMessage("The server could not read a compressed request, sending uncompressed requests from now on",
+                                     'CartoVista', Qgis.MessageLevel.Info)
+        return response
+
+    @staticmethod
+    def _full_url(url, query_params) -> str:
+        return url + '?' + urlencode(query_params) if query_params else url
+
+    def _send_multipart(self, method, url, headers, post_params, _preload_content, _request_timeout):
+        multipart_body = StreamingMultipartBody(post_params)
+        headers['Content-Type'] = multipart_body.content_type
+        headers['Content-Length'] = str(len(multipart_body))
+        try:
+            return self._pool_request(method, url, multipart_body, headers, _preload_content, _request_timeout)
+        finally:
+            multipart_body.close()
+
+    def _send_compressed(self, method, url, headers, compressed: bytes, _preload_content, _request_timeout):
+        """The response to the gzipped body, None when the server rejected the compression"""
+        compressed_headers = dict(headers, **{'Content-Type': headers.get('Content-Type', 'application/json'),
+                                              'Content-Encoding': 'gzip'})
+        try:
+            return self._pool_request(method, url, compressed, compressed_headers, _preload_content, _request_timeout)
+        except rest.ApiException as e:
+            if not compression_rejected(e):
+                raise
+            return None
+
+    def _pool_request(self, method, url, body, headers, _preload_content, _request_timeout):
+        try:
+            r = self.pool_manager.request(
+                method.upper(), url,
+                body=body,
+                preload_content=_preload_content,
+                timeout=self._timeout(_request_timeout),
+                headers=headers)
+        except urllib3.exceptions.SSLError as e:
+            msg = "{0}\n{1}".format(type(e).__name__, str(e))
+            raise rest.ApiException(status=0, reason=msg)
+
+        if _preload_content:
+            r = rest.RESTResponse(r)
+
+        if not 200 <= r.status <= 299:
+            raise rest.ApiException(http_resp=r)
+
+        return r
+
+    @staticmethod
+    def _timeout(_request_timeout):
+        if isinstance(_request_timeout, (int, float)) and _request_timeout:
+            return urllib3.Timeout(total=_request_timeout)
+        if isinstance(_request_timeout, tuple) and len(_request_timeout) == 2:
+            return urllib3.Timeout(connect=_request_timeout[0], read=_request_timeout[1])
+        return None
+
+
+class StreamingApiClient(SwaggerApiClient):
+    """
+    Swagger ApiClient whose file parameters are streamed from disk.
+
+    Used for layer_create_layer_from_zip, layer_update_from_zip, layer_append_to_layer
+    and portal_upload, which all post a zip through the `files` parameter.
+    """
+    def __init__(self, configuration=None, header_name=None, header_value=None, cookie=None):
+        super().__init__(configuration, header_name, header_value, cookie)
+        self.rest_client = StreamingRESTClientObject(self.configuration)
+
+    def prepare_post_parameters(self, post_params=None, files=None):
+        params = []
+
+        if post_params:
+            params = post_params
+
+        if files:
+            for k, v in six.iteritems(files):
+                if not v:
+                    continue
+                file_names = v if type(v) is list else [v]
+                for n in file_names:
+                    multipart_file = n if isinstance(n, MultipartFile) else MultipartFile(n)
+                    params.append(
+                        tuple([k, tuple([multipart_file.filename, multipart_file, multipart_file.mimetype])]))
+
+        return params
+
+    def sanitize_for_serialization(self, obj):
+        if isinstance(obj, MultipartFile):
+            return obj
+        return super().sanitize_for_serialization(obj)
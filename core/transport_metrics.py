@@ -0,0 +1,45 @@
+"""
+Counters of the HTTP transport, logged with the upload pipeline statistics
+"""
+
+import threading
+from collections import defaultdict
+
+from qgis.PyQt.QtCore import QCoreApplication
+
+
+class TransportMetrics:
+    """Thread safe named counters, incremented by the REST client on the network threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def add(self, name: str, amount: float = 1):
+        with self._lock:
+            self._values[name] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def summary(self) -> str:
+        values = self.snapshot()
+        if values.get("gzip_bytes_in"):
+            # Compressed size of the gzipped request bodies
+            values["gzip_ratio"] = round(values.get("gzip_bytes_out", 0) / values["gzip_bytes_in"], 3)
+        return ", ".join(f"{name} {value:g}" for name, value in sorted(values.items())) or "no requests"
+
+
+ # --- Singleton pattern using QCoreApplication ---
+def get_transport_metrics():
+    app = QCoreApplication.instance()
+    if not hasattr(app, "_cv_plugin_transport_metrics"):
+        app._cv_plugin_transport_metrics = TransportMetrics()
+    return app._cv_plugin_transport_metrics
+
+TRANSPORT_METRICS = get_transport_metrics()
@@ -0,0 +1,269 @@
+"""
+Streaming export -> compress -> upload -> style pipeline for layer uploads
+"""
+
+import time
+from collections import deque
+from functools import partial
+from typing import List, Optional
+
+from qgis.PyQt.QtCore import QObject, pyqtSignal
+from qgis.core import Qgis, QgsMessageLog
+
+from .artifacts import artifact_size
+from .async_manager import ASYNC_MANAGER
+from .concurrency_limiter import CONCURRENCY_LIMITERS
+from .layer_upload_info import LayerUploadInfo, LayerUploadStatus
+from .plugin_settings import PluginSettings, MAX_CPU_WORKERS, MAX_NETWORK_WORKERS, PIPELINE_QUEUE_SIZE
+from .request_timeouts import Deadline
+from .transport_metrics import TRANSPORT_METRICS
+
+STAGE_CHECK = "check"
+STAGE_EXPORT = "export"
+STAGE_COMPRESS = "compress"
+STAGE_UPLOAD = "upload"
+STAGE_STYLE = "style"
+STAGE_ORDER = [STAGE_CHECK, STAGE_EXPORT, STAGE_COMPRESS, STAGE_UPLOAD, STAGE_STYLE]
+
+
+class PipelineStage:
+    """
+    One step of the pipeline, with its own worker limit and a bounded input queue.
+
+    start(layer_upload_info, on_done, on_error) must call exactly one of the callbacks.
+    Layers for which skip(layer_upload_info) is True, or that already went through the
+    stage in a previous run (LayerUploadInfo.done_stages), go straight to the next stage.
+    """
+
+    def __init__(self, name: str, start, max_workers: int, queue_size=None, skip=None):
+        self.name = name
+        self.start = start
+        self.skip = skip
+        self.max_workers = max(1, max_workers)
+        self.queue_size = queue_size
+        self.queue = deque()
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.max_queue_depth = 0
+        self.busy_time = 0.0
+        self._busy_since = None
+
+    def should_skip(self, layer_upload_info: LayerUploadInfo) -> bool:
+        if self.name in layer_upload_info.done_stages:
+            return True
+        return self.skip is not None and self.skip(layer_upload_info)
+
+    def has_room(self, incoming: int) -> bool:
+        return self.queue_size is None or len(self.queue) + incoming < self.queue_size
+
+    def enqueue(self, layer_upload_info: LayerUploadInfo):
+        self.queue.append(layer_upload_info)
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+
+    def item_started(self):
+        if self.active == 0:
+            self._busy_since = time.monotonic()
+        self.active += 1
+
+    def item_done(self, success: bool, size: int = 0):
+        self.active -= 1
+        if success:
+            self.completed += 1
+            self.bytes += size
+        else:
+            self.failed += 1
+        if self.active == 0 and self._busy_since is not None:
+            self.busy_time += time.monotonic() - self._busy_since
+            self._busy_since = None
+
+    def stats(self) -> dict:
+        busy_time = self.busy_time
+        if self._busy_since is not None:
+            busy_time += time.monotonic() - self._busy_since
+        return {
+            "queue_depth": len(self.queue),
+            "max_queue_depth": self.max_queue_depth,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "busy_seconds": busy_time,
+            "layers_per_second": self.completed / busy_time if busy_time > 0 else 0.0,
+            "bytes_per_second": self.bytes / busy_time if busy_time > 0 else 0.0,
+        }
+
+
+class UploadPipeline(QObject):
+    """
+    Runs the layer uploads of a publish as a pipeline of stages connected by bounded
+    queues, so that layer k uploads while layer k+1 is compressed and layer k+2 exported.
+
+    A stage only starts a layer when the next stage's queue has room for it, which keeps
+    exported and zipped artifacts from piling up on disk when the network is the bottleneck.
+    """
+    stage_finished = pyqtSignal(str, LayerUploadInfo)
+    layer_finished = pyqtSignal(LayerUploadInfo)
+    stats_changed = pyqtSignal(dict)
+    finished = pyqtSignal()
+
+    def __init__(self, layer_upload_helper, temp_dir: str, deadline: Optional[Deadline] = None):
+        super().__init__()
+        self.layer_upload_helper = layer_upload_helper
+        self.temp_dir = temp_dir
+        self.deadline = deadline
+        self.layers_upload_info: List[LayerUploadInfo] = []
+        self._finished_count = 0
+        self._styling = {}
+        self._started_at = None
+
+        cpu_workers = PluginSettings.int_value(MAX_CPU_WORKERS)
+        network_workers = PluginSettings.int_value(MAX_NETWORK_WORKERS)
+        queue_size = PluginSettings.int_value(PIPELINE_QUEUE_SIZE)
+        has_remote_data = self._has_remote_data
+        # In STAGE_ORDER
+        self.stages = [
+            PipelineStage(STAGE_CHECK, self._start_check, network_workers),
+            PipelineStage(STAGE_EXPORT, self._start_export, cpu_workers, None, has_remote_data),
+            PipelineStage(STAGE_COMPRESS, self._start_compress, cpu_workers, queue_size, has_remote_data),
+            PipelineStage(STAGE_UPLOAD, self._start_upload, network_workers, queue_size, has_remote_data),
+            PipelineStage(STAGE_STYLE, self._start_style, network_workers, queue_size),
+        ]
+
+        self.layer_upload_helper.layer_uploaded.connect(self._on_layer_styled)
+
+    def start(self, layers_upload_info: List[LayerUploadInfo]):
+        self.layers_upload_info = list(layers_upload_info)
+        self._finished_count = 0
+        self._started_at = time.monotonic()
+        if not self.layers_upload_info:
+            self._finish()
+            return
+        for layer_upload_info in self.layers_upload_info:
+            layer_upload_info.deadline = self.deadline
+            self._enqueue(0, layer_upload_info)
+        self._pump()
+
+    def dispose(self):
+        try:
+            self.layer_upload_helper.layer_uploaded.disconnect(self._on_layer_styled)
+        except TypeError:
+            pass
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def bottleneck(self) -> str:
+        """Name of the stage that has been busy the longest"""
+        return max(self.stages, key=lambda stage: stage.stats()["busy_seconds"]).name
+
+    def _pump(self):
+        # Downstream stages first, so that they free queue room for the upstream ones
+        for index in reversed(range(len(self.stages))):
+            stage = self.stages[index]
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            while (stage.queue and stage.active < stage.max_workers
+                   and (next_stage is None or next_stage.has_room(stage.active))):
+                self._run(stage, stage.queue.popleft())
+
+    def _enqueue(self, index: int, layer_upload_info: LayerUploadInfo):
+        while index < len(self.stages) and self.stages[index].should_skip(layer_upload_info):
+            self.stage_finished.emit(self.stages[index].name, layer_upload_info)
+            index += 1
+        if index < len(self.stages):
+            self.stages[index].enqueue(layer_upload_info)
+        else:
+            self._layer_done(layer_upload_info)
+
+    def _run(self, stage: PipelineStage, layer_upload_info: LayerUploadInfo):
+        stage.item_started()
+        stage.start(
+            layer_upload_info,
+            partial(self._on_stage_done, stage, layer_upload_info),
+            partial(self._on_stage_error, stage, layer_upload_info),
+        )
+
+    def _on_stage_done(self, stage: PipelineStage, layer_upload_info: LayerUploadInfo, _=None):
+        stage.item_done(True, self._stage_bytes(stage, layer_upload_info))
+        self.stage_finished.emit(stage.name, layer_upload_info)
+        self._enqueue(self.stages.index(stage) + 1, layer_upload_info)
+        self._pump()
+        self.stats_changed.emit(self.stats())
+
+    def _on_stage_error(self, stage: PipelineStage, layer_upload_info: LayerUploadInfo, e=None):
+        stage.item_done(False)
+        layer_upload_info.status = LayerUploadStatus.FAILED
+        layer_upload_info.error = e
+        QgsMessageLog.logMessage(f"{layer_upload_info.layer_name}: {stage.name} failed: {e}", 'CartoVista', Qgis.MessageLevel.Warning)
+        self._layer_done(layer_upload_info)
+        self._pump()
+        self.stats_changed.emit(self.stats())
+
+    def _layer_done(self, layer_upload_info: LayerUploadInfo):
+        if layer_upload_info.status == LayerUploadStatus.COMPLETE:
+            self.layer_upload_helper.record_published_layer(layer_upload_info)
+        self._finished_count += 1
+        self.layer_finished.emit(layer_upload_info)
+        if self._finished_count == len(self.layers_upload_info):
+            self._finish()
+
+    def _finish(self):
+        self.dispose()
+        self._log_stats()
+        self.finished.emit()
+
+    def _log_stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        lines = [f"Upload pipeline finished in {elapsed:.1f}s, bottleneck: {self.bottleneck()}"]
+        for name, stats in self.stats().items():
+            lines.append(
+                f"  {name}: {stats['completed']} done, {stats['failed']} failed, "
+                f"max queue {stats['max_queue_depth']}, busy {stats['busy_seconds']:.1f}s, "
+                f"{stats['layers_per_second']:.2f} layers/s, {stats['bytes_per_second'] / 1024 / 1024:.2f} MB/s"
+            )
+        lines.append(f"  transport: {TRANSPORT_METRICS.summary()}")
+        lines.append("  concurrency limits: " + ", ".join(f"{name} {limit:.1f}" for name, limit in CONCURRENCY_LIMITERS.limits().items()))
+        QgsMessageLog.logMessage("\n".join(lines), 'CartoVista', Qgis.MessageLevel.Info)
+
+    @staticmethod
+    def _stage_bytes(stage: PipelineStage, layer_upload_info: LayerUploadInfo) -> int:
+        if stage.name in (STAGE_EXPORT, STAGE_COMPRESS) and layer_upload_info.size:
+            return layer_upload_info.size * 1024
+        if stage.name == STAGE_UPLOAD and layer_upload_info.zip_path:
+            try:
+                return artifact_size(layer_upload_info.zip_path)
+            except OSError:
+                return 0
+        return 0
+
+    # --- Stages ---
+
+    @staticmethod
+    def _has_remote_data(layer_upload_info: LayerUploadInfo) -> bool:
+        """Unchanged since the last publish, or published from its service"""
+        return layer_upload_info.reuse_remote_layer or layer_upload_info.published_by_reference
+
+    def _start_check(self, layer_upload_info: LayerUploadInfo, on_done, on_error):
+        on_checked = partial(self.layer_upload_helper.publish_by_reference, layer_upload_info, on_done)
+        self.layer_upload_helper.check_published_layer(layer_upload_info, on_checked, on_error)
+
+    def _start_export(self, layer_upload_info: LayerUploadInfo, on_done, on_error):
+        ASYNC_MANAGER.setup_cpu_thread(on_done, on_error, self.layer_upload_helper.create_geopackage, layer_upload_info, self.temp_dir)
+
+    def _start_compress(self, layer_upload_info: LayerUploadInfo, on_done, on_error):
+        ASYNC_MANAGER.setup_cpu_thread(on_done, on_error, self.layer_upload_helper.zip_geopackage, self.temp_dir, layer_upload_info)
+
+    def _start_upload(self, layer_upload_info: LayerUploadInfo, on_done, on_error):
+        def _on_uploaded(upload_response):
+            self.layer_upload_helper.set_uploaded_layer(layer_upload_info, upload_response)
+            on_done()
+        self.layer_upload_helper.upload_layer_data(layer_upload_info, _on_uploaded, on_error)
+
+    def _start_style(self, layer_upload_info: LayerUploadInfo, on_done, on_error):
+        self._styling[id(layer_upload_info)] = on_done
+        self.layer_upload_helper.style_layer(layer_upload_info)
+
+    def _on_layer_styled(self, layer_upload_info: LayerUploadInfo):
+        on_done = self._styling.pop(id(layer_upload_info), None)
+        if on_done is not None:
+            on_done()
@@ -0,0 +1,123 @@
+"""
+Fields of a layer that are uploaded to CartoVista, and their integer types narrowed to the data
+"""
+
+import re
+from typing import List, Optional
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsExpression, QgsFeatureRequest, QgsField, QgsFields, QgsVectorLayer
+
+from .plugin_settings import PluginSettings, PRUNE_ATTRIBUTES, KEEP_FIELDS, NARROW_FIELD_TYPES
+
+# Layer custom properties overriding the plugin settings for one layer
+PRUNE_ATTRIBUTES_PROPERTY = "add_to_cartovista/prune_attributes"
+KEEP_FIELDS_PROPERTY = "add_to_cartovista/keep_fields"
+
+# Expressions embedded in map tips, [% "field" || 'text' %]
+MAP_TIP_EXPRESSION = re.compile(r"\[%(.*?)%\]", re.DOTALL)
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+def _split_names(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(name).strip() for name in value if str(name).strip()]
+    return [name.strip() for name in str(value).split(",") if name.strip()]
+
+
+def _expression_fields(expression: str) -> set:
+    if not expression:
+        return set()
+    return set(QgsExpression(expression).referencedColumns())
+
+
+def used_fields(layer: QgsVectorLayer) -> set:
+    """Fields shown by the labels, the map tip (popup), the display expression or the style, and the primary key"""
+    names = set()
+    if layer.labelsEnabled() and layer.labeling() is not None and layer.labeling().type() == "simple":
+        label_settings = layer.labeling().settings()
+        if label_settings.isExpression:
+            names |= _expression_fields(label_settings.fieldName)
+        elif label_settings.fieldName:
+            names.add(label_settings.fieldName)
+    for expression in MAP_TIP_EXPRESSION.findall(layer.mapTipTemplate() or ""):
+        names |= _expression_fields(expression)
+    names |= _expression_fields(layer.displayExpression())
+    if layer.renderer() is not None:
+        names |= set(layer.renderer().usedAttributes(layer.createExpressionContext()))
+    fields = layer.fields()
+    names |= {fields.at(index).name() for index in layer.primaryKeyAttributes()}
+    return names
+
+
+def schema_settings(layer: QgsVectorLayer) -> dict:
+    """
+    Names of the uploaded fields in layer order, and whether their types are narrowed. Binary
+    fields are never uploaded, nor are fields with a hidden widget unless they are used or kept.
+    With attribute pruning, only the used fields and the kept fields are uploaded. Main thread only.
+    """
+    prune = layer.customProperty(PRUNE_ATTRIBUTES_PROPERTY)
+    prune = PluginSettings.bool_value(PRUNE_ATTRIBUTES) if prune is None \
+        else str(prune).lower() in ("1", "true", "yes", "on")
+    keep = set(_split_names(PluginSettings.value(KEEP_FIELDS))) | set(_split_names(layer.customProperty(KEEP_FIELDS_PROPERTY)))
+    used = used_fields(layer) | keep
+
+    fields = layer.fields()
+    names = []
+    for index in range(fields.count()):
+        field = fields.at(index)
+        if field.type() == QVariant.ByteArray:
+            continue
+        if field.name() not in used:
+            if prune or layer.editorWidgetSetup(index).type() == "Hidden":
+                continue
+        names.append(field.name())
+    return {
+        "fields": names,
+        "narrow_types": PluginSettings.bool_value(NARROW_FIELD_TYPES),
+    }
+
+
+def upload_field_names(layer: QgsVectorLayer) -> List[str]:
+    return schema_settings(layer)["fields"]
+
+
+def upload_fields(fields: QgsFields, indexes: List[int], feature_source, narrow: bool) -> QgsFields:
+    """
+    Fields at indexes, with 64 bit integer fields made 32 bit when all their values fit.
+    Text fields keep their declared length, the values of the layer may grow after the
+    upload. Narrowing reads the attributes of feature_source once, without geometries.
+    Safe to call from a worker thread.
+    """
+    output = [QgsField(fields.at(index)) for index in indexes]
+    long_indexes = [index for index in indexes if fields.at(index).type() == QVariant.LongLong]
+    if narrow and long_indexes:
+        fits_int32 = {index: True for index in long_indexes}
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.Flag.NoGeometry) \
+            .setSubsetOfAttributes(long_indexes)
+        for feature in feature_source.getFeatures(request):
+            attributes = feature.attributes()
+            for index in long_indexes:
+                value = attributes[index]
+                if fits_int32[index] and isinstance(value, int) and not INT32_MIN <= value <= INT32_MAX:
+                    fits_int32[index] = False
+
+        for field, index in zip(output, indexes):
+            if fits_int32.get(index):
+                field.setType(QVariant.Int)
+                field.setTypeName("integer")
+
+    result = QgsFields()
+    for field in output:
+        result.append(field)
+    return result
+
+
+def field_indexes(fields: QgsFields, names: Optional[List[str]]) -> List[int]:
+    if names is None:
+        return list(range(fields.count()))
+    return [index for index in (fields.lookupField(name) for name in names) if index >= 0]
@@ -0,0 +1,57 @@
+"""
+GeoPackage writer profile of the upload exports. CartoVista rebuilds its own indexes from
+the uploaded data and the file is thrown away after the upload, so the spatial index,
+the journal, the fsyncs and the metadata tables are work for nothing.
+"""
+
+import contextlib
+from typing import List
+
+from .plugin_settings import PluginSettings, UPLOAD_WRITER_PROFILE, GPKG_PAGE_SIZE
+
+UPLOAD_LAYER_OPTIONS = ["SPATIAL_INDEX=NO"]
+# The gpkg_ogr_contents triggers update the feature count on every insert
+UPLOAD_DATASET_OPTIONS = ["METADATA_TABLES=NO", "ADD_GPKG_OGR_CONTENTS=NO"]
+
+
+def enabled() -> bool:
+    return PluginSettings.bool_value(UPLOAD_WRITER_PROFILE)
+
+
+def layer_options() -> List[str]:
+    return list(UPLOAD_LAYER_OPTIONS) if enabled() else []
+
+
+def dataset_options() -> List[str]:
+    return list(UPLOAD_DATASET_OPTIONS) if enabled() else []
+
+
+def config_options() -> dict:
+    """GDAL configuration of the SQLite connections writing the GeoPackage"""
+    options = {
+        "OGR_SQLITE_JOURNAL": "OFF",
+        "OGR_SQLITE_SYNCHRONOUS": "OFF",
+    }
+    page_size = PluginSettings.int_value(GPKG_PAGE_SIZE)
+    if page_size:
+        # Only applies to new files, before their first table
+        options["OGR_SQLITE_PRAGMA"] = f"page_size={page_size}"
+    return options
+
+
+@contextlib.contextmanager
+def upload_profile():
+    """Applies the SQLite settings of the profile to the GeoPackages created by this thread"""
+    if not enabled():
+        yield
+        return
+    from osgeo import gdal
+    options = config_options()
+    previous = {key: gdal.GetThreadLocalConfigOption(key, None) for key in options}
+    for key, value in options.items():
+        gdal.SetThreadLocalConfigOption(key, value)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            gdal.SetThreadLocalConfigOption(key, value)
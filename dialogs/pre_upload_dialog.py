@@ -5,7 +5,17 @@ CartoVista Authorization dialog
 from typing import Optional
 
 from .authorized_dialog import AuthorizedDialog
-from qgis.PyQt.QtWidgets import QWidget
+from ..core.publish_scope import PublishScope, PUBLISH_ALL, PUBLISH_EXTENT, PUBLISH_SELECTION, PUBLISH_EXPRESSION
+from qgis.PyQt.QtWidgets import QComboBox, QFormLayout, QWidget
+from qgis.core import QgsVectorLayer
+from qgis.gui import QgsExpressionLineEdit, QgsMapCanvas
+
+PUBLISH_MODES = [
+    (PUBLISH_ALL, "All features"),
+    (PUBLISH_EXTENT, "Features in the current map extent"),
+    (PUBLISH_SELECTION, "Selected features"),
+    (PUBLISH_EXPRESSION, "Features matching an expression"),
+]
 
 
 class PreUploadDialog(AuthorizedDialog):
@@ -15,7 +25,33 @@ class PreUploadDialog(AuthorizedDialog):
         
         self.setObjectName('PreUploadDialog')
 
-    def open(self, isMap: bool, mac_os_keychain_issue: bool):
+        self.publishModeCombo = QComboBox()
+        for mode, label in PUBLISH_MODES:
+            self.publishModeCombo.addItem(self.tr(label), mode)
+        self.expressionEdit = QgsExpressionLineEdit()
+        self.publishModeCombo.currentIndexChanged.connect(self._on_publish_mode_changed)
+        scope_layout = QFormLayout()
+        scope_layout.addRow(self.tr("Publish"), self.publishModeCombo)
+        scope_layout.addRow(self.tr("Expression"), self.expressionEdit)
+        self.scopeWidget = QWidget()
+        self.scopeWidget.setLayout(scope_layout)
+        self.verticalLayout.insertWidget(self.verticalLayout.indexOf(self.dialogText) + 1, self.scopeWidget)
+        self._on_publish_mode_changed()
+
+    def _on_publish_mode_changed(self, _=None):
+        is_expression = self.publishModeCombo.currentData() == PUBLISH_EXPRESSION
+        self.expressionEdit.setVisible(is_expression)
+        self.scopeWidget.layout().labelForField(self.expressionEdit).setVisible(is_expression)
+
+    def publish_scope(self, canvas: QgsMapCanvas) -> PublishScope:
+        mode = self.publishModeCombo.currentData()
+        if mode == PUBLISH_EXTENT:
+            return PublishScope(mode, canvas.extent(), canvas.mapSettings().destinationCrs())
+        if mode == PUBLISH_EXPRESSION:
+            return PublishScope(mode, expression=self.expressionEdit.expression())
+        return PublishScope(mode)
+
+    def open(self, isMap: bool, mac_os_keychain_issue: bool, layer: Optional[QgsVectorLayer] = None):
         window_title = 'Upload map to CartoVista' if isMap else 'Upload layer to CartoVista'
         self.setWindowTitle(self.tr(window_title))
         self.primaryButton.clicked.connect(self.accept)
@@ -32,6 +68,8 @@ class PreUploadDialog(AuthorizedDialog):
             '<br> Open <i>Keychain Access</i> → search "QGIS" → double-click it → ' \
             'Access Control → select "Allow all applications to access this item" → Save.</small>'
         self.dialogText.setText(dialog_text)
+        # Expressions are checked against the fields of the layer, a map mixes several layers
+        self.expressionEdit.setLayer(layer)
 
         return self.exec()
 
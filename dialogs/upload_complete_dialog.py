@@ -5,7 +5,7 @@ CartoVista Authorization dialog
 from typing import List, Optional
 
 from .authorized_dialog import AuthorizedDialog
-from qgis.PyQt.QtWidgets import QWidget
+from qgis.PyQt.QtWidgets import QWidget, QPushButton
 from qgis.PyQt.QtGui import QDesktopServices
 from qgis.PyQt.QtCore import QUrl, pyqtSignal
 
@@ -17,6 +17,7 @@ class UploadCompleteDialog(AuthorizedDialog):
     """
 
     create_map_from_layer = pyqtSignal()
+    retry_failed_layers = pyqtSignal()
     def __init__(self, parent: Optional[QWidget] = None):
         super().__init__(parent)
 
@@ -29,6 +30,11 @@ class UploadCompleteDialog(AuthorizedDialog):
         self.secondaryButton.clicked.connect(self.close)
         self.secondaryButton.setText("Close")
 
+        self.retryButton = QPushButton("Retry failed layers")
+        self.retryButton.setVisible(False)
+        self.retryButton.clicked.connect(self.retry_failed_layers.emit)
+        self.horizontalLayout.insertWidget(self.horizontalLayout.indexOf(self.secondaryButton), self.retryButton)
+
     def _set_primary_button(self, isMap: bool):
         self.clear_primary_button_listeners()
         if isMap:
@@ -50,8 +56,10 @@ class UploadCompleteDialog(AuthorizedDialog):
         except TypeError:
             pass
 
-    def map_success(self, map_title: str, map_url, invalid_layer_names: List[str], failed_layer_names: List[str]):
+    def map_success(self, map_title: str, map_url, invalid_layer_names: List[str], failed_layer_names: List[str], can_retry: bool = False):
         self._set_primary_button(True)
+        self.retryButton.setText("Retry failed layers")
+        self.retryButton.setVisible(can_retry)
         self.map_url = map_url
         text = f"{map_title} has been successfully added to your CartoVista workspace."
         if (invalid_layer_names and len(invalid_layer_names) > 0):
@@ -63,18 +71,23 @@ class UploadCompleteDialog(AuthorizedDialog):
 
     def layer_success(self, layer_name: str):
         self._set_primary_button(False)
+        self.retryButton.setVisible(False)
         text = f"Layer {layer_name} has been successfully added to your CartoVista workspace."
         self.dialogText.setText(text)
         self.show()
 
-    def layer_failed(self, layer_name: str):
+    def layer_failed(self, layer_name: str, can_retry: bool = False):
         self.primaryButton.setVisible(False)
+        self.retryButton.setText("Retry")
+        self.retryButton.setVisible(can_retry)
         text = f"Upload of layer {layer_name} failed. An unexpected error occured."
         self.dialogText.setText(text)
         self.show()
 
-    def map_failed(self, map_name: str):
+    def map_failed(self, map_name: str, can_retry: bool = False):
         self.primaryButton.setVisible(False)
+        self.retryButton.setText("Retry")
+        self.retryButton.setVisible(can_retry)
         text = f"Upload of map {map_name} failed. An unexpected error occured."
         self.dialogText.setText(text)
         self.show()
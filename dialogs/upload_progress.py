@@ -49,6 +49,13 @@ class UploadProgress(AuthorizedDialog):
         self.set_maximum(4)
         self.show()
 
+    def start_sync_layer(self, layer_name):
+        text = f"Sending edits of layer {layer_name} to CartoVista..."
+        self.dialogText.setText(text)
+        self.set_progress(0)
+        self.set_maximum(1)
+        self.show()
+
         
     def set_progress(self, progress: int):
         self._progress = progress
@@ -2,22 +2,39 @@
 CartoVista QGIS plugin
 """
 
-import math
 import platform
 import re
 from add_to_cartovista.constants import DEPLOYMENT_URL
 
 from .core import (
-    ASYNC_MANAGER,
     HelperFunctions,
     LayerUploadHelper,
     LayerUploadInfo,
     LayerUploadStatus,
     generate_theme_set_group,
-    API_CLIENT
+    API_CLIENT,
+    UploadPipeline,
+    FeatureSync,
+    FeatureSyncManager,
+    PUBLISH_JOURNAL,
+    PublishJob,
+    JOB_KIND_MAP,
+    JOB_KIND_LAYER,
+    JOB_FAILED,
+    PublishScope,
+    PublishScopeError,
+    PUBLISH_SELECTION,
+    STAGE_CHECK,
+    STAGE_EXPORT,
+    STAGE_COMPRESS,
+    STAGE_UPLOAD,
+    STAGE_STYLE
 )
 
 from .authorization import AUTHORIZATION_MANAGER
+from .core.feature_sync import sync_key_problem
+from .core.layer_fingerprint import PublishRegistry
+from .core.request_timeouts import Deadline, publish_deadline
 
 from .dialogs import (
     UploadCompleteDialog,
@@ -30,13 +47,12 @@ from .dialogs import (
 
 from qgis.PyQt.QtCore import QObject, QCoreApplication, QSettings, QTranslator
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtWidgets import QAction, QMenu, QDialog
+from qgis.PyQt.QtWidgets import QAction, QMenu, QDialog, QMessageBox
 from qgis.PyQt import sip
 from qgis.core import Qgis, QgsVectorLayer, QgsLayerTreeLayer, QgsProject, QgsApplication
 from qgis.gui import QgisInterface
 
 import shutil
-import tempfile
 import os.path
 from typing import List, Optional
 from functools import partial
@@ -46,6 +62,15 @@ from add_to_cartovista.swagger_client.models.organization import Organization
 from add_to_cartovista.swagger_client.models.user import User
 from add_to_cartovista.swagger_client.models.slide import Slide
 
+# Share of the progress bar given to each pipeline stage of a layer
+STAGE_PROGRESS = {
+    STAGE_CHECK: 5,
+    STAGE_EXPORT: 10,
+    STAGE_COMPRESS: 10,
+    STAGE_UPLOAD: 65,
+    STAGE_STYLE: 10,
+}
+
 
 class CartoVistaPlugin(QObject):
     """ 
@@ -82,6 +107,12 @@ class CartoVistaPlugin(QObject):
         self.layer_upload_helper = LayerUploadHelper()
         self.master_password_dialog = MasterPasswordDialog()
         self.layer_to_upload = None
+        self.layer_to_sync = None
+        self.feature_sync: Optional[FeatureSync] = None
+        self.feature_sync_manager = FeatureSyncManager()
+        self.upload_pipeline: Optional[UploadPipeline] = None
+        self.publish_job: Optional[PublishJob] = None
+        self.publish_deadline: Optional[Deadline] = None
         self.temp_dir = None
         self.map_name = None
         self.organization : Optional[Organization] = None
@@ -91,6 +122,7 @@ class CartoVistaPlugin(QObject):
         AUTHORIZATION_MANAGER.authenticated.connect(self._on_authenticated)
         AUTHORIZATION_MANAGER.show_auth_dialog.connect(self.on_show_authorize_dialog)
         self.upload_complete_dialog.create_map_from_layer.connect(self.create_map_from_uploaded_layer)
+        self.upload_complete_dialog.retry_failed_layers.connect(self.retry_publish_job)
         self.master_password_dialog.accepted.connect(self.verify_master_password)
 
         self.mac_os_keychain_permission_issue = False
@@ -140,6 +172,7 @@ class CartoVistaPlugin(QObject):
         
 
         self.set_share_map_state()
+        PUBLISH_JOURNAL.purge()
 
         # Re-check whenever project layers change
         QgsProject.instance().layerTreeRoot().addedChildren.connect(self.set_share_map_state)
@@ -147,6 +180,13 @@ class CartoVistaPlugin(QObject):
         QgsProject.instance().layersAdded.connect(self.set_share_map_state) #needed since layerTreeRoot().addedChildren does not fire when opening a project
         QgsProject.instance().layerTreeRoot().visibilityChanged.connect(self.set_share_map_state)
         self.share_layer_action = None
+        self.sync_layer_action = None
+
+        # Record the edits of published layers so that they can be synced without a full upload
+        self.feature_sync_manager.track_published_layers()
+        QgsProject.instance().layersAdded.connect(self.feature_sync_manager.track_layers)
+        QgsProject.instance().readProject.connect(self.feature_sync_manager.track_published_layers)
+        QgsProject.instance().layersWillBeRemoved.connect(self.feature_sync_manager.untrack)
         
         try:
             self.iface.layerTreeView().contextMenuAboutToShow.connect(self.layer_tree_view_menu)
@@ -159,6 +199,10 @@ class CartoVistaPlugin(QObject):
         self.disconnect_signal(QgsProject.instance().layerTreeRoot().visibilityChanged, self.set_share_map_state)
         self.disconnect_signal(QgsProject.instance().layerTreeRoot().addedChildren, self.set_share_map_state)
         self.disconnect_signal(QgsProject.instance().layerTreeRoot().removedChildren, self.set_share_map_state)
+        self.disconnect_signal(QgsProject.instance().layersAdded, self.feature_sync_manager.track_layers)
+        self.disconnect_signal(QgsProject.instance().readProject, self.feature_sync_manager.track_published_layers)
+        self.disconnect_signal(QgsProject.instance().layersWillBeRemoved, self.feature_sync_manager.untrack)
+        self.feature_sync_manager.dispose()
 
         if self.cartovista_web_menu and not sip.isdeleted(self.cartovista_web_menu):
             self.cartovista_web_menu.deleteLater()
@@ -172,60 +216,230 @@ class CartoVistaPlugin(QObject):
             self.share_layer_action.deleteLater()
         self.share_layer_action = None
 
+        if self.sync_layer_action and not sip.isdeleted(self.sync_layer_action):
+            self.sync_layer_action.deleteLater()
+        self.sync_layer_action = None
+
     def open_upload_map_dialog(self):
         self.close_all_dialogs()
+        job = PUBLISH_JOURNAL.unfinished_job(JOB_KIND_MAP, API_CLIENT.tenant_url_code)
+        if job is not None and self.ask_resume_publish_job(job):
+            self.resume_publish_job(job)
+            return
         result = self.pre_upload_dialog.open(True, self.mac_os_keychain_permission_issue)
         if result == QDialog.DialogCode.Accepted:
-            self.upload_map()
+            scope = self._publish_scope()
+            if scope is not None:
+                self.upload_map(scope)
     
     def upload_map_pre_dialog(self):
         self.layer_to_upload = None
+        self.layer_to_sync = None
         self.verify_master_password()
 
     def upload_layer_pre_dialog(self, layer_id):
         self.layer_to_upload = layer_id
+        self.layer_to_sync = None
+        self.verify_master_password()
+
+    def sync_layer_pre_dialog(self, layer):
+        self.layer_to_upload = None
+        self.layer_to_sync = layer
         self.verify_master_password()
 
     def open_upload_layer_dialog(self):
         self.close_all_dialogs()
-        result = self.pre_upload_dialog.open(False, self.mac_os_keychain_permission_issue)
+        job = PUBLISH_JOURNAL.unfinished_job(JOB_KIND_LAYER, API_CLIENT.tenant_url_code)
+        if job is not None and [row["qgis_id"] for row in job.layer_rows()] == [self.layer_to_upload.id()] and self.ask_resume_publish_job(job):
+            self.resume_publish_job(job)
+            return
+        result = self.pre_upload_dialog.open(False, self.mac_os_keychain_permission_issue, self.layer_to_upload)
         if result == QDialog.DialogCode.Accepted:
-            self.upload_single_layer(self.layer_to_upload)
+            scope = self._publish_scope()
+            if scope is None:
+                return
+            if scope.mode == PUBLISH_SELECTION and not self.layer_to_upload.selectedFeatureCount():
+                self.iface.messageBar().pushMessage(f"No feature of {self.layer_to_upload.name()} is selected", level=Qgis.MessageLevel.Warning)
+                return
+            self.upload_single_layer(self.layer_to_upload, scope)
+
+    def _publish_scope(self) -> Optional[PublishScope]:
+        """Features to publish chosen in the pre upload dialog, None if the choice is invalid"""
+        scope = self.pre_upload_dialog.publish_scope(self.iface.mapCanvas())
+        try:
+            scope.validate()
+        except PublishScopeError as e:
+            self.iface.messageBar().pushMessage(str(e), level=Qgis.MessageLevel.Warning)
+            return None
+        return scope
         
 
-    def upload_single_layer(self, layer: Optional[QgsVectorLayer] = None):
-        # Create temp directory
-        # Create a directory inside C:\Users\USENAME\AppData\Local\Temp for windows
-        self.temp_dir = tempfile.mkdtemp(None, 'cartovista_qgisplugin_', None)
-        layer_info = LayerUploadInfo(layer)
+    def upload_single_layer(self, layer: Optional[QgsVectorLayer] = None, scope: Optional[PublishScope] = None):
+        try:
+            layer_info = LayerUploadInfo(layer, scope)
+        except PublishScopeError as e:
+            self.iface.messageBar().pushMessage(f"{layer.name()}: {e}", level=Qgis.MessageLevel.Warning)
+            return
+        self._start_publish_job(JOB_KIND_LAYER, layer_info.layer_name, [layer_info], scope)
         self.upload_progress_dialog.start_upload_layer(layer_info.layer_name)
-        self.layer_upload_helper.layers_upload_info = [layer_info]
-        ASYNC_MANAGER.setup_thread(self._upload_single_layer_2, self._on_upload_single_layer_error, self.layer_upload_helper.create_geopackage, self.layer_upload_helper.layers_upload_info[0], self.temp_dir)
-    
-    def _upload_single_layer_2(self):
-        self.upload_progress_dialog.set_progress(1)
-        ASYNC_MANAGER.setup_thread(self._upload_single_layer_3, self._on_upload_single_layer_error, self.layer_upload_helper.zip_geopackage, self.temp_dir, self.layer_upload_helper.layers_upload_info[0])
-
-    def _upload_single_layer_3(self):
-        self.upload_progress_dialog.set_progress(2)
-        self.layer_upload_helper.layer_uploaded.connect(self._on_upload_single_layer_success)
-        self.layer_upload_helper.layer_upload_failed.connect(self._on_upload_single_layer_error)
-        self.layer_upload_helper.upload_layer(self.layer_upload_helper.layers_upload_info[0])
+        self.upload_progress_dialog.set_maximum(sum(STAGE_PROGRESS.values()))
+        self._start_upload_pipeline(self._on_upload_single_layer_stage_finished, self._on_upload_single_layer_finished)
+
+    def _on_upload_single_layer_stage_finished(self, stage: str, _):
+        self.upload_progress_dialog.set_progress(self.upload_progress_dialog.get_progress() + STAGE_PROGRESS[stage])
+
+    def _on_upload_single_layer_finished(self):
+        self._dispose_upload_pipeline()
+        layer_upload_info = self.layer_upload_helper.layers_upload_info[0]
+        if layer_upload_info.status == LayerUploadStatus.COMPLETE:
+            self._on_upload_single_layer_success(layer_upload_info)
+        else:
+            self._on_upload_single_layer_error(None)
     
     def _on_upload_single_layer_success(self, layer_upload_info: LayerUploadInfo):
-        self.upload_progress_dialog.set_progress(4)
-        self.delete_temp_folder()
-        self.disconnect_signal(self.layer_upload_helper.layer_uploaded, self._on_upload_single_layer_success)
-        self.disconnect_signal(self.layer_upload_helper.layer_upload_failed, self._on_upload_single_layer_error)
+        self.upload_progress_dialog.set_progress(self.upload_progress_dialog.get_maximum())
+        self._finish_publish_job()
         self.upload_progress_dialog.close()
         self.upload_complete_dialog.layer_success(layer_upload_info.layer_name)
 
     def _on_upload_single_layer_error(self, _):
         layer_upload_info = self.layer_upload_helper.layers_upload_info[0]
-        self.disconnect_signal(self.layer_upload_helper.layer_uploaded, self._on_upload_single_layer_success)
-        self.disconnect_signal(self.layer_upload_helper.layer_upload_failed, self._on_upload_single_layer_error)
+        can_retry = self._keep_publish_job()
         self.upload_progress_dialog.close()
-        self.upload_complete_dialog.layer_failed(layer_upload_info.layer_name)
+        self.upload_complete_dialog.layer_failed(layer_upload_info.layer_name, can_retry)
+
+    def _start_upload_pipeline(self, on_stage_finished, on_finished):
+        self.upload_pipeline = UploadPipeline(self.layer_upload_helper, self.temp_dir, self.publish_deadline)
+        self.upload_pipeline.stage_finished.connect(on_stage_finished)
+        self.upload_pipeline.layer_finished.connect(self._on_pipeline_layer_finished)
+        if self.publish_job is not None:
+            self.upload_pipeline.stage_finished.connect(self.publish_job.on_stage_finished)
+        self.upload_pipeline.finished.connect(on_finished)
+        self.upload_pipeline.start(self.layer_upload_helper.layers_upload_info)
+
+    def _on_pipeline_layer_finished(self, layer_upload_info: LayerUploadInfo):
+        if (layer_upload_info.status == LayerUploadStatus.COMPLETE and layer_upload_info.scope.is_all
+                and not layer_upload_info.published_by_reference):
+            self.feature_sync_manager.layer_published(layer_upload_info.layer)
+        if self.publish_job is not None:
+            upload_state = self.layer_upload_helper.chunked_upload_state(layer_upload_info)
+            self.publish_job.record_layer(layer_upload_info, upload_state=upload_state, error=layer_upload_info.error)
+        # Failed layers of a journaled publish keep their artifacts on disk for the retry,
+        # in-memory ones are not reused and are released with the others
+        self.layer_upload_helper.release_artifacts(layer_upload_info)
+
+    def _start_publish_job(self, kind: str, name: str, layers_upload_info: List[LayerUploadInfo], scope: Optional[PublishScope] = None):
+        """Journals the publish, its export artifacts go to the job folder in the profile"""
+        self.publish_deadline = publish_deadline()
+        self.publish_job = PUBLISH_JOURNAL.create_job(kind, name, API_CLIENT.tenant_url_code, scope)
+        self.publish_job.add_layers(layers_upload_info)
+        self.temp_dir = self.publish_job.artifact_dir
+        self.layer_upload_helper.layers_upload_info = layers_upload_info
+
+    def _finish_publish_job(self):
+        """Everything was published, the job and its artifacts are not needed anymore"""
+        self.publish_deadline = None
+        if self.publish_job is not None:
+            self.publish_job.discard()
+            self.publish_job = None
+            self.temp_dir = None
+        for layer_upload_info in self.layer_upload_helper.layers_upload_info:
+            self.layer_upload_helper.release_artifacts(layer_upload_info)
+        self.delete_temp_folder()
+
+    def _keep_publish_job(self) -> bool:
+        """Keeps the job and its artifacts to retry the failed layers, returns False if there is no job"""
+        self.publish_deadline = None
+        self.temp_dir = None
+        if self.publish_job is None:
+            return False
+        self.publish_job.set_status(JOB_FAILED)
+        return True
+
+    def ask_resume_publish_job(self, job: PublishJob) -> bool:
+        answer = QMessageBox.question(
+            self.iface.mainWindow(),
+            self.tr('Add to CartoVista'),
+            self.tr(f"The upload of {job.name} did not complete. Resume it? Layers already uploaded will not be uploaded again."),
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            return True
+        job.discard()
+        return False
+
+    def retry_publish_job(self):
+        self.upload_complete_dialog.close()
+        if self.publish_job is not None:
+            self.resume_publish_job(self.publish_job)
+
+    def resume_publish_job(self, job: PublishJob):
+        """Runs the job again for its layers that did not complete"""
+        layers_upload_info = job.restore_layers()
+        if not layers_upload_info:
+            job.discard()
+            self.iface.messageBar().pushMessage(f"The layers of {job.name} are not in the project anymore", level=Qgis.MessageLevel.Warning)
+            return
+        self.close_all_dialogs()
+        self.publish_deadline = publish_deadline()
+        self.publish_job = job
+        self.temp_dir = job.artifact_dir
+        self.map_name = job.name
+        self.layer_upload_helper.layers_upload_info = layers_upload_info
+        self.layer_upload_helper.invalid_layer_names = []
+        if job.kind == JOB_KIND_MAP:
+            self.upload_progress_dialog.start_upload_map(job.name)
+            self.upload_progress_dialog.set_maximum(len(layers_upload_info) * sum(STAGE_PROGRESS.values()))
+            self._start_upload_pipeline(self._on_layer_stage_finished_for_upload_map, self._on_layers_uploaded_for_upload_map)
+        else:
+            self.upload_progress_dialog.start_upload_layer(job.name)
+            self.upload_progress_dialog.set_maximum(sum(STAGE_PROGRESS.values()))
+            self._start_upload_pipeline(self._on_upload_single_layer_stage_finished, self._on_upload_single_layer_finished)
+
+    def sync_layer(self, layer: QgsVectorLayer):
+        tracker = self.feature_sync_manager.tracker(layer.id())
+        record = PublishRegistry.get(layer.id(), API_CLIENT.tenant_url_code)
+        problem = sync_key_problem(layer)
+        if record is not None and problem is not None:
+            self.iface.messageBar().pushMessage(f"{layer.name()} can't be synced, {problem}. Share the layer instead", level=Qgis.MessageLevel.Warning)
+            return
+        if tracker is None or record is None:
+            self.iface.messageBar().pushMessage(f"{layer.name()} was not published to this organization, share the layer instead", level=Qgis.MessageLevel.Warning)
+            return
+        self.close_all_dialogs()
+        self.upload_progress_dialog.start_sync_layer(layer.name())
+        self.feature_sync = FeatureSync(tracker, record)
+        self.feature_sync.progress.connect(self._on_sync_layer_progress)
+        self.feature_sync.finished.connect(self._on_sync_layer_finished)
+        self.feature_sync.failed.connect(self._on_sync_layer_failed)
+        self.feature_sync.start()
+
+    def _on_sync_layer_progress(self, done: int, total: int):
+        self.upload_progress_dialog.set_maximum(max(1, total))
+        self.upload_progress_dialog.set_progress(done)
+
+    def _on_sync_layer_finished(self, count: int):
+        layer_name = self.feature_sync.layer.name()
+        self._dispose_feature_sync()
+        self.upload_progress_dialog.close()
+        self.iface.messageBar().pushMessage(f"{count} changes of {layer_name} sent to CartoVista", level=Qgis.MessageLevel.Success)
+
+    def _on_sync_layer_failed(self, e: Exception):
+        layer_name = self.feature_sync.layer.name()
+        self._dispose_feature_sync()
+        self.upload_progress_dialog.close()
+        self.iface.messageBar().pushMessage(f"Failed to send the changes of {layer_name} to CartoVista", str(e), level=Qgis.MessageLevel.Critical)
+
+    def _dispose_feature_sync(self):
+        if self.feature_sync is not None:
+            self.feature_sync.deleteLater()
+        self.feature_sync = None
+
+    def _dispose_upload_pipeline(self):
+        if self.upload_pipeline is not None:
+            self.upload_pipeline.dispose()
+            self.upload_pipeline.deleteLater()
+        self.upload_pipeline = None
 
     def get_map_name(self, layer_names: Optional[list] = None):
         # Get the current project instance
@@ -244,7 +458,7 @@ class CartoVistaPlugin(QObject):
         title_cleaned = re.sub(r'\s*[-—]\s*QGIS\b.*$', '', window_title).lstrip('*')
         self.map_name = title_cleaned
 
-    def upload_map(self):
+    def upload_map(self, scope: Optional[PublishScope] = None):
 
         def is_layer_visible(layer):
             layer_tree_root = QgsProject.instance().layerTreeRoot()
@@ -253,71 +467,53 @@ class CartoVistaPlugin(QObject):
                 return layer.id() in checked_ids
             return False        
         layers = list(filter(is_layer_visible, self.iface.mapCanvas().layers())) 
+        if scope is not None and scope.mode == PUBLISH_SELECTION:
+            # Only the layers with a selection
+            layers = [layer for layer in layers if isinstance(layer, QgsVectorLayer) and layer.selectedFeatureCount()]
         
         if not layers:
             self.iface.messageBar().pushMessage("No layer selected for uplaod", level=Qgis.MessageLevel.Warning)
             return
+        scope_errors = self.layer_upload_helper.create_layers_info_for_map_upload(layers, scope)
+        for message in scope_errors:
+            self.iface.messageBar().pushMessage(message, level=Qgis.MessageLevel.Warning)
+        if scope_errors and not self.layer_upload_helper.layers_upload_info:
+            return
         self.get_map_name()
         self.upload_progress_dialog.start_upload_map(self.map_name)
-        self.temp_dir = tempfile.mkdtemp(None, 'cartovista_qgisplugin_', None)
-
-        self.layer_upload_helper.create_layers_info_for_map_upload(layers)
-        ASYNC_MANAGER.setup_thread(self._upload_map_2, self._on_map_creation_failed, self._upload_map_create_geopackages)
-        
-    def _upload_map_create_geopackages(self):
-        maxProgress = 0
-        currentProgress = 0
-        for layer_upload_info in self.layer_upload_helper.layers_upload_info:
-            self.layer_upload_helper.create_geopackage(layer_upload_info, self.temp_dir)
-            maxProgress += math.floor(layer_upload_info.size * 1.2 * 1.1)
-            currentProgress += math.floor(layer_upload_info.size * 0.1)
-        return (maxProgress, currentProgress)
-
-    def _upload_map_2(self, progress_bar_info):
-        maxProgress = progress_bar_info[0]
-        currentProgress = progress_bar_info[1]
 
-        self.upload_progress_dialog.set_maximum(maxProgress)
-        self.upload_progress_dialog.set_progress(currentProgress)
-
-        self.layer_upload_helper.layer_uploaded.connect(self._on_layer_uploaded_for_upload_map)
-        self.layer_upload_helper.layer_upload_failed.connect(self._on_layer_failed_for_upload_map)
-        for layer_upload_info in self.layer_upload_helper.layers_upload_info:
-            ASYNC_MANAGER.setup_thread(self._on_layer_zipped_for_upload_map, self._on_map_creation_failed, self.layer_upload_helper.zip_geopackage, self.temp_dir, layer_upload_info)
+        self._start_publish_job(JOB_KIND_MAP, self.map_name, self.layer_upload_helper.layers_upload_info, scope)
+        self.upload_progress_dialog.set_maximum(len(self.layer_upload_helper.layers_upload_info) * sum(STAGE_PROGRESS.values()))
+        self._start_upload_pipeline(self._on_layer_stage_finished_for_upload_map, self._on_layers_uploaded_for_upload_map)
 
-    def _on_layer_zipped_for_upload_map(self, layer_upload_info):
-        currentProgress = self.upload_progress_dialog.get_progress()
-        currentProgress += math.floor(layer_upload_info.size * 0.1)
-        self.upload_progress_dialog.set_progress(currentProgress)
-        self.layer_upload_helper.upload_layer(layer_upload_info)
+    def _on_layer_stage_finished_for_upload_map(self, stage: str, _):
+        self.upload_progress_dialog.set_progress(self.upload_progress_dialog.get_progress() + STAGE_PROGRESS[stage])
 
-    def _on_layer_uploaded_for_upload_map(self, layer_upload_info: Optional[LayerUploadInfo]):
-        if layer_upload_info is not None:
-            self.upload_progress_dialog.set_progress(self.upload_progress_dialog.get_progress() + layer_upload_info.size)
+    def _on_layers_uploaded_for_upload_map(self):
+        self._dispose_upload_pipeline()
         info_complete_layers = [lui for lui in self.layer_upload_helper.layers_upload_info if lui.status == LayerUploadStatus.COMPLETE]
-        info_failed_layers = [lui for lui in self.layer_upload_helper.layers_upload_info if lui.status == LayerUploadStatus.FAILED]
-        if len(info_failed_layers) == len(self.layer_upload_helper.layers_upload_info):
-            self.disconnect_signal(self.layer_upload_helper.layer_uploaded, self._on_layer_uploaded_for_upload_map)
-            self.disconnect_signal(self.layer_upload_helper.layer_upload_failed, self._on_layer_failed_for_upload_map)
+        if len(info_complete_layers) == 0:
             self._on_map_creation_failed(None)
+            return
 
-        if len(info_failed_layers) + len(info_complete_layers) == len(self.layer_upload_helper.layers_upload_info):
-            self.disconnect_signal(self.layer_upload_helper.layer_uploaded, self._on_layer_uploaded_for_upload_map)
-            self.disconnect_signal(self.layer_upload_helper.layer_upload_failed, self._on_layer_failed_for_upload_map)
-
-            self.delete_temp_folder()
-            map_layer_parameters = []
-            for info_complete_layer in info_complete_layers:
-                map_layer_parameters.append(({
-                    "identifier": info_complete_layer.cv_id,
-                    "type": "Interactive"
-                }))
-            layer_names = [info_complete_layer.layer_name for info_complete_layer in info_complete_layers]
-            self.get_map_name(layer_names)
-            API_CLIENT.create_map_api(self.map_name, map_layer_parameters, self._update_slide, self._on_map_creation_failed)
-
-    def _on_layer_failed_for_upload_map(self, e):
-        self._on_layer_uploaded_for_upload_map(None)
+        map_layer_parameters = []
+        for info_complete_layer in info_complete_layers:
+            map_layer_parameters.append(({
+                "identifier": info_complete_layer.cv_id,
+                "type": "Interactive"
+            }))
+        if self.publish_job is not None and self.publish_job.map_identifier:
+            # The map was created by a previous run, add the layers that completed since
+            new_layer_parameters = [parameters for parameters, info in zip(map_layer_parameters, info_complete_layers) if STAGE_STYLE not in info.done_stages]
+            map_id = self.publish_job.map_identifier
+            on_added = lambda _: API_CLIENT.get_map(map_id, self._update_slide, self._on_map_creation_failed, deadline=self.publish_deadline)
+            API_CLIENT.add_layers_to_map_api(map_id, new_layer_parameters, on_added, self._on_map_creation_failed,
+                                             deadline=self.publish_deadline)
+            return
+        layer_names = [info_complete_layer.layer_name for info_complete_layer in info_complete_layers]
+        self.get_map_name(layer_names)
+        API_CLIENT.create_map_api(self.map_name, map_layer_parameters, self._update_slide, self._on_map_creation_failed,
+                                  deadline=self.publish_deadline)
 
     def create_map_from_uploaded_layer(self):
         self.upload_complete_dialog.close()
@@ -326,29 +522,39 @@ class CartoVistaPlugin(QObject):
                     "type": "Interactive"
                 }]
         self.map_name = self.layer_upload_helper.layers_upload_info[0].layer_name
-        API_CLIENT.create_map_api(self.map_name, map_layer_parameters, self._update_slide, self._on_map_creation_failed)
+        API_CLIENT.create_map_api(self.map_name, map_layer_parameters, self._update_slide, self._on_map_creation_failed,
+                                  deadline=self.publish_deadline)
 
     def _on_map_creation_success(self, cv_map: Map):
         self.map_name = cv_map.title
         self.upload_progress_dialog.set_progress(self.upload_progress_dialog.get_maximum())
         self.upload_progress_dialog.close()
         upload_failed_layer_names = [layer_info.layer_name for layer_info in self.layer_upload_helper.layers_upload_info if layer_info.status == LayerUploadStatus.FAILED]
-        self.upload_complete_dialog.map_success(self.map_name, self.construct_map_url(API_CLIENT.tenant_url_code, cv_map.vanity_url), self.layer_upload_helper.invalid_layer_names, upload_failed_layer_names)
+        if upload_failed_layer_names:
+            can_retry = self._keep_publish_job()
+        else:
+            can_retry = False
+            self._finish_publish_job()
+        self.upload_complete_dialog.map_success(self.map_name, self.construct_map_url(API_CLIENT.tenant_url_code, cv_map.vanity_url), self.layer_upload_helper.invalid_layer_names, upload_failed_layer_names, can_retry)
         self.iface.messageBar().pushMessage("Map created", level=Qgis.MessageLevel.Info)
     
     def _update_slide(self, cv_map: Map):
+        if self.publish_job is not None:
+            self.publish_job.set_map_identifier(cv_map.id)
         layers_need_slide_update = [lui for lui in self.layer_upload_helper.layers_upload_info if lui.status == LayerUploadStatus.COMPLETE and (lui.add_cv_labels or lui.opacity != 1)]
         if len(layers_need_slide_update) == 0:
             self._on_map_creation_success(cv_map)
             return
-        API_CLIENT.get_map_slides(cv_map.unique_identifier, partial(self._update_slide_2, cv_map), partial(self._on_update_slide_failed, cv_map))
+        API_CLIENT.get_map_slides(cv_map.unique_identifier, partial(self._update_slide_2, cv_map), partial(self._on_update_slide_failed, cv_map),
+                                  deadline=self.publish_deadline)
     
     def _update_slide_2(self, cv_map: Map, slides: List[Slide]):
         if len(slides) < 1: 
             self._on_map_creation_success(cv_map)
             return
         theme_set_group = generate_theme_set_group(self.layer_upload_helper.layers_upload_info)
-        API_CLIENT.update_slide_themeset(slides[0].id, theme_set_group, partial(self._on_update_slide_success, cv_map), partial(self._on_update_slide_failed, cv_map))
+        API_CLIENT.update_slide_themeset(slides[0].id, theme_set_group, partial(self._on_update_slide_success, cv_map), partial(self._on_update_slide_failed, cv_map),
+                                         deadline=self.publish_deadline)
     
     def _on_update_slide_failed(self, cv_map: Map, e):
         self._on_map_creation_success(cv_map)
@@ -357,9 +563,9 @@ class CartoVistaPlugin(QObject):
         self._on_map_creation_success(cv_map)
 
     def _on_map_creation_failed(self, e: Optional[Exception] = None):
-        self.delete_temp_folder()
+        can_retry = self._keep_publish_job()
         self.upload_progress_dialog.close()
-        self.upload_complete_dialog.map_failed(self.map_name)
+        self.upload_complete_dialog.map_failed(self.map_name, can_retry)
 
     def layer_tree_view_menu(self, menu: QMenu):
         """
@@ -393,6 +599,16 @@ class CartoVistaPlugin(QObject):
         export_menu.addAction(self.share_layer_action)        
         self.share_layer_action.triggered.connect(partial(self.upload_layer_pre_dialog, layer))
 
+        tracker = self.feature_sync_manager.tracker(layer.id())
+        if tracker is None:
+            return
+        change_count = tracker.changes.count()
+        self.sync_layer_action = QAction(self.tr(f"Sync Edits to CartoVista ({change_count} changes)"), menu)
+        self.sync_layer_action.setIcon(QIcon(GuiUtils.get_icon('icon.png')))
+        self.sync_layer_action.setEnabled(change_count > 0 and self.feature_sync is None)
+        export_menu.addAction(self.sync_layer_action)
+        self.sync_layer_action.triggered.connect(partial(self.sync_layer_pre_dialog, layer))
+
     def set_share_map_state(self, _ = None):
         supported = False
         layers = QgsProject.instance().mapLayers().values()
@@ -424,7 +640,9 @@ class CartoVistaPlugin(QObject):
         self.open_upload_dialog()
 
     def open_upload_dialog(self):
-            if self.layer_to_upload is not None:
+            if self.layer_to_sync is not None:
+                self.sync_layer(self.layer_to_sync)
+            elif self.layer_to_upload is not None:
                 self.open_upload_layer_dialog()
             else:
                 self.open_upload_map_dialog()
@@ -442,7 +660,9 @@ class CartoVistaPlugin(QObject):
     def _on_deauthenticated(self):
         self.close_all_dialogs()
         self.set_user_and_organization_in_dialogs(None, None)
-        if (self.layer_to_upload is not None):
+        if self.layer_to_sync is not None:
+            self.sync_layer_pre_dialog(self.layer_to_sync)
+        elif (self.layer_to_upload is not None):
             self.upload_layer_pre_dialog(self.layer_to_upload)
         else:
             self.upload_map_pre_dialog()
@@ -0,0 +1,106 @@
+"""
+Compares the default GeoPackage writer options with the upload writer profile of the plugin
+(core/writer_profile.py) on representative layers: export time, GeoPackage size, zip time
+and zip size, median of several runs.
+
+Run with the Python of QGIS from the plugin sources:
+    python-qgis benchmark_writer_profile.py roads.shp parcels.gpkg|layername=parcels --runs 5
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import time
+import types
+import zipfile
+
+from qgis.core import QgsApplication, QgsCoordinateTransformContext, QgsVectorFileWriter, QgsVectorLayer
+
+DEFAULT_PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_writer_profile(plugin_dir: str):
+    """
+    core/writer_profile.py loaded by path. Importing it from the plugin package would run the
+    package __init__ files, which log in and start the API client and the thread pools.
+    """
+    core_dir = os.path.join(plugin_dir, "core")
+    # Package of the relative imports of the module, without its __init__
+    package = types.ModuleType("cartovista_core")
+    package.__path__ = [core_dir]
+    sys.modules[package.__name__] = package
+    spec = importlib.util.spec_from_file_location("cartovista_core.writer_profile", os.path.join(core_dir, "writer_profile.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def export(layer: QgsVectorLayer, path: str, profile) -> float:
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.fileEncoding = "UTF-8"
+    started = time.perf_counter()
+    if profile is None:
+        error = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path, QgsCoordinateTransformContext(), options)
+    else:
+        options.datasourceOptions = profile.dataset_options()
+        options.layerOptions = profile.layer_options()
+        options.saveMetadata = False
+        with profile.upload_profile():
+            error = QgsVectorFileWriter.writeAsVectorFormatV3(layer, path, QgsCoordinateTransformContext(), options)
+    if error[0] != QgsVectorFileWriter.WriterError.NoError:
+        raise RuntimeError(f"Failed to export {layer.name()}: {error[1]}")
+    return time.perf_counter() - started
+
+
+def compress(path: str) -> float:
+    started = time.perf_counter()
+    with zipfile.ZipFile(path + ".zip", "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path, os.path.basename(path))
+    return time.perf_counter() - started
+
+
+def measure(layer: QgsVectorLayer, profile, runs: int) -> dict:
+    results = {"export": [], "zip": [], "size": 0, "zip_size": 0}
+    for run in range(runs):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, f"run{run}.gpkg")
+            results["export"].append(export(layer, path, profile))
+            results["zip"].append(compress(path))
+            results["size"] = os.path.getsize(path)
+            results["zip_size"] = os.path.getsize(path + ".zip")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="OGR data sources of the layers")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--plugin-dir", default=DEFAULT_PLUGIN_DIR, help="folder of the plugin sources, the parent of this script's folder by default")
+    args = parser.parse_args()
+
+    application = QgsApplication([], False)
+    application.initQgis()
+    writer_profile = load_writer_profile(args.plugin_dir)
+
+    print(f"{'layer':30} {'features':>10} {'profile':8} {'export s':>9} {'gpkg KB':>10} {'zip s':>7} {'zip KB':>10}")
+    for source in args.sources:
+        layer = QgsVectorLayer(source, os.path.basename(source), "ogr")
+        if not layer.isValid():
+            print(f"{source}: invalid layer, skipped")
+            continue
+        for name, profile in (("default", None), ("upload", writer_profile)):
+            results = measure(layer, profile, args.runs)
+            print(f"{layer.name()[:30]:30} {layer.featureCount():>10} {name:8} "
+                  f"{statistics.median(results['export']):>9.2f} {results['size'] / 1024:>10.0f} "
+                  f"{statistics.median(results['zip']):>7.2f} {results['zip_size'] / 1024:>10.0f}")
+
+    application.exitQgis()
+
+
+if __name__ == "__main__":
+    main()